@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文档处理性能基准测试
+生成可复现的合成语料（Word、PDF、Excel、PowerPoint），分别计时各格式的
+process_* 解析、convert_to_qa_format 和 create_word_document，
+并可与保存的基线结果对比以发现性能回退
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import zlib
+import struct
+import random
+import platform
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 结果格式版本，格式不兼容时递增
+RESULT_VERSION = 1
+
+# 语料规模预设：每种格式的文件数和单个文件的大小
+SCALES = {
+    'small': {'files': 3, 'docx_sections': 20, 'pdf_pages': 10, 'xlsx_rows': 2000, 'pptx_slides': 10,
+              'image_every': 4},
+    'medium': {'files': 10, 'docx_sections': 80, 'pdf_pages': 50, 'xlsx_rows': 20000, 'pptx_slides': 40,
+               'image_every': 3},
+    'large': {'files': 20, 'docx_sections': 300, 'pdf_pages': 200, 'xlsx_rows': 100000, 'pptx_slides': 120,
+              'image_every': 2},
+}
+
+# 格式 -> (文件扩展名, 解析方法名)
+FORMATS = {
+    'docx': ('.docx', 'process_word'),
+    'pdf': ('.pdf', 'process_pdf'),
+    'xlsx': ('.xlsx', 'process_excel'),
+    'pptx': ('.pptx', 'process_powerpoint'),
+}
+
+# 计时的阶段
+STAGES = ['handler', 'qa', 'docx']
+
+# 合成文本的词汇，包含关键词词典中的术语以覆盖关键词匹配
+PHRASES = [
+    'SRMS系统', '用户登录', 'Batch处理', 'Demand Note', '列印收据', '设置权限', '配置参数', '删除记录',
+    '更新资料', '导出报表', 'Journal入账', '解锁帐户', '修复数据', 'Occupant资料', 'Building ID',
+    'CashType设定', 'Community App', 'Facility Booking', '上传附件', '下载文件', '注册用户',
+    '管理处', '住户', '收款', '月结', '核对', '系统管理员', '浏览器', '清除缓存', '重新启动'
+]
+SQL_TEMPLATES = [
+    "SELECT * FROM receipt WHERE batch_no = '{n}';",
+    "UPDATE occupant SET status = 'A' WHERE building_id = {n};",
+    "DELETE FROM journal_tmp WHERE journal_id = {n};",
+]
+
+# 写入生成文件的固定创建时间，相同种子生成的文档元数据一致
+FIXED_TIMESTAMP = datetime(2024, 1, 1)
+
+
+def make_png(rng: random.Random, width: int = 320, height: int = 240, block: int = 16) -> bytes:
+    """生成色块PNG图片（压缩率接近界面截图），不依赖图像库"""
+    cols = (width + block - 1) // block
+    raw = bytearray()
+    for by in range(0, height, block):
+        colors = [bytes(rng.randrange(256) for _ in range(3)) for _ in range(cols)]
+        row = b'\x00' + b''.join(color * block for color in colors)[:width * 3]
+        raw += row * min(block, height - by)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(bytes(raw))) + chunk(b'IEND', b'')
+
+
+def make_sentence(rng: random.Random, min_words: int = 4, max_words: int = 10) -> str:
+    return '，'.join(rng.choice(PHRASES) for _ in range(rng.randint(min_words, max_words))) + '。'
+
+
+def make_paragraph(rng: random.Random) -> str:
+    """随机生成一段文本，部分段落包含问题、步骤或SQL"""
+    kind = rng.randrange(4)
+    if kind == 0:
+        return f"问题：{make_sentence(rng, 2, 4)}解决方法：{make_sentence(rng)}"
+    if kind == 1:
+        return ''.join(f"步骤{i}：{make_sentence(rng, 2, 5)}" for i in range(1, rng.randint(3, 6)))
+    if kind == 2:
+        return make_sentence(rng) + rng.choice(SQL_TEMPLATES).format(n=rng.randint(1, 99999))
+    return make_sentence(rng) + make_sentence(rng)
+
+
+def generate_docx(path: Path, rng: random.Random, scale: Dict[str, int]):
+    """生成含标题、段落、表格和图片的Word文档"""
+    from docx import Document
+    from docx.shared import Inches
+
+    doc = Document()
+    for i in range(scale['docx_sections']):
+        doc.add_heading(f"{i + 1}. {rng.choice(PHRASES)}", level=1)
+        for _ in range(rng.randint(2, 4)):
+            doc.add_paragraph(make_paragraph(rng))
+        if i % 3 == 0:
+            table = doc.add_table(rows=8, cols=4)
+            for r, row in enumerate(table.rows):
+                for c, cell in enumerate(row.cells):
+                    cell.text = f"字段{c + 1}" if r == 0 else rng.choice(PHRASES)
+        if i % scale['image_every'] == 0:
+            doc.add_picture(io.BytesIO(make_png(rng)), width=Inches(3))
+    doc.core_properties.created = doc.core_properties.modified = FIXED_TIMESTAMP
+    doc.save(path)
+
+
+def generate_pdf(path: Path, rng: random.Random, scale: Dict[str, int]):
+    """生成多页PDF，每页有文本，部分页面复用同一图片（覆盖xref去重）"""
+    try:
+        import pymupdf as fitz
+    except ImportError:
+        import fitz
+
+    doc = fitz.open()
+    shared_xref = None
+    for i in range(scale['pdf_pages']):
+        page = doc.new_page()
+        text = '\n'.join(make_paragraph(rng) for _ in range(6))
+        page.insert_textbox(fitz.Rect(50, 50, 545, 500), text, fontname='china-s', fontsize=10)
+        if i % scale['image_every'] == 0:
+            rect = fitz.Rect(50, 520, 370, 760)
+            if shared_xref and i % (scale['image_every'] * 2) == 0:
+                page.insert_image(rect, xref=shared_xref)
+            else:
+                xref = page.insert_image(rect, stream=make_png(rng))
+                shared_xref = shared_xref or xref
+    doc.set_metadata({'creationDate': 'D:20240101000000', 'modDate': 'D:20240101000000'})
+    doc.save(path, no_new_id=True)
+    doc.close()
+
+
+def generate_xlsx(path: Path, rng: random.Random, scale: Dict[str, int]):
+    """生成两个工作表的大表（只写模式）"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for sheet_num in range(2):
+        sheet = workbook.create_sheet(f"数据{sheet_num + 1}")
+        sheet.append(['编号', '日期', '住户', '项目', '金额', '备注'])
+        for row in range(scale['xlsx_rows'] // 2):
+            sheet.append([row + 1, f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                          rng.choice(PHRASES), rng.choice(PHRASES), round(rng.uniform(10, 5000), 2),
+                          make_sentence(rng, 1, 3)])
+    workbook.properties.created = workbook.properties.modified = FIXED_TIMESTAMP
+    workbook.save(path)
+
+
+def generate_pptx(path: Path, rng: random.Random, scale: Dict[str, int]):
+    """生成含标题、正文和图片的幻灯片"""
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    prs = Presentation()
+    layout = prs.slide_layouts[1]
+    for i in range(scale['pptx_slides']):
+        slide = prs.slides.add_slide(layout)
+        slide.shapes.title.text = f"{i + 1}. {rng.choice(PHRASES)}"
+        slide.placeholders[1].text = '\n'.join(make_paragraph(rng) for _ in range(3))
+        if i % scale['image_every'] == 0:
+            slide.shapes.add_picture(io.BytesIO(make_png(rng)), Inches(5), Inches(4), width=Inches(4))
+    prs.core_properties.created = prs.core_properties.modified = FIXED_TIMESTAMP
+    prs.save(path)
+
+
+GENERATORS = {
+    'docx': generate_docx,
+    'pdf': generate_pdf,
+    'xlsx': generate_xlsx,
+    'pptx': generate_pptx,
+}
+
+
+def generate_corpus(corpus_dir: str, scale: str = 'small', seed: int = 42,
+                    formats: Optional[List[str]] = None) -> Dict[str, Any]:
+    """生成合成语料；相同规模和种子的语料已存在时直接复用"""
+    corpus_dir = Path(corpus_dir)
+    formats = formats or list(FORMATS)
+    meta = {'scale': scale, 'seed': seed, 'params': SCALES[scale], 'formats': sorted(formats)}
+
+    meta_path = corpus_dir / 'corpus.json'
+    if meta_path.exists():
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == meta:
+                logger.info(f"复用已有语料: {corpus_dir}")
+                return meta
+
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    for fmt in formats:
+        ext = FORMATS[fmt][0]
+        for i in range(SCALES[scale]['files']):
+            # 每个文件使用独立的随机序列，生成结果与格式顺序无关
+            rng = random.Random(f"{seed}-{fmt}-{i}")
+            GENERATORS[fmt](corpus_dir / f"bench_{i:03d}{ext}", rng, SCALES[scale])
+
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    logger.info(f"已生成语料: {corpus_dir}（耗时 {time.perf_counter() - started:.1f} s）")
+    return meta
+
+
+def _peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存（MB）
+
+    Linux下读取 /proc 中的 VmHWM：ru_maxrss 在exec后仍保留父进程的峰值，
+    新启动的子进程无法据此单独统计。
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _bench_format(corpus_dir: str, fmt: str, repeat: int) -> Dict[str, Any]:
+    """在独立进程中计时一种格式（峰值内存只反映该格式的处理）"""
+    logging.getLogger().setLevel(logging.WARNING)
+    from document_processor import DocumentProcessor, load_backend, FORMAT_BACKENDS
+
+    ext, handler_name = FORMATS[fmt]
+    files = sorted(Path(corpus_dir).glob(f"bench_*{ext}"))
+    total_bytes = sum(path.stat().st_size for path in files)
+
+    # 预先导入解析库和输出用的python-docx，导入耗时不计入结果
+    load_backend(FORMAT_BACKENDS[ext])
+    load_backend('docx')
+    baseline_rss = _peak_rss_mb()
+
+    best = None
+    failed = 0
+    qa_count = 0
+    for _ in range(repeat):
+        # 每次运行使用新的输出目录和处理器：图片存储按内容寻址，复用时第二次起
+        # 图片全部命中已有文件，写出和规范化的耗时不再计入，不同的 --repeat 之间无法比较
+        with tempfile.TemporaryDirectory() as output_dir:
+            processor = DocumentProcessor(corpus_dir, output_dir)
+            handler = getattr(processor, handler_name)
+            timings = dict.fromkeys(STAGES, 0.0)
+            failed = 0
+            qa_count = 0
+            for path in files:
+                started = time.perf_counter()
+                content = handler(path)
+                timings['handler'] += time.perf_counter() - started
+                if not content:
+                    failed += 1
+                    continue
+
+                started = time.perf_counter()
+                qa_pairs = processor.convert_to_qa_format(content)
+                timings['qa'] += time.perf_counter() - started
+                qa_count += len(qa_pairs)
+
+                started = time.perf_counter()
+                processor.create_word_document(qa_pairs, Path(output_dir) / 'bench.docx', content['title'])
+                timings['docx'] += time.perf_counter() - started
+
+        # 多次运行取总耗时最短的一次，减少系统噪声的影响
+        if best is None or sum(timings.values()) < sum(best.values()):
+            best = timings
+
+    megabytes = total_bytes / 1024 / 1024
+    stages = {}
+    for name, seconds in list(best.items()) + [('total', sum(best.values()))]:
+        stages[name] = {
+            'seconds': seconds,
+            'docs_per_sec': len(files) / seconds if seconds else 0.0,
+            'mb_per_sec': megabytes / seconds if seconds else 0.0
+        }
+
+    peak_rss = _peak_rss_mb()
+    return {
+        'files': len(files),
+        'megabytes': megabytes,
+        'failed': failed,
+        'qa_pairs': qa_count,
+        'peak_rss_mb': peak_rss,
+        'rss_growth_mb': peak_rss - baseline_rss,
+        'stages': stages
+    }
+
+
+def run_benchmark(corpus_dir: str, meta: Dict[str, Any], formats: List[str], repeat: int = 3) -> Dict[str, Any]:
+    """逐个格式运行基准测试，每种格式使用一个新启动的进程"""
+    results = {
+        'version': RESULT_VERSION,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'corpus': meta,
+        'repeat': repeat,
+        'formats': {}
+    }
+
+    # spawn而非fork：子进程不继承父进程已占用的内存，峰值内存可比
+    context = multiprocessing.get_context('spawn')
+    for fmt in formats:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(_bench_format, str(corpus_dir), fmt, repeat).result()
+        results['formats'][fmt] = result
+        stages = ', '.join(f"{name} {result['stages'][name]['seconds']:.2f}s" for name in STAGES)
+        logger.info(f"{fmt}: {result['stages']['total']['docs_per_sec']:.2f} 文档/秒, "
+                    f"{result['stages']['total']['mb_per_sec']:.2f} MB/秒, "
+                    f"峰值内存 {result['peak_rss_mb']:.0f} MB（{stages}）")
+    return results
+
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.2) -> List[Dict[str, Any]]:
+    """对比两次结果；吞吐下降或峰值内存增长超过阈值的指标标记为回退"""
+    if baseline.get('corpus') != current.get('corpus'):
+        logger.warning("基线与本次使用的语料不同，对比结果仅供参考")
+
+    rows = []
+    for fmt, result in current['formats'].items():
+        base = baseline['formats'].get(fmt)
+        if not base:
+            continue
+
+        metrics = [(f"{name}.docs_per_sec", base['stages'][name]['docs_per_sec'],
+                    result['stages'][name]['docs_per_sec'], True)
+                   for name in STAGES + ['total'] if name in base['stages']]
+        metrics.append(('peak_rss_mb', base['peak_rss_mb'], result['peak_rss_mb'], False))
+
+        for metric, old, new, higher_is_better in metrics:
+            change = (new - old) / old if old else 0.0
+            regressed = change < -threshold if higher_is_better else change > threshold
+            rows.append({'format': fmt, 'metric': metric, 'baseline': old, 'current': new,
+                         'change': change, 'regressed': regressed})
+    return rows
+
+
+def print_comparison(rows: List[Dict[str, Any]]) -> bool:
+    """打印对比表，返回是否存在回退"""
+    for row in rows:
+        flag = '  <-- 回退' if row['regressed'] else ''
+        print(f"{row['format']:5} {row['metric']:22} {row['baseline']:10.2f} -> {row['current']:10.2f} "
+              f"({row['change']:+.1%}){flag}")
+    regressions = [row for row in rows if row['regressed']]
+    print(f"\n共 {len(rows)} 项指标，{len(regressions)} 项回退")
+    return bool(regressions)
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+    if results.get('version') != RESULT_VERSION:
+        raise ValueError(f"结果文件版本不匹配: {path}")
+    return results
+
+
+def main():
+    """命令行入口"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="文档处理性能基准测试")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_corpus_args(sub):
+        sub.add_argument('--corpus', help="语料目录（默认为系统临时目录下按规模和种子区分的目录）")
+        sub.add_argument('--scale', choices=sorted(SCALES), default='small', help="语料规模（默认small）")
+        sub.add_argument('--seed', type=int, default=42, help="随机种子（默认42）")
+        sub.add_argument('--formats', nargs='+', choices=list(FORMATS), default=list(FORMATS), help="测试的格式")
+
+    generate_parser = subparsers.add_parser('generate', help="只生成合成语料")
+    add_corpus_args(generate_parser)
+
+    run_parser = subparsers.add_parser('run', help="生成（或复用）语料并运行基准测试")
+    add_corpus_args(run_parser)
+    run_parser.add_argument('--repeat', type=int, default=3, help="每种格式重复次数，取最快的一次（默认3）")
+    run_parser.add_argument('--output', help="结果JSON文件")
+    run_parser.add_argument('--baseline', help="与基线结果JSON对比，存在回退时以非零状态退出")
+    run_parser.add_argument('--threshold', type=float, default=0.2, help="判定回退的相对变化（默认0.2，即20%%）")
+
+    compare_parser = subparsers.add_parser('compare', help="对比两份已保存的结果")
+    compare_parser.add_argument('baseline', help="基线结果JSON")
+    compare_parser.add_argument('current', help="本次结果JSON")
+    compare_parser.add_argument('--threshold', type=float, default=0.2, help="判定回退的相对变化（默认0.2）")
+
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        regressed = print_comparison(compare_results(load_results(args.current), load_results(args.baseline),
+                                                     args.threshold))
+        sys.exit(1 if regressed else 0)
+
+    corpus_dir = args.corpus or os.path.join(tempfile.gettempdir(), 'kb_benchmark', f"{args.scale}_{args.seed}")
+    meta = generate_corpus(corpus_dir, args.scale, args.seed, args.formats)
+    if args.command == 'generate':
+        return
+
+    results = run_benchmark(corpus_dir, meta, args.formats, max(1, args.repeat))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        logger.info(f"结果已保存: {args.output}")
+
+    if args.baseline:
+        regressed = print_comparison(compare_results(results, load_results(args.baseline), args.threshold))
+        sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
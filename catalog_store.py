@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+知识库SQLite目录存储
+把文档、章节、Q&A、关键词和图片引用写入单个SQLite数据库，
+并对问题和答案建立FTS5全文索引
+"""
+
+import os
+import json
+import time
+import sqlite3
+import argparse
+from pathlib import Path
+from typing import List, Dict, Any, Iterator, Optional
+import logging
+
+from qa_index import tokenize
+from records import json_default
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL UNIQUE,
+    title TEXT,
+    type TEXT,
+    source_file TEXT,
+    processed_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS sections (
+    id INTEGER PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    heading TEXT,
+    content TEXT,
+    tables TEXT
+);
+
+CREATE TABLE IF NOT EXISTS qa_pairs (
+    id INTEGER PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    type TEXT,
+    source TEXT,
+    image_hash TEXT,
+    image_format TEXT,
+    extra TEXT,
+    -- 分词后的文本（中文二元组，空格分隔），供FTS5的unicode61分词器使用
+    question_tokens TEXT NOT NULL,
+    answer_tokens TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS keywords (
+    qa_id INTEGER NOT NULL REFERENCES qa_pairs(id) ON DELETE CASCADE,
+    keyword TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS images (
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    format TEXT,
+    size INTEGER,
+    page INTEGER,
+    slide INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS idx_sections_document ON sections(document_id);
+CREATE INDEX IF NOT EXISTS idx_qa_document ON qa_pairs(document_id);
+CREATE INDEX IF NOT EXISTS idx_keywords_keyword ON keywords(keyword);
+CREATE INDEX IF NOT EXISTS idx_keywords_qa ON keywords(qa_id);
+CREATE INDEX IF NOT EXISTS idx_images_document ON images(document_id);
+CREATE INDEX IF NOT EXISTS idx_images_hash ON images(hash);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS qa_fts USING fts5(
+    question_tokens, answer_tokens,
+    content='qa_pairs', content_rowid='id', tokenize='unicode61'
+);
+
+CREATE TRIGGER IF NOT EXISTS qa_pairs_ai AFTER INSERT ON qa_pairs BEGIN
+    INSERT INTO qa_fts(rowid, question_tokens, answer_tokens)
+    VALUES (new.id, new.question_tokens, new.answer_tokens);
+END;
+
+CREATE TRIGGER IF NOT EXISTS qa_pairs_ad AFTER DELETE ON qa_pairs BEGIN
+    INSERT INTO qa_fts(qa_fts, rowid, question_tokens, answer_tokens)
+    VALUES ('delete', old.id, old.question_tokens, old.answer_tokens);
+END;
+'''
+
+# 单独存列的Q&A字段，其余字段以JSON保存在extra中
+QA_COLUMNS = ('question', 'answer', 'type', 'source', 'image_hash', 'image_format', 'keywords')
+
+# 查询Q&A时一并取出所属文档和关键词：关键词按写入顺序以单元分隔符（\x1f）拼接，
+# 避免为每条Q&A单独查询一次关键词表
+KEYWORD_SEPARATOR = '\x1f'
+QA_SELECT = (
+    'SELECT q.*, d.source AS document, '
+    '(SELECT group_concat(keyword, char(31)) FROM '
+    '(SELECT keyword FROM keywords WHERE qa_id = q.id ORDER BY rowid)) AS keyword_list '
+)
+
+
+def segment(text: str) -> str:
+    """分词后以空格拼接，保持词序以支持短语查询"""
+    return ' '.join(tokenize(text))
+
+
+def build_match_expression(query: str) -> str:
+    """把查询转换为FTS5表达式：空格分隔的每个词组成一个短语，短语之间为AND"""
+    phrases = []
+    for term in query.split():
+        tokens = tokenize(term)
+        if tokens:
+            phrases.append('"' + ' '.join(tokens) + '"')
+    return ' AND '.join(phrases)
+
+
+class CatalogStore:
+    """单文件知识库目录
+
+    写入由调用方控制事务批次：连续调用 add_document 后调用 commit，
+    同一批次中的所有文档在一个事务中提交。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def commit(self):
+        self.conn.commit()
+
+    def add_document(self, source: str, content: Dict[str, Any], qa_pairs: List[Dict[str, Any]]):
+        """写入（或替换）一个文档的全部内容，不自动提交"""
+        self.remove_document(source)
+        cursor = self.conn.execute(
+            'INSERT INTO documents (source, title, type, source_file, processed_at) VALUES (?, ?, ?, ?, ?)',
+            (source, content.get('title'), content.get('type'), content.get('source_file'), time.time())
+        )
+        document_id = cursor.lastrowid
+
+        self.conn.executemany(
+            'INSERT INTO sections (document_id, position, heading, content, tables) VALUES (?, ?, ?, ?, ?)',
+            [(document_id, i, section.get('heading'), section.get('content'),
+              json.dumps(section.get('tables', []), ensure_ascii=False, default=json_default))
+             for i, section in enumerate(content.get('sections', []))]
+        )
+
+        self.conn.executemany(
+            'INSERT INTO images (document_id, position, hash, format, size, page, slide) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(document_id, i, image['hash'], image.get('format'), image.get('size'),
+              image.get('page'), image.get('slide'))
+             for i, image in enumerate(content.get('images', []))]
+        )
+
+        keyword_rows = []
+        for i, qa in enumerate(qa_pairs):
+            extra = {key: value for key, value in qa.items() if key not in QA_COLUMNS}
+            cursor = self.conn.execute(
+                'INSERT INTO qa_pairs (document_id, position, question, answer, type, source, image_hash, '
+                'image_format, extra, question_tokens, answer_tokens) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (document_id, i, qa['question'], qa['answer'], qa.get('type'), qa.get('source'),
+                 qa.get('image_hash'), qa.get('image_format'),
+                 json.dumps(extra, ensure_ascii=False) if extra else None,
+                 segment(qa['question']), segment(qa['answer']))
+            )
+            keyword_rows.extend((cursor.lastrowid, keyword) for keyword in qa.get('keywords', []))
+
+        self.conn.executemany('INSERT INTO keywords (qa_id, keyword) VALUES (?, ?)', keyword_rows)
+
+    def remove_document(self, source: str):
+        """删除一个文档（章节、Q&A、关键词、图片引用级联删除），不自动提交"""
+        self.conn.execute('DELETE FROM documents WHERE source = ?', (source,))
+
+    def _qa_from_row(self, row: sqlite3.Row) -> Dict[str, Any]:
+        """把数据库行还原为与 convert_to_qa_format 相同结构的字典"""
+        qa = {
+            'question': row['question'],
+            'answer': row['answer'],
+            'keywords': row['keyword_list'].split(KEYWORD_SEPARATOR) if row['keyword_list'] is not None else [],
+            'source': row['source'],
+            'type': row['type']
+        }
+        if row['image_hash']:
+            qa['image_hash'] = row['image_hash']
+            qa['image_format'] = row['image_format']
+        if row['extra']:
+            qa.update(json.loads(row['extra']))
+        qa['document'] = row['document']
+        return qa
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """全文检索问题和答案，按FTS5的BM25得分排序"""
+        expression = build_match_expression(query)
+        if not expression:
+            return []
+
+        rows = self.conn.execute(
+            QA_SELECT + ', bm25(qa_fts) AS rank '
+            'FROM qa_fts JOIN qa_pairs q ON q.id = qa_fts.rowid JOIN documents d ON d.id = q.document_id '
+            'WHERE qa_fts MATCH ? ORDER BY rank LIMIT ?',
+            (expression, limit)
+        ).fetchall()
+
+        results = []
+        for row in rows:
+            qa = self._qa_from_row(row)
+            qa['score'] = -row['rank']
+            results.append(qa)
+        return results
+
+    def find_by_keywords(self, keywords: List[str], limit: int = 100) -> List[Dict[str, Any]]:
+        """查找同时带有所有给定关键词的Q&A"""
+        placeholders = ', '.join('?' for _ in keywords)
+        rows = self.conn.execute(
+            QA_SELECT + 'FROM qa_pairs q JOIN documents d ON d.id = q.document_id '
+            f'WHERE q.id IN (SELECT qa_id FROM keywords WHERE keyword IN ({placeholders}) '
+            'GROUP BY qa_id HAVING COUNT(DISTINCT keyword) = ?) ORDER BY q.id LIMIT ?',
+            (*keywords, len(set(keywords)), limit)
+        ).fetchall()
+        return [self._qa_from_row(row) for row in rows]
+
+    def iter_qa_pairs(self) -> Iterator[Dict[str, Any]]:
+        """按文档顺序遍历整个知识库的Q&A"""
+        rows = self.conn.execute(
+            QA_SELECT + 'FROM qa_pairs q JOIN documents d ON d.id = q.document_id '
+            'ORDER BY d.source, q.position'
+        )
+        for row in rows:
+            yield self._qa_from_row(row)
+
+    def stats(self) -> Dict[str, int]:
+        """各表的记录数"""
+        return {
+            table: self.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            for table in ('documents', 'sections', 'qa_pairs', 'keywords', 'images')
+        }
+
+
+def main():
+    """命令行入口"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="知识库SQLite目录查询")
+    parser.add_argument('--db', default=os.path.join("已处理知识库", "knowledge_base.sqlite"), help="数据库文件")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    search_parser = subparsers.add_parser('search', help="全文检索问题和答案")
+    search_parser.add_argument('query', help="查询文本，空格分隔的词需同时出现")
+    search_parser.add_argument('-n', '--limit', type=int, default=10, help="返回结果数")
+
+    keyword_parser = subparsers.add_parser('keywords', help="按关键词查找")
+    keyword_parser.add_argument('keywords', nargs='+', help="需同时具备的关键词")
+
+    subparsers.add_parser('stats', help="统计记录数")
+
+    args = parser.parse_args()
+    if not os.path.exists(args.db):
+        logger.error(f"数据库不存在: {args.db}")
+        return
+
+    store = CatalogStore(args.db)
+    try:
+        if args.command == 'stats':
+            for table, count in store.stats().items():
+                print(f"{table}: {count}")
+            return
+
+        started = time.perf_counter()
+        if args.command == 'search':
+            results = store.search(args.query, args.limit)
+        else:
+            results = store.find_by_keywords(args.keywords)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        for rank, qa in enumerate(results, 1):
+            print(f"{rank}. {qa['question']}  ({qa['document']})")
+        print(f"\n共 {len(results)} 条结果，耗时 {elapsed_ms:.1f} ms")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+检索用分块
+把章节正文切分为大小受限、相邻之间有重叠的分块：标题与其后的内容保持在一起，
+编号步骤和SQL语句不会被拆开。正文只扫描一遍，耗时与文本长度成线性关系；
+每个分块记录它在章节正文中的起止偏移
+"""
+
+import re
+from itertools import islice
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+# 分块大小的计量单位：字符数，或估算的token数
+CHUNK_UNITS = ('chars', 'tokens')
+# 切分规则的版本：规则变化时记录在处理清单中的配置随之变化，已有的输出会重新处理
+CHUNKER_VERSION = 3
+
+# 标题行：Markdown标题、"第N章/节"、"一、"
+HEADING_LINE = re.compile(r'\s*(?:#{1,6}\s|第[一二三四五六七八九十百\d]+[章节部分篇]|[一二三四五六七八九十]+、)')
+# 编号步骤："1." "2、" "3)" "(4)" "步骤5" "Step 6"（"1.2" 这类小节号除外）
+STEP_LINE = re.compile(r'\s*(?:\d{1,3}[.、)）](?!\d)|[(（]\d{1,3}[)）]|步骤\s*\d+|step\s*\d+)', re.IGNORECASE)
+# SQL语句的开头和续行
+SQL_START = re.compile(r'\s*(?:select|update|delete|insert|exec|execute|merge|truncate|create|alter|drop|declare)\b',
+                       re.IGNORECASE)
+SQL_CONTINUATION = re.compile(
+    r'\s*(?:from|where|and|or|set|values|into|join|inner|left|right|full|cross|on|group|order|having|union'
+    r'|select|case|when|then|else|end|as|--)\b|\s*[(),+]', re.IGNORECASE)
+SQL_OPEN_END = re.compile(r'(?:[,+(=]|\b(?:and|or|select|from|where|set|values|into|join|on))\s*$', re.IGNORECASE)
+# 句末标点：超长段落在句子之间切分（"1. " 这类步骤编号中的点除外）
+SENTENCE_END = re.compile(r'[。！？!?；;]+|(?<!\d)\.(?=\s)')
+# token估算：每个汉字一个token，连续的字母数字一个token，其他符号各一个
+TOKEN = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]|[A-Za-z0-9_]+|[^\sA-Za-z0-9_\u3400-\u9fff\uf900-\ufaff]')
+
+
+class Unit:
+    """不可再分的文本单元：[start, end) 为在正文中的偏移"""
+
+    __slots__ = ('kind', 'start', 'end', 'size', 'glue')
+
+    def __init__(self, kind: str, start: int, end: int, size: int, glue: bool = False):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.size = size
+        # 为True时不在该单元之后切分（标题、以冒号结尾的引导句）
+        self.glue = glue
+
+
+def iter_lines(text: str) -> Iterator[Tuple[int, int]]:
+    """逐行产出 (起始偏移, 结束偏移)，结束偏移不含换行符"""
+    start = 0
+    length = len(text)
+    while start < length:
+        end = text.find('\n', start)
+        if end < 0:
+            end = length
+        yield start, end
+        start = end + 1
+
+
+class Chunker:
+    """把正文切分为不超过 max_size 的分块，相邻分块重叠约 overlap
+
+    分块大小按整段文本（包括单元之间的换行）计算。单个SQL语句（连同前面的标题）
+    超过 max_size 时单独成为一个分块（不会被截断）；其他超长的单元按句子切分，
+    单个句子仍超长时才按大小硬切。标题不单独成块：标题加上后面的单元超过
+    max_size 时切开该单元，第一部分与标题放在同一块。
+    """
+
+    def __init__(self, max_size: int = 800, overlap: int = 100, unit: str = 'chars'):
+        if unit not in CHUNK_UNITS:
+            raise ValueError(f"不支持的分块单位: {unit}")
+        if max_size <= 0:
+            raise ValueError("分块大小必须为正数")
+        self.max_size = max_size
+        self.overlap = max(0, min(overlap, max_size // 2))
+        self.unit = unit
+
+    def options(self) -> Dict[str, Any]:
+        """影响输出结果的配置，记录在处理清单中"""
+        return {'max_size': self.max_size, 'overlap': self.overlap, 'unit': self.unit, 'version': CHUNKER_VERSION}
+
+    def measure(self, text: str, start: int = 0, end: int = None) -> int:
+        """text[start:end] 的大小（字符数或估算的token数）"""
+        end = len(text) if end is None else end
+        if self.unit == 'chars':
+            return end - start
+        return sum(1 for _ in TOKEN.finditer(text, start, end))
+
+    def split(self, text: str) -> List[Dict[str, Any]]:
+        """切分正文，返回 [{'text', 'start', 'end', 'size'}]；text 为 text[start:end]"""
+        start, end = _strip_span(text, 0, len(text))
+        if start >= end:
+            return []
+        size = self.measure(text, start, end)
+        if size <= self.max_size:
+            return [{'text': text[start:end], 'start': start, 'end': end, 'size': size}]
+        return [self._chunk(text, units) for units in self._pack(text, self._units(text))]
+
+    def _units(self, text: str) -> Iterator[Unit]:
+        """按行扫描，识别标题、编号步骤、SQL语句和普通段落"""
+        lines = iter_lines(text)
+        line = next(lines, None)
+        while line is not None:
+            start, end = line
+            first = text[start:end]
+            if not first.strip():
+                line = next(lines, None)
+                continue
+
+            if SQL_START.match(first):
+                kind = 'sql'
+                depth = first.count('(') - first.count(')')
+                previous = first
+                block_end = end
+                line = next(lines, None)
+                while line is not None:
+                    current = text[line[0]:line[1]]
+                    if not current.strip() or not (depth > 0 or SQL_CONTINUATION.match(current)
+                                                   or SQL_OPEN_END.search(previous)):
+                        break
+                    if previous.rstrip().endswith(';'):
+                        break
+                    depth += current.count('(') - current.count(')')
+                    previous = current
+                    block_end = line[1]
+                    line = next(lines, None)
+                yield Unit(kind, start, block_end, self.measure(text, start, block_end))
+                continue
+
+            if HEADING_LINE.match(first):
+                line = next(lines, None)
+                yield Unit('heading', start, end, self.measure(text, start, end), glue=True)
+                continue
+
+            # 编号步骤或普通段落：连续的非空行，遇到新的步骤、标题或SQL时结束
+            kind = 'step' if STEP_LINE.match(first) else 'text'
+            block_end = end
+            line = next(lines, None)
+            while line is not None:
+                current = text[line[0]:line[1]]
+                if (not current.strip() or STEP_LINE.match(current) or HEADING_LINE.match(current)
+                        or SQL_START.match(current)):
+                    break
+                block_end = line[1]
+                line = next(lines, None)
+            size = self.measure(text, start, block_end)
+            glue = text[start:block_end].rstrip().endswith((':', '：'))
+            if size <= self.max_size:
+                yield Unit(kind, start, block_end, size, glue)
+            else:
+                yield from self._split_long(text, kind, start, block_end)
+
+    def _split_long(self, text: str, kind: str, start: int, end: int) -> Iterator[Unit]:
+        """在句子之间切分超长的段落；单个句子仍超长时按大小硬切"""
+        sentence_start = start
+        for match in SENTENCE_END.finditer(text, start, end):
+            yield from self._hard_split(text, kind, sentence_start, match.end())
+            sentence_start = match.end()
+        if sentence_start < end:
+            yield from self._hard_split(text, kind, sentence_start, end)
+
+    def _hard_split(self, text: str, kind: str, start: int, end: int) -> Iterator[Unit]:
+        start, end = _strip_span(text, start, end)
+        if start >= end:
+            return
+        size = self.measure(text, start, end)
+        if size <= self.max_size:
+            yield Unit(kind, start, end, size)
+            return
+        if self.unit == 'chars':
+            for offset in range(start, end, self.max_size):
+                piece_start, piece_end = _strip_span(text, offset, min(offset + self.max_size, end))
+                if piece_start < piece_end:
+                    yield Unit(kind, piece_start, piece_end, piece_end - piece_start)
+            return
+        piece_start = start
+        count = 0
+        for match in TOKEN.finditer(text, start, end):
+            if count == self.max_size:
+                yield Unit(kind, piece_start, _strip_span(text, piece_start, match.start())[1], count)
+                piece_start, count = match.start(), 0
+            count += 1
+        yield Unit(kind, piece_start, end, count)
+
+    def _pack(self, text: str, units: Iterator[Unit]) -> Iterator[List[Unit]]:
+        """贪心地把连续单元装入分块，切分后把上一块末尾的单元作为重叠带入下一块
+
+        分块大小按起止偏移之间的整段计算（包括单元之间的换行和空行），与 _chunk 一致。
+        """
+        current = []
+        size = 0
+        # 被切开的单元剩余的部分，优先于后续单元处理
+        rest = None
+        units = iter(units)
+        while True:
+            unit, rest = rest, None
+            if unit is None:
+                unit = next(units, None)
+                if unit is None:
+                    break
+            # 新标题前的分块已经过半时在标题处切分，使分块与章节结构对齐
+            full = size + self._added_size(text, current, unit) > self.max_size
+            at_heading = unit.kind == 'heading' and size >= self.max_size // 2
+            if current and (full or at_heading):
+                # 标题和引导句跟随后面的内容进入下一块，不单独成块
+                carry = []
+                while current and current[-1].glue:
+                    carry.insert(0, current.pop())
+                tail = []
+                if current:
+                    yield current
+                    tail = self._overlap_tail(current) if not at_heading else []
+                current = tail + carry
+                size = self._span_size(text, current)
+                if tail and size + self._added_size(text, current, unit) > self.max_size:
+                    current = carry
+                    size = self._span_size(text, current)
+                gap = self._added_size(text, current, unit) - unit.size
+                if carry and size + gap + unit.size > self.max_size and unit.kind != 'sql':
+                    # 把本单元切开，第一部分与标题装入同一块
+                    split = self._split_unit(text, unit, self.max_size - size - gap)
+                    if split:
+                        unit, rest = split
+                    else:
+                        # 标题本身已接近 max_size，只能单独成块
+                        yield current
+                        current, size = [], 0
+            size += self._added_size(text, current, unit)
+            current.append(unit)
+        if current:
+            yield current
+
+    def _added_size(self, text: str, current: List[Unit], unit: Unit) -> int:
+        """把 unit 追加到 current 之后分块增加的大小（包括与上一个单元之间的换行）"""
+        if not current:
+            return unit.size
+        return self.measure(text, current[-1].end, unit.start) + unit.size
+
+    def _span_size(self, text: str, units: List[Unit]) -> int:
+        return self.measure(text, units[0].start, units[-1].end) if units else 0
+
+    def _split_unit(self, text: str, unit: Unit, budget: int) -> Optional[Tuple[Unit, Unit]]:
+        """把单元切为大小不超过 budget 的前半部分和剩余部分：优先在句子之间切分，否则按大小硬切"""
+        if budget <= 0:
+            return None
+        cut = None
+        measured, position = 0, unit.start
+        for match in SENTENCE_END.finditer(text, unit.start, unit.end):
+            measured += self.measure(text, position, match.end())
+            position = match.end()
+            if measured > budget:
+                break
+            cut = match.end()
+        if cut is None:
+            if self.unit == 'chars':
+                cut = unit.start + budget
+            else:
+                starts = [match.start() for match in islice(TOKEN.finditer(text, unit.start, unit.end), budget + 1)]
+                cut = starts[budget] if len(starts) > budget else unit.end
+        head_start, head_end = _strip_span(text, unit.start, cut)
+        rest_start, rest_end = _strip_span(text, cut, unit.end)
+        if head_start >= head_end or rest_start >= rest_end:
+            return None
+        return (Unit(unit.kind, head_start, head_end, self.measure(text, head_start, head_end)),
+                Unit(unit.kind, rest_start, rest_end, self.measure(text, rest_start, rest_end), unit.glue))
+
+    def _overlap_tail(self, units: List[Unit]) -> List[Unit]:
+        """分块末尾总大小不超过 overlap 的完整单元"""
+        tail = []
+        size = 0
+        for unit in reversed(units):
+            if size + unit.size > self.overlap or unit.kind == 'heading':
+                break
+            tail.insert(0, unit)
+            size += unit.size
+        if len(tail) == len(units):
+            return []
+        return tail
+
+    def _chunk(self, text: str, units: List[Unit]) -> Dict[str, Any]:
+        start, end = units[0].start, units[-1].end
+        return {'text': text[start:end], 'start': start, 'end': end, 'size': self.measure(text, start, end)}
+
+
+def _strip_span(text: str, start: int, end: int) -> Tuple[int, int]:
+    """去掉 text[start:end] 两端空白后的偏移"""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
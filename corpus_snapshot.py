@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+知识库二进制快照
+把处理结果目录中全部文档的原始内容和问答对保存为单个二进制文件：所有字符串
+去重后集中存放在字符串表中，记录里只保存字符串编号；每个文档是一条带长度前缀
+的记录，按内存映射方式读取并还原为 records 中的定长记录。加载整个知识库时
+不需要逐个解析带缩进的 _data.json，重复的关键词、来源和表格单元格也只占一份内存
+"""
+
+import os
+import json
+import mmap
+import time
+import struct
+import argparse
+import tracemalloc
+from array import array
+from pathlib import Path
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+import logging
+
+from records import DocumentRecord, QARecord, SectionRecord, TableRecord, json_default
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_NAME = 'knowledge_base.snap'
+SNAPSHOT_MAGIC = b'KBSNAP\r\n'
+# 快照格式版本，格式不兼容时递增
+SNAPSHOT_VERSION = 1
+
+# 文件头：魔数、版本、文档数、字符串表偏移、文档索引偏移
+HEADER = struct.Struct('<8sIIQQ')
+# 记录的长度前缀
+LENGTH = struct.Struct('<I')
+U32 = struct.Struct('<I')
+# 文档记录头：来源文档、指纹、原始内容类型、原始内容的字节数
+DOC_HEAD = struct.Struct('<IIBI')
+# 原始内容：标题、原文件路径、类型、章节数
+CONTENT_HEAD = struct.Struct('<IIII')
+# 章节：记录类型、标题、正文、表格数
+SECTION_HEAD = struct.Struct('<BIII')
+# 问答对：记录类型、问题、答案、来源、类型、关键词数
+QA_HEAD = struct.Struct('<BIIIII')
+# 图片Q&A：图片哈希、格式
+IMAGE_REF = struct.Struct('<II')
+
+# 原始内容和章节的记录类型
+NO_CONTENT, RECORD, GENERIC = 0, 1, 2
+# 问答对的记录类型：普通（文本、表格）、带分块来源、图片、其他结构（按通用值保存）
+QA_PLAIN, QA_CHUNK, QA_IMAGE, QA_GENERIC = 0, 1, 2, 3
+QA_FIELDS = ('question', 'answer', 'keywords', 'source', 'type')
+QA_LAYOUTS = {QA_FIELDS: QA_PLAIN, QA_FIELDS + ('chunk',): QA_CHUNK,
+              QA_FIELDS + ('image_hash', 'image_format'): QA_IMAGE}
+
+
+def snapshot_path(output_dir: str) -> Path:
+    return Path(output_dir) / SNAPSHOT_NAME
+
+
+def document_fingerprint(entry: Dict[str, Any], path: Path) -> Optional[str]:
+    """文档在快照中的指纹：源文件内容摘要 + 问答对输出文件的名称、修改时间和大小
+
+    输出文件都是原子替换的，重新处理（包括只改变分块等配置）后指纹必然变化。
+    """
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return f"{entry.get('sha256')}:{path.name}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def is_record(value: Any, fields: Tuple[str, ...]) -> bool:
+    """字典的键（及顺序）与记录字段一致时可以按定长记录保存"""
+    return hasattr(value, 'keys') and tuple(value.keys()) == fields
+
+
+def is_section_record(section: Any) -> bool:
+    """章节及其表格都是标准结构（文本字段和单元格都是字符串）"""
+    if not (is_record(section, SectionRecord.__slots__)
+            and isinstance(section['heading'], str) and isinstance(section['content'], str)):
+        return False
+    return all(is_record(table, TableRecord.__slots__)
+               and all(isinstance(cell, str) for cell in table['headers'])
+               and all(isinstance(cell, str) for row in table['rows'] for cell in row)
+               for table in section['tables'])
+
+
+class SnapshotWriter:
+    """逐个文档写出快照：记录先写入临时文件，字符串表和文档索引在关闭时追加"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        self.file = open(self.tmp_path, 'wb')
+        self.file.write(b'\0' * HEADER.size)
+        self.strings = {}
+        self.offsets = []
+
+    def intern(self, text: str) -> int:
+        """字符串的编号；相同的字符串只保存一次"""
+        index = self.strings.get(text)
+        if index is None:
+            index = self.strings[text] = len(self.strings)
+        return index
+
+    def add_document(self, source: str, fingerprint: str, content: Optional[Dict[str, Any]],
+                     qa_pairs: List[Dict[str, Any]]):
+        body = bytearray()
+        if content is None:
+            kind = NO_CONTENT
+        elif (is_record(content, DocumentRecord.__slots__)
+              and all(isinstance(content[name], str) for name in ('title', 'source_file', 'type'))):
+            kind = RECORD
+            self._encode_content(body, content)
+        else:
+            kind = GENERIC
+            self._encode_value(body, content)
+        content_size = len(body)
+        body += U32.pack(len(qa_pairs))
+        for qa in qa_pairs:
+            self._encode_qa(body, qa)
+
+        record = DOC_HEAD.pack(self.intern(source), self.intern(fingerprint), kind, content_size) + body
+        self.offsets.append(self.file.tell())
+        self.file.write(LENGTH.pack(len(record)))
+        self.file.write(record)
+
+    def _encode_content(self, out: bytearray, content: Dict[str, Any]):
+        intern = self.intern
+        out += CONTENT_HEAD.pack(intern(content['title']), intern(content['source_file']),
+                                 intern(content['type']), len(content['sections']))
+        for section in content['sections']:
+            if is_section_record(section):
+                tables = section['tables']
+                out += SECTION_HEAD.pack(RECORD, intern(section['heading']), intern(section['content']), len(tables))
+                for table in tables:
+                    self._encode_strings(out, table['headers'])
+                    out += U32.pack(len(table['rows']))
+                    for row in table['rows']:
+                        self._encode_strings(out, row)
+                self._encode_value(out, section['images'])
+            else:
+                out += SECTION_HEAD.pack(GENERIC, 0, 0, 0)
+                self._encode_value(out, section)
+        self._encode_value(out, content['images'])
+
+    def _encode_strings(self, out: bytearray, values: List[str]):
+        out += U32.pack(len(values))
+        out += array('I', [self.intern(value) for value in values]).tobytes()
+
+    def _encode_qa(self, out: bytearray, qa: Dict[str, Any]):
+        kind = QA_LAYOUTS.get(tuple(qa.keys()), QA_GENERIC)
+        strings = ('question', 'answer', 'source', 'type') + (('image_hash', 'image_format') if kind == QA_IMAGE else ())
+        if kind != QA_GENERIC and not all(isinstance(qa[name], str) for name in strings):
+            kind = QA_GENERIC
+        if kind == QA_GENERIC:
+            out += QA_HEAD.pack(QA_GENERIC, 0, 0, 0, 0, 0)
+            self._encode_value(out, qa)
+            return
+
+        intern = self.intern
+        keywords = qa['keywords']
+        out += QA_HEAD.pack(kind, intern(qa['question']), intern(qa['answer']), intern(qa['source']),
+                            intern(qa['type']), len(keywords))
+        out += array('I', [intern(keyword) for keyword in keywords]).tobytes()
+        if kind == QA_CHUNK:
+            self._encode_value(out, qa['chunk'])
+        elif kind == QA_IMAGE:
+            out += IMAGE_REF.pack(intern(qa['image_hash']), intern(qa['image_format']))
+
+    def _encode_value(self, out: bytearray, value: Any):
+        """通用值（图片信息、分块来源等结构不固定的部分）：紧凑的JSON文本，同样进入字符串表"""
+        text = json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=json_default)
+        out += U32.pack(self.intern(text))
+
+    def close(self) -> Path:
+        """写出字符串表和文档索引，回填文件头并原子替换目标文件"""
+        strings_offset = self.file.tell()
+        # 字符串表：个数、按字符计的结束偏移、整体UTF-8编码的文本
+        texts = list(self.strings)
+        ends = array('I')
+        total = 0
+        for text in texts:
+            total += len(text)
+            ends.append(total)
+        self.file.write(U32.pack(len(texts)))
+        self.file.write(ends.tobytes())
+        blob = ''.join(texts).encode('utf-8', 'surrogatepass')
+        self.file.write(struct.pack('<Q', len(blob)))
+        self.file.write(blob)
+
+        index_offset = self.file.tell()
+        self.file.write(array('Q', self.offsets).tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(self.offsets), strings_offset, index_offset))
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def abort(self):
+        self.file.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+
+class SnapshotDocument:
+    """快照中的一个文档：原始内容（输出中没有 _data.json 时为None）和问答对"""
+
+    __slots__ = ('source', 'fingerprint', 'content', 'qa_pairs')
+
+    def __init__(self, source: str, fingerprint: str, content: Optional[DocumentRecord], qa_pairs: List[QARecord]):
+        self.source = source
+        self.fingerprint = fingerprint
+        self.content = content
+        self.qa_pairs = qa_pairs
+
+
+class CorpusSnapshot:
+    """以内存映射方式读取的快照
+
+    打开时只解码字符串表和文档索引；文档记录按需解码，可以只读取问答对而跳过原始内容。
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, count, strings_offset, index_offset = HEADER.unpack_from(self.buffer, 0)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                raise ValueError(f"不是当前版本的知识库快照: {self.path}")
+            self.strings = self._read_strings(strings_offset)
+            self.offsets = array('Q')
+            self.offsets.frombytes(self.buffer[index_offset:index_offset + 8 * count])
+            # 来源文档 -> (文档序号, 指纹)
+            self.sources = {}
+            for i, offset in enumerate(self.offsets):
+                source, fingerprint, _, _ = DOC_HEAD.unpack_from(self.buffer, offset + LENGTH.size)
+                self.sources[self.strings[source]] = (i, self.strings[fingerprint])
+        except Exception:
+            self.buffer.close()
+            raise
+
+    @classmethod
+    def open(cls, output_dir: str) -> Optional['CorpusSnapshot']:
+        """打开处理结果目录中的快照；不存在或无法读取时返回None"""
+        path = snapshot_path(output_dir)
+        if not path.exists():
+            return None
+        try:
+            return cls(path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"读取知识库快照 {path} 时出错，将改为读取处理结果: {str(e)}")
+            return None
+
+    def _read_strings(self, offset: int) -> List[str]:
+        (count,) = U32.unpack_from(self.buffer, offset)
+        offset += U32.size
+        ends = array('I')
+        ends.frombytes(self.buffer[offset:offset + 4 * count])
+        offset += 4 * count
+        (size,) = struct.unpack_from('<Q', self.buffer, offset)
+        offset += 8
+        text = self.buffer[offset:offset + size].decode('utf-8', 'surrogatepass')
+        strings = []
+        start = 0
+        for end in ends:
+            strings.append(text[start:end])
+            start = end
+        return strings
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def close(self):
+        self.buffer.close()
+
+    def fingerprint(self, source: str) -> Optional[str]:
+        entry = self.sources.get(source)
+        return entry[1] if entry else None
+
+    def document(self, index: int, content: bool = True) -> SnapshotDocument:
+        """解码第 index 个文档；content 为False时跳过原始内容"""
+        buffer, strings = self.buffer, self.strings
+        offset = self.offsets[index] + LENGTH.size
+        source, fingerprint, kind, content_size = DOC_HEAD.unpack_from(buffer, offset)
+        offset += DOC_HEAD.size
+        record = None
+        if content and kind == RECORD:
+            record = self._decode_content(offset)
+        elif content and kind == GENERIC:
+            record, _ = self._decode_value(offset)
+        offset += content_size
+
+        (count,) = U32.unpack_from(buffer, offset)
+        offset += U32.size
+        qa_pairs = []
+        unpack_head = QA_HEAD.unpack_from
+        for _ in range(count):
+            qa_kind, question, answer, qa_source, qa_type, keyword_count = unpack_head(buffer, offset)
+            offset += QA_HEAD.size
+            if qa_kind == QA_GENERIC:
+                qa, offset = self._decode_value(offset)
+                qa_pairs.append(qa)
+                continue
+            end = offset + 4 * keyword_count
+            keywords = [strings[i] for i in struct.unpack_from(f'<{keyword_count}I', buffer, offset)]
+            offset = end
+            qa = QARecord(strings[question], strings[answer], keywords, strings[qa_source], strings[qa_type])
+            if qa_kind == QA_CHUNK:
+                qa.chunk, offset = self._decode_value(offset)
+            elif qa_kind == QA_IMAGE:
+                image_hash, image_format = IMAGE_REF.unpack_from(buffer, offset)
+                qa.image_hash, qa.image_format = strings[image_hash], strings[image_format]
+                offset += IMAGE_REF.size
+            qa_pairs.append(qa)
+        return SnapshotDocument(strings[source], strings[fingerprint], record, qa_pairs)
+
+    def documents(self, content: bool = True) -> Iterator[SnapshotDocument]:
+        for i in range(len(self.offsets)):
+            yield self.document(i, content)
+
+    def qa_pairs(self, source: str, fingerprint: Optional[str]) -> Optional[List[QARecord]]:
+        """指纹与快照中一致时返回该文档的问答对，否则返回None"""
+        entry = self.sources.get(source)
+        if entry is None or fingerprint is None or entry[1] != fingerprint:
+            return None
+        return self.document(entry[0], content=False).qa_pairs
+
+    def _decode_content(self, offset: int) -> DocumentRecord:
+        buffer, strings = self.buffer, self.strings
+        title, source_file, doc_type, section_count = CONTENT_HEAD.unpack_from(buffer, offset)
+        offset += CONTENT_HEAD.size
+        sections = []
+        for _ in range(section_count):
+            kind, heading, text, table_count = SECTION_HEAD.unpack_from(buffer, offset)
+            offset += SECTION_HEAD.size
+            if kind == GENERIC:
+                section, offset = self._decode_value(offset)
+                sections.append(section)
+                continue
+            tables = []
+            for _ in range(table_count):
+                headers, offset = self._decode_strings(offset)
+                (row_count,) = U32.unpack_from(buffer, offset)
+                offset += U32.size
+                rows = []
+                for _ in range(row_count):
+                    row, offset = self._decode_strings(offset)
+                    rows.append(row)
+                tables.append(TableRecord(headers, rows))
+            images, offset = self._decode_value(offset)
+            sections.append(SectionRecord(strings[heading], strings[text], tables, images))
+        images, offset = self._decode_value(offset)
+        return DocumentRecord(strings[title], strings[source_file], strings[doc_type], sections, images)
+
+    def _decode_strings(self, offset: int) -> Tuple[List[str], int]:
+        (count,) = U32.unpack_from(self.buffer, offset)
+        offset += U32.size
+        strings = self.strings
+        return [strings[i] for i in struct.unpack_from(f'<{count}I', self.buffer, offset)], offset + 4 * count
+
+    def _decode_value(self, offset: int) -> Tuple[Any, int]:
+        return json.loads(self.strings[U32.unpack_from(self.buffer, offset)[0]]), offset + U32.size
+
+
+def iter_output_documents(output_dir: Path) -> Iterator[Tuple[str, Dict[str, Any], Path]]:
+    """按处理清单列出有问答对输出的文档：(源文档标识, 清单条目, 输出文件)，优先 _data.json"""
+    from qa_index import QA_OUTPUT_SUFFIXES
+
+    with open(output_dir / 'manifest.json', 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('storage') == 'sqlite':
+        raise ValueError("SQLite存储方式已可按文档读取，不需要生成快照")
+    for source, entry in sorted(manifest.get('documents', {}).items()):
+        names = [name for name in entry['outputs'] if name.endswith(QA_OUTPUT_SUFFIXES)]
+        if names:
+            names.sort(key=lambda name: not name.endswith(QA_OUTPUT_SUFFIXES[0]))
+            yield source, entry, output_dir / names[0]
+
+
+def read_output_document(path: Path) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    """读取一个输出文件：_data.json 返回 (原始内容, 问答对)，_qa.jsonl 只有问答对"""
+    from qa_index import read_qa_output
+
+    if path.name.endswith('_data.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data.get('raw_content'), data['qa_pairs']
+    return None, read_qa_output(path)
+
+
+def build_snapshot(output_dir: str, path: Optional[str] = None) -> Dict[str, Any]:
+    """由处理结果生成快照，返回统计信息
+
+    旧快照中指纹未变的文档直接从旧快照解码，只有新增或重新处理的文档读取JSON。
+    """
+    output_dir = Path(output_dir)
+    path = Path(path) if path else snapshot_path(output_dir)
+    started = time.perf_counter()
+    previous = None
+    if path.exists():
+        try:
+            previous = CorpusSnapshot(path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"旧快照 {path} 无法读取，将全部重新解析: {str(e)}")
+    stats = {'documents': 0, 'qa_pairs': 0, 'reused': 0, 'parsed': 0}
+    writer = SnapshotWriter(path)
+    try:
+        for source, entry, output in iter_output_documents(output_dir):
+            fingerprint = document_fingerprint(entry, output)
+            if fingerprint is None:
+                continue
+            if previous and previous.fingerprint(source) == fingerprint:
+                document = previous.document(previous.sources[source][0])
+                content, qa_pairs = document.content, document.qa_pairs
+                stats['reused'] += 1
+            else:
+                content, qa_pairs = read_output_document(output)
+                stats['parsed'] += 1
+            writer.add_document(source, fingerprint, content, qa_pairs)
+            stats['documents'] += 1
+            stats['qa_pairs'] += len(qa_pairs)
+        stats['strings'] = len(writer.strings)
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        if previous:
+            previous.close()
+    writer.close()
+    stats['bytes'] = path.stat().st_size
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+def load_snapshot(output_dir: str, content: bool = True) -> List[SnapshotDocument]:
+    """读取快照中的全部文档"""
+    snapshot = CorpusSnapshot(snapshot_path(output_dir))
+    try:
+        return list(snapshot.documents(content))
+    finally:
+        snapshot.close()
+
+
+def load_json_outputs(output_dir: str) -> List[Tuple[str, Optional[Dict[str, Any]], List[Dict[str, Any]]]]:
+    """逐个解析输出文件读取全部文档（对比基准）"""
+    return [(source, *read_output_document(output))
+            for source, _, output in iter_output_documents(Path(output_dir))]
+
+
+def measure_load(load, repeat: int) -> Dict[str, float]:
+    """加载耗时（取最快的一次）、加载结果占用的内存和加载过程中的峰值内存"""
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        load()
+        seconds.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        result = load()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return {'seconds': min(seconds), 'retained_mb': retained / 1024 / 1024, 'peak_mb': peak / 1024 / 1024}
+
+
+def main():
+    """命令行入口"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="知识库二进制快照")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="由处理结果生成（或增量更新）快照")
+    build_parser.add_argument('--output', default="已处理知识库", help="处理结果目录")
+
+    load_parser = subparsers.add_parser('load', help="加载快照，与逐个解析 _data.json 比较耗时和内存")
+    load_parser.add_argument('--output', default="已处理知识库", help="处理结果目录")
+    load_parser.add_argument('--repeat', type=int, default=3, help="计时重复次数（取最快的一次）")
+    load_parser.add_argument('--no-compare', action='store_true', help="只加载快照，不解析JSON对比")
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        stats = build_snapshot(args.output)
+        logger.info(f"快照生成完成: {stats['documents']} 个文档，{stats['qa_pairs']} 个问答对，"
+                    f"{stats['strings']} 个不同的字符串，{stats['bytes'] / 1024:.0f} KB，"
+                    f"复用 {stats['reused']} 个文档，解析 {stats['parsed']} 个，耗时 {stats['seconds']:.2f} s")
+        return
+
+    documents = load_snapshot(args.output)
+    logger.info(f"快照: {len(documents)} 个文档，{sum(len(d.qa_pairs) for d in documents)} 个问答对")
+    del documents
+    results = {'snapshot': measure_load(lambda: load_snapshot(args.output), args.repeat)}
+    if not args.no_compare:
+        results['json'] = measure_load(lambda: load_json_outputs(args.output), args.repeat)
+    for name, result in results.items():
+        print(f"{name:<10} 耗时 {result['seconds'] * 1000:8.1f} ms  "
+              f"占用内存 {result['retained_mb']:7.1f} MB  峰值内存 {result['peak_mb']:7.1f} MB")
+    if 'json' in results:
+        print(f"快照加载耗时为JSON的 {results['snapshot']['seconds'] / results['json']['seconds']:.0%}，"
+              f"占用内存为 {results['snapshot']['retained_mb'] / results['json']['retained_mb']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+知识库近似重复检测
+对全部文档的Q&A答案文本计算MinHash签名，用LSH分桶找出候选对，
+图片Q&A按感知哈希（dHash）分组；近似重复的Q&A可以标记或合并
+"""
+
+import os
+import json
+import time
+import zlib
+import argparse
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Optional, Tuple, Callable
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("请安装numpy: pip install numpy")
+
+logger = logging.getLogger(__name__)
+
+DEDUP_MODES = ('flag', 'merge')
+
+# MinHash 排列数 = 分带数 × 每带行数；16×8 时候选阈值约为 (1/16)^(1/8) ≈ 0.71
+NUM_PERM = 128
+LSH_BANDS = 16
+# 答案文本按字符切分的片段长度
+SHINGLE_SIZE = 5
+# 大于 2^32 的素数：哈希值与系数都小于 2^32，乘积加常数不会溢出uint64
+MERSENNE_PRIME = np.uint64(4294967311)
+
+# dHash 64位分为8段：汉明距离不超过7的两张图片至少有一段完全相同
+PHASH_BANDS = 8
+MAX_IMAGE_DISTANCE = 6
+
+
+def answer_body(answer: str) -> str:
+    """去掉 enhance_answer 添加的"文档来源"前缀，只比较答案正文"""
+    if answer.startswith('文档来源：'):
+        _, _, answer = answer.partition('\n\n')
+    return answer
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> List[str]:
+    """去掉空白并转小写后按字符切分为重叠片段"""
+    text = ''.join(text.lower().split())
+    if len(text) <= size:
+        return [text] if text else []
+    return list({text[i:i + size] for i in range(len(text) - size + 1)})
+
+
+class MinHasher:
+    """MinHash签名：每个排列为 (a·x + b) mod p 的通用哈希"""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, 2 ** 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 2 ** 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, pieces: List[str]) -> np.ndarray:
+        hashes = np.fromiter((zlib.crc32(piece.encode('utf-8')) for piece in pieces),
+                             dtype=np.uint64, count=len(pieces))
+        return ((np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME).min(axis=0)
+
+
+class UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, item: int) -> int:
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a: int, b: int):
+        a, b = self.find(a), self.find(b)
+        # 较早出现的记录作为根，即合并后保留的那一条
+        if a < b:
+            self.parent[b] = a
+        elif b < a:
+            self.parent[a] = b
+
+
+def dhash(path: str) -> Optional[int]:
+    """图片的64位差分哈希；无法读取时返回None"""
+    try:
+        from PIL import Image
+        with Image.open(path) as image:
+            pixels = list(image.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    except Exception:
+        return None
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def _bucket_groups(keys: Iterable[Tuple[int, bytes]]) -> Iterable[List[int]]:
+    """按键分桶，产出成员数大于1的桶"""
+    buckets = {}
+    for item, key in keys:
+        buckets.setdefault(key, []).append(item)
+    return (members for members in buckets.values() if len(members) > 1)
+
+
+def _link_bucket(members: List[int], similar: Callable[[int, int], bool], groups: UnionFind):
+    """桶内每个成员只与各簇的代表比较，桶内成员互不相似时才退化为两两比较"""
+    representatives = []
+    for member in members:
+        for representative in representatives:
+            if groups.find(member) == groups.find(representative) or similar(member, representative):
+                groups.union(member, representative)
+                break
+        else:
+            representatives.append(member)
+
+
+def find_duplicates(documents: Iterable[Tuple[str, List[Dict[str, Any]]]],
+                    image_path: Optional[Callable[[Dict[str, Any]], str]] = None,
+                    threshold: float = 0.8, max_distance: int = MAX_IMAGE_DISTANCE) -> Dict[str, Any]:
+    """在整个语料中查找近似重复的Q&A
+
+    documents 为按文档顺序排列的 (文档标识, 问答对列表)；每个簇中最早出现的
+    Q&A为保留项。文本Q&A按答案正文的MinHash估计Jaccard相似度，
+    图片Q&A按感知哈希的汉明距离判断。
+    """
+    if max_distance >= PHASH_BANDS:
+        raise ValueError(f"图片汉明距离阈值必须小于 {PHASH_BANDS}")
+
+    records = []
+    for document, qa_pairs in documents:
+        for position, qa in enumerate(qa_pairs):
+            records.append((document, position, qa))
+
+    groups = UnionFind(len(records))
+    hasher = MinHasher()
+    rows = NUM_PERM // LSH_BANDS
+
+    # 文本：MinHash + LSH
+    text_items = []
+    signatures = []
+    for i, (_, _, qa) in enumerate(records):
+        if qa.get('type') == 'image':
+            continue
+        pieces = shingles(answer_body(qa['answer']))
+        if pieces:
+            text_items.append(i)
+            signatures.append(hasher.signature(pieces))
+    signature_matrix = np.vstack(signatures) if signatures else np.zeros((0, NUM_PERM), dtype=np.uint64)
+    row_of = {item: row for row, item in enumerate(text_items)}
+
+    def text_similarity(a: int, b: int) -> float:
+        return float(np.mean(signature_matrix[row_of[a]] == signature_matrix[row_of[b]]))
+
+    for band in range(LSH_BANDS):
+        band_keys = signature_matrix[:, band * rows:(band + 1) * rows]
+        keys = ((item, band_keys[row].tobytes()) for row, item in enumerate(text_items))
+        for members in _bucket_groups(keys):
+            _link_bucket(members, lambda a, b: text_similarity(a, b) >= threshold, groups)
+
+    # 图片：dHash按段分桶，段相同的候选再比较完整汉明距离
+    hashes = {}
+    cache = {}
+    for i, (_, _, qa) in enumerate(records):
+        if qa.get('type') != 'image' or not qa.get('image_hash'):
+            continue
+        if qa['image_hash'] not in cache:
+            cache[qa['image_hash']] = dhash(image_path(qa)) if image_path else None
+        value = cache[qa['image_hash']]
+        # 无法计算感知哈希时只合并内容完全相同的图片
+        hashes[i] = value if value is not None else qa['image_hash']
+
+    def image_distance(a: int, b: int) -> int:
+        if isinstance(hashes[a], int) and isinstance(hashes[b], int):
+            return bin(hashes[a] ^ hashes[b]).count('1')
+        return 0 if hashes[a] == hashes[b] else 64
+
+    for band in range(PHASH_BANDS):
+        keys = ((item, value.to_bytes(8, 'big')[band:band + 1] if isinstance(value, int) else value.encode())
+                for item, value in hashes.items())
+        for members in _bucket_groups(keys):
+            _link_bucket(members, lambda a, b: image_distance(a, b) <= max_distance, groups)
+
+    clusters = {}
+    for i in range(len(records)):
+        root = groups.find(i)
+        if root != i:
+            clusters.setdefault(root, []).append(i)
+
+    def describe(i: int) -> Dict[str, Any]:
+        document, position, qa = records[i]
+        return {'document': document, 'position': position, 'question': qa['question']}
+
+    result_clusters = []
+    removed_bytes = 0
+    for root, members in sorted(clusters.items()):
+        kind = 'image' if root in hashes else 'text'
+        duplicates = []
+        for member in members:
+            entry = describe(member)
+            if kind == 'text':
+                entry['similarity'] = round(text_similarity(root, member), 3)
+            else:
+                entry['similarity'] = round(1 - image_distance(root, member) / 64, 3)
+            duplicates.append(entry)
+            removed_bytes += len(records[member][2]['answer'].encode('utf-8'))
+        result_clusters.append({'kind': kind, 'canonical': describe(root), 'duplicates': duplicates})
+
+    return {
+        'threshold': threshold,
+        'max_image_distance': max_distance,
+        'documents': len({document for document, _, _ in records}),
+        'qa_pairs': len(records),
+        'duplicates': sum(len(cluster['duplicates']) for cluster in result_clusters),
+        'duplicate_answer_bytes': removed_bytes,
+        'text_clusters': sum(1 for cluster in result_clusters if cluster['kind'] == 'text'),
+        'image_clusters': sum(1 for cluster in result_clusters if cluster['kind'] == 'image'),
+        'clusters': result_clusters
+    }
+
+
+def apply_dedup(documents: Iterable[Tuple[str, List[Dict[str, Any]]]], report: Dict[str, Any],
+                mode: str = 'merge') -> Iterable[Tuple[str, List[Dict[str, Any]]]]:
+    """按检测结果产出去重后的 (文档标识, 问答对列表)
+
+    merge：删除重复项，保留项记录被合并的来源文档 merged_sources；
+    flag：保留所有Q&A，重复项带 duplicate_of 指向保留项。
+    """
+    if mode not in DEDUP_MODES:
+        raise ValueError(f"不支持的去重方式: {mode}")
+
+    duplicate_of = {}
+    merged_sources = {}
+    for cluster in report['clusters']:
+        canonical = (cluster['canonical']['document'], cluster['canonical']['position'])
+        for duplicate in cluster['duplicates']:
+            duplicate_of[(duplicate['document'], duplicate['position'])] = cluster['canonical']
+            if duplicate['document'] != canonical[0]:
+                merged_sources.setdefault(canonical, set()).add(duplicate['document'])
+
+    for document, qa_pairs in documents:
+        result = []
+        for position, qa in enumerate(qa_pairs):
+            key = (document, position)
+            if key in duplicate_of:
+                if mode == 'merge':
+                    continue
+                qa = dict(qa, duplicate_of={'document': duplicate_of[key]['document'],
+                                            'position': duplicate_of[key]['position']})
+            elif key in merged_sources:
+                qa = dict(qa, merged_sources=sorted(merged_sources[key]))
+            result.append(qa)
+        yield document, result
+
+
+def write_report(path: Path, report: Dict[str, Any]):
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def write_jsonl(path: Path, documents: Iterable[Tuple[str, List[Dict[str, Any]]]]) -> int:
+    """写出去重后的语料（每行一个问答对，带 document 字段），返回条数"""
+    count = 0
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for document, qa_pairs in documents:
+            for qa in qa_pairs:
+                f.write(json.dumps(dict(qa, document=document), ensure_ascii=False) + '\n')
+                count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def main():
+    """命令行入口"""
+    from qa_index import load_processed_outputs
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="知识库近似重复检测")
+    parser.add_argument('--output', default="已处理知识库", help="处理结果目录")
+    parser.add_argument('--mode', choices=DEDUP_MODES, default='merge', help="merge 删除重复项；flag 只标记")
+    parser.add_argument('--threshold', type=float, default=0.8, help="答案文本相似度阈值（默认0.8）")
+    parser.add_argument('--max-image-distance', type=int, default=MAX_IMAGE_DISTANCE,
+                        help=f"图片感知哈希的最大汉明距离（默认{MAX_IMAGE_DISTANCE}）")
+    args = parser.parse_args()
+
+    output_dir = Path(args.output)
+    started = time.perf_counter()
+    documents = list(load_processed_outputs(str(output_dir)))
+    report = find_duplicates(documents, lambda qa: str(output_dir / 'images' / qa['image_hash'][:2] /
+                                                      f"{qa['image_hash']}.{qa['image_format']}"),
+                             args.threshold, args.max_image_distance)
+    report['mode'] = args.mode
+    write_report(output_dir / 'dedup_report.json', report)
+    kept = write_jsonl(output_dir / 'deduplicated_qa.jsonl', apply_dedup(documents, report, args.mode))
+
+    print(f"共 {report['qa_pairs']} 个问答对，近似重复 {report['duplicates']} 个"
+          f"（文本 {report['text_clusters']} 组，图片 {report['image_clusters']} 组），"
+          f"输出 {kept} 个，耗时 {time.perf_counter() - started:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
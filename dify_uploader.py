@@ -0,0 +1,716 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dify知识库同步
+把 document_processor.py 生成的问答对以分段（segment）形式批量上传到Dify知识库：
+每个源文档对应知识库中的一个文档，问答对按内容哈希增量同步，只上传新增的、
+删除已消失的。请求由有界线程池中复用的 http.client 连接并发发送，失败时退避重试。
+同步进度记录在本地的同步状态中，中断后重新运行会从断点继续且不会重复上传。
+另带一个本地的Dify知识库API替身服务器，用于在没有Dify的环境中测试同步
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+import argparse
+import threading
+import http.client
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs, quote
+import logging
+
+from qa_index import load_processed_outputs
+
+logger = logging.getLogger(__name__)
+
+# 同步状态格式版本，格式不兼容时递增
+SYNC_STATE_VERSION = 1
+
+# 同步状态目录（位于处理结果目录下），每个知识库一个快照和一个日志
+SYNC_DIR_NAME = 'dify_sync'
+
+# 需要重试的HTTP状态码
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+# 其中表示服务器未处理请求的状态码：新建类的请求只在这些情况下直接重试，
+# 超时、连接中断和其他5xx时请求可能已经生效，需要先与远端核对
+UNPROCESSED_STATUSES = (408, 429, 503)
+# 退避重试的初始等待和最长等待（秒）
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# 等待新建文档完成索引的轮询间隔和最长时间（秒）
+INDEXING_POLL_INTERVAL = 0.5
+INDEXING_TIMEOUT = 600.0
+# 列出远端分段时每页的数量
+LIST_PAGE_SIZE = 100
+
+
+class DifyError(Exception):
+    """Dify API返回的错误"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}" if status else message)
+        self.status = status
+
+    @property
+    def ambiguous(self) -> bool:
+        """请求是否可能已在服务器上生效（超时、连接中断或服务器内部错误）"""
+        return self.status == 0 or (self.status >= 500 and self.status not in UNPROCESSED_STATUSES)
+
+
+class HTTPConnectionPool:
+    """基于 http.client 的连接池
+
+    请求在大小为 max_connections 的线程池中执行，协程通过 run_in_executor 等待结果，
+    同时进行的请求数不超过线程数。连接在请求之间保持（keep-alive）并复用。
+    """
+
+    def __init__(self, base_url: str, max_connections: int = 8, timeout: float = 60.0,
+                 headers: Optional[Dict[str, str]] = None):
+        parsed = urlsplit(base_url)
+        if parsed.scheme not in ('http', 'https'):
+            raise ValueError(f"不支持的URL: {base_url}")
+        self.connection_class = (http.client.HTTPSConnection if parsed.scheme == 'https'
+                                 else http.client.HTTPConnection)
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.base_path = parsed.path.rstrip('/')
+        self.max_connections = max(1, max_connections)
+        self.timeout = timeout
+        self.headers = {'Accept': 'application/json', **(headers or {})}
+        self.executor = ThreadPoolExecutor(max_workers=self.max_connections, thread_name_prefix='dify-http')
+        self.lock = threading.Lock()
+        self.idle = []
+        # 统计：新建的连接数和发出的请求数
+        self.connections_opened = 0
+        self.requests_sent = 0
+
+    async def request(self, method: str, path: str, payload: Any = None) -> Tuple[int, Dict[str, str], Any]:
+        """发送一个请求，返回 (状态码, 响应头, 解析后的JSON或文本)"""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._request, method, path, body)
+
+    def _request(self, method: str, path: str, body: Optional[bytes]) -> Tuple[int, Dict[str, str], Any]:
+        headers = dict(self.headers)
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        # 复用的连接可能已被服务器关闭，此时换一个新连接再试一次
+        while True:
+            connection, reused = self._acquire()
+            try:
+                connection.request(method, self.base_path + path, body=body, headers=headers)
+                with self.lock:
+                    self.requests_sent += 1
+                response = connection.getresponse()
+                content = response.read()
+            except ConnectionError:
+                connection.close()
+                if reused:
+                    continue
+                raise
+            except http.client.HTTPException as e:
+                connection.close()
+                raise ConnectionError(f"连接中断: {type(e).__name__} {e}") from e
+            except BaseException:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                with self.lock:
+                    self.idle.append(connection)
+            break
+
+        response_headers = {name.lower(): value for name, value in response.getheaders()}
+        text = content.decode('utf-8', errors='replace')
+        if text and 'json' in response_headers.get('content-type', ''):
+            return response.status, response_headers, json.loads(text)
+        return response.status, response_headers, text
+
+    def _acquire(self) -> Tuple[http.client.HTTPConnection, bool]:
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+            self.connections_opened += 1
+        return self.connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+        with self.lock:
+            for connection in self.idle:
+                connection.close()
+            self.idle = []
+
+
+class DifyDatasetClient:
+    """Dify知识库API（/datasets）的异步客户端：可重试的错误按指数退避重试"""
+
+    def __init__(self, base_url: str, api_key: str, dataset_id: str, concurrency: int = 8,
+                 retries: int = 5, timeout: float = 60.0):
+        self.dataset_id = dataset_id
+        self.retries = retries
+        self.pool = HTTPConnectionPool(base_url, concurrency, timeout, {'Authorization': f"Bearer {api_key}"})
+        self.retried = 0
+
+    async def call(self, method: str, path: str, payload: Any = None, idempotent: bool = True) -> Any:
+        """调用API并返回响应；网络错误、超时和可重试的状态码按指数退避重试
+
+        非幂等的请求（idempotent=False）只在服务器明确未处理时重试，
+        结果不确定时抛出 ambiguous 的 DifyError，由调用方核对远端状态。
+        """
+        path = f"/datasets/{self.dataset_id}{path}"
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                status, headers, data = await self.pool.request(method, path, payload)
+            except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+                error = DifyError(0, f"{method} {path}: {type(e).__name__} {e}")
+            else:
+                if status < 300:
+                    return data
+                message = data.get('message', '') if isinstance(data, dict) else str(data)[:200]
+                error = DifyError(status, f"{method} {path}: {message}")
+                if status not in RETRY_STATUSES:
+                    raise error
+                retry_after = headers.get('retry-after')
+            if attempt == self.retries or (not idempotent and error.ambiguous):
+                raise error
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            self.retried += 1
+            logger.debug(f"{error}，{delay:.1f}s 后重试")
+            await asyncio.sleep(delay)
+
+    async def create_document(self, name: str, text: str) -> Tuple[str, str]:
+        """按文本新建文档，返回 (文档ID, 索引批次)"""
+        data = await self.call('POST', '/document/create-by-text', {
+            'name': name,
+            'text': text,
+            'indexing_technique': 'high_quality',
+            'process_rule': {'mode': 'automatic'}
+        }, idempotent=False)
+        return data['document']['id'], data['batch']
+
+    async def find_document(self, name: str) -> Optional[str]:
+        """按名称查找文档，返回文档ID"""
+        page = 1
+        while True:
+            data = await self.call('GET', f"/documents?keyword={quote(name)}&page={page}&limit={LIST_PAGE_SIZE}")
+            for document in data.get('data', []):
+                if document.get('name') == name:
+                    return document['id']
+            if not data.get('has_more'):
+                return None
+            page += 1
+
+    async def wait_indexed(self, batch: str):
+        """等待新建的文档完成索引（索引完成前不能添加分段）"""
+        deadline = time.monotonic() + INDEXING_TIMEOUT
+        while True:
+            data = await self.call('GET', f"/documents/{batch}/indexing-status")
+            statuses = [item.get('indexing_status') for item in data.get('data', [])]
+            if statuses and all(status == 'completed' for status in statuses):
+                return
+            if any(status == 'error' for status in statuses):
+                raise DifyError(0, f"文档索引失败（批次 {batch}）")
+            if time.monotonic() > deadline:
+                raise DifyError(0, f"等待文档索引超时（批次 {batch}）")
+            await asyncio.sleep(INDEXING_POLL_INTERVAL)
+
+    async def add_segments(self, document_id: str, segments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        data = await self.call('POST', f"/documents/{document_id}/segments", {'segments': segments},
+                               idempotent=False)
+        return data['data']
+
+    async def list_segments(self, document_id: str) -> List[Dict[str, Any]]:
+        segments = []
+        page = 1
+        while True:
+            data = await self.call('GET', f"/documents/{document_id}/segments?page={page}&limit={LIST_PAGE_SIZE}")
+            segments.extend(data.get('data', []))
+            if not data.get('has_more'):
+                return segments
+            page += 1
+
+    async def delete_segment(self, document_id: str, segment_id: str):
+        await self.call('DELETE', f"/documents/{document_id}/segments/{segment_id}")
+
+    async def delete_document(self, document_id: str):
+        await self.call('DELETE', f"/documents/{document_id}")
+
+    def close(self):
+        self.pool.close()
+
+
+def segment_content(qa: Dict[str, Any]) -> str:
+    """问答对上传为分段时的正文"""
+    return f"问题：{qa.get('question', '')}\n答案：{qa.get('answer', '')}"
+
+
+def segment_hash(content: str) -> str:
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def document_title(source: str) -> str:
+    """新建文档时的正文（文档不能为空）；问答对随后作为分段添加"""
+    return f"来源文档：{source}"
+
+
+class SyncState:
+    """已同步到知识库的内容：源文档 -> {document_id, segments: {内容哈希: 分段ID}, complete}
+
+    每次改动远端之后立即追加一行日志（只追加并刷新，开销与改动数成正比），
+    同步结束时合并为快照。文档在改动开始前标记为未完成，中断后重新同步时
+    先与远端的分段列表核对，因此不会重复上传。
+    """
+
+    def __init__(self, sync_dir: Path, dataset_id: str):
+        self.snapshot_path = sync_dir / f"{dataset_id}.json"
+        self.journal_path = sync_dir / f"{dataset_id}.journal"
+        self.documents = {}
+        self.journal = None
+        sync_dir.mkdir(parents=True, exist_ok=True)
+        self.load()
+
+    def load(self):
+        if self.snapshot_path.exists():
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if snapshot.get('version') == SYNC_STATE_VERSION:
+                self.documents = snapshot['documents']
+        if self.journal_path.exists():
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self.apply(json.loads(line))
+                    except ValueError:
+                        # 中断时写了一半的最后一行
+                        break
+        self.journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def apply(self, event: Dict[str, Any]):
+        op = event['op']
+        source = event['source']
+        if op == 'creating':
+            self.documents[source] = {'document_id': None, 'segments': {}, 'complete': False}
+        elif op == 'create':
+            self.documents[source] = {'document_id': event['document_id'], 'segments': {}, 'complete': False}
+        elif op == 'begin':
+            self.documents[source]['complete'] = False
+        elif op == 'complete':
+            self.documents[source]['complete'] = True
+        elif op == 'add':
+            self.documents[source]['segments'].update(event['segments'])
+        elif op == 'delete':
+            for key in event['hashes']:
+                self.documents[source]['segments'].pop(key, None)
+        elif op == 'reset':
+            self.documents[source]['segments'] = event['segments']
+        elif op == 'drop':
+            self.documents.pop(source, None)
+
+    def record(self, op: str, source: str, **fields):
+        """应用一次改动并追加到日志"""
+        event = dict(op=op, source=source, **fields)
+        self.apply(event)
+        self.journal.write(json.dumps(event, ensure_ascii=False) + '\n')
+        self.journal.flush()
+
+    def save(self):
+        """原子地写出快照并清空日志"""
+        tmp_path = self.snapshot_path.with_name(f".{self.snapshot_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': SYNC_STATE_VERSION, 'documents': self.documents}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.snapshot_path)
+        self.journal.close()
+        self.journal = open(self.journal_path, 'w', encoding='utf-8')
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+
+class DifySync:
+    """把本地问答对增量同步到一个Dify知识库"""
+
+    def __init__(self, client: DifyDatasetClient, state: SyncState, batch_size: int = 50):
+        self.client = client
+        self.state = state
+        self.batch_size = max(1, batch_size)
+        self.stats = {'documents_created': 0, 'documents_deleted': 0, 'documents_failed': 0,
+                      'segments_added': 0, 'segments_deleted': 0, 'unchanged': 0}
+
+    async def sync(self, documents: Iterable[Tuple[str, List[Dict[str, Any]]]]):
+        local = OrderedDict()
+        for source, qa_pairs in documents:
+            segments = local.setdefault(source, OrderedDict())
+            for qa in qa_pairs:
+                content = segment_content(qa)
+                segments.setdefault(segment_hash(content), {
+                    'content': content,
+                    'keywords': list(qa.get('keywords', []))
+                })
+
+        removed = [source for source in self.state.documents if source not in local]
+        tasks = [self.sync_document(source, segments) for source, segments in local.items()]
+        tasks.extend(self.remove_document(source) for source in removed)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for source, result in zip(list(local) + removed, results):
+            if isinstance(result, BaseException):
+                if not isinstance(result, Exception):
+                    raise result
+                self.stats['documents_failed'] += 1
+                logger.error(f"同步失败 {source}: {result}")
+
+    async def sync_document(self, source: str, segments: Dict[str, Dict[str, Any]]):
+        entry = self.state.documents.get(source)
+        if entry is not None and not entry['complete']:
+            entry = await self.reconcile(source, entry)
+        if entry is None:
+            entry = await self.create_document(source)
+        elif entry['complete']:
+            if entry['segments'].keys() == segments.keys():
+                self.stats['unchanged'] += 1
+                return
+            self.state.record('begin', source)
+
+        try:
+            await self.apply_changes(source, entry, segments)
+        except DifyError as e:
+            if not e.ambiguous:
+                raise
+            # 部分请求结果不确定：与远端核对后再补一次
+            logger.warning(f"{e}，核对远端分段后重试: {source}")
+            entry = await self.reconcile(source, entry)
+            if entry is None:
+                raise
+            await self.apply_changes(source, entry, segments)
+        self.state.record('complete', source)
+
+    async def create_document(self, source: str) -> Dict[str, Any]:
+        # 先记录正在新建，新建请求结果不确定时下次按名称找回该文档
+        self.state.record('creating', source)
+        document_id, batch = await self.client.create_document(source, document_title(source))
+        self.state.record('create', source, document_id=document_id)
+        self.stats['documents_created'] += 1
+        await self.client.wait_indexed(batch)
+        return self.state.documents[source]
+
+    async def apply_changes(self, source: str, entry: Dict[str, Any], segments: Dict[str, Dict[str, Any]]):
+        """删除已消失的分段，按批添加新的分段"""
+        document_id = entry['document_id']
+        stale = [(key, segment_id) for key, segment_id in entry['segments'].items() if key not in segments]
+        missing = [key for key in segments if key not in entry['segments']]
+        await self.gather(self.delete_segment(source, document_id, key, segment_id) for key, segment_id in stale)
+        batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+        await self.gather(self.add_batch(source, document_id, keys, segments) for keys in batches)
+
+    @staticmethod
+    async def gather(coroutines: Iterable):
+        """并发执行，全部结束后再抛出第一个错误（保证状态记录完整）"""
+        for result in await asyncio.gather(*coroutines, return_exceptions=True):
+            if isinstance(result, BaseException):
+                raise result
+
+    async def add_batch(self, source: str, document_id: str, keys: List[str], segments: Dict[str, Dict[str, Any]]):
+        created = await self.client.add_segments(document_id, [segments[key] for key in keys])
+        # 按返回的正文重新计算哈希，与请求顺序无关
+        ids = {segment_hash(item['content']): item['id'] for item in created}
+        self.state.record('add', source, segments=ids)
+        self.stats['segments_added'] += len(ids)
+
+    async def delete_segment(self, source: str, document_id: str, key: Optional[str], segment_id: str):
+        try:
+            await self.client.delete_segment(document_id, segment_id)
+        except DifyError as e:
+            if e.status != 404:
+                raise
+        if key is not None:
+            self.state.record('delete', source, hashes=[key])
+        self.stats['segments_deleted'] += 1
+
+    async def reconcile(self, source: str, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """上次同步中断的文档：以远端实际存在的分段为准并删除重复的分段；
+        远端文档不存在时返回None"""
+        document_id = entry['document_id']
+        if document_id is None:
+            document_id = await self.client.find_document(source)
+            if document_id is None:
+                self.state.record('drop', source)
+                return None
+            self.state.record('create', source, document_id=document_id)
+        try:
+            remote = await self.client.list_segments(document_id)
+        except DifyError as e:
+            if e.status != 404:
+                raise
+            self.state.record('drop', source)
+            return None
+
+        title = document_title(source)
+        segments = {}
+        duplicates = []
+        for item in remote:
+            if item['content'] == title:
+                continue
+            key = segment_hash(item['content'])
+            if key in segments:
+                duplicates.append(item['id'])
+            else:
+                segments[key] = item['id']
+        self.state.record('reset', source, segments=segments)
+        await self.gather(self.delete_segment(source, document_id, None, segment_id) for segment_id in duplicates)
+        return self.state.documents[source]
+
+    async def remove_document(self, source: str):
+        entry = self.state.documents[source]
+        try:
+            document_id = entry['document_id'] or await self.client.find_document(source)
+            if document_id is not None:
+                await self.client.delete_document(document_id)
+        except DifyError as e:
+            if e.status != 404:
+                raise
+        self.state.record('drop', source)
+        self.stats['documents_deleted'] += 1
+
+
+def sync_to_dify(output_dir: str, base_url: str, api_key: str, dataset_id: str,
+                 documents: Optional[Iterable[Tuple[str, List[Dict[str, Any]]]]] = None,
+                 concurrency: int = 8, batch_size: int = 50, retries: int = 5) -> Dict[str, Any]:
+    """把处理结果中的问答对增量同步到Dify知识库，返回同步统计
+
+    documents 为 (源文档标识, 问答对列表)，默认读取 output_dir 中的全部处理结果。
+    部分文档同步失败时其余文档照常同步，失败的文档下次运行时重试。
+    """
+    if documents is None:
+        documents = load_processed_outputs(output_dir)
+    state = SyncState(Path(output_dir) / SYNC_DIR_NAME, dataset_id)
+    client = DifyDatasetClient(base_url, api_key, dataset_id, concurrency, retries)
+    syncer = DifySync(client, state, batch_size)
+    started = time.perf_counter()
+
+    async def run():
+        try:
+            await syncer.sync(documents)
+        finally:
+            client.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        state.save()
+        state.close()
+    return dict(syncer.stats, requests=client.pool.requests_sent, retries=client.retried,
+                connections=client.pool.connections_opened, seconds=time.perf_counter() - started)
+
+
+class StandInDataset:
+    """替身服务器中的知识库数据（内存中）"""
+
+    def __init__(self, indexing_delay: float):
+        self.indexing_delay = indexing_delay
+        self.lock = threading.Lock()
+        # 文档ID -> {name, batch, created, segments: OrderedDict(分段ID -> 分段)}
+        self.documents = {}
+        self.batches = {}
+
+    def indexing_status(self, document: Dict[str, Any]) -> str:
+        return 'completed' if time.monotonic() - document['created'] >= self.indexing_delay else 'indexing'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """实现同步用到的Dify知识库API子集，可注入延迟和随机失败"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'DifyStandIn/1.0'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def reply(self, status: int, payload: Any = None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else b''
+        self.send_response(status)
+        if body:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_api(self, method: str):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length)) if length else None
+        server.counter[method] = server.counter.get(method, 0) + 1
+        if server.latency:
+            time.sleep(server.latency)
+        if self.headers.get('Authorization') != f"Bearer {server.api_key}":
+            return self.reply(401, {'code': 'unauthorized', 'message': 'Access token is invalid'})
+        if server.fail_rate and random.random() < server.fail_rate:
+            return self.reply(503, {'code': 'unavailable', 'message': 'injected failure'})
+
+        parsed = urlsplit(self.path)
+        parts = parsed.path.strip('/').split('/')
+        if parts[:1] == ['v1']:
+            parts = parts[1:]
+        if len(parts) < 2 or parts[0] != 'datasets':
+            return self.reply(404, {'code': 'not_found', 'message': 'Not Found'})
+        dataset = server.datasets.setdefault(parts[1], StandInDataset(server.indexing_delay))
+        route = parts[2:]
+
+        with dataset.lock:
+            if method == 'POST' and route == ['document', 'create-by-text']:
+                document_id, batch = str(uuid.uuid4()), uuid.uuid4().hex
+                document = {'id': document_id, 'name': payload['name'], 'batch': batch,
+                            'created': time.monotonic(), 'segments': OrderedDict()}
+                dataset.documents[document_id] = document
+                dataset.batches[batch] = document_id
+                return self.reply(200, {'document': {'id': document_id, 'name': payload['name'],
+                                                     'indexing_status': 'waiting'}, 'batch': batch})
+
+            if method == 'GET' and len(route) == 3 and route[0] == 'documents' and route[2] == 'indexing-status':
+                document = dataset.documents.get(dataset.batches.get(route[1]))
+                if document is None:
+                    return self.reply(404, {'code': 'not_found', 'message': 'Documents not found.'})
+                return self.reply(200, {'data': [{'id': document['id'],
+                                                  'indexing_status': dataset.indexing_status(document)}]})
+
+            if method == 'GET' and route == ['documents']:
+                query = parse_qs(parsed.query)
+                keyword = query.get('keyword', [''])[0]
+                page = int(query.get('page', ['1'])[0])
+                limit = int(query.get('limit', ['20'])[0])
+                items = [{'id': document['id'], 'name': document['name'],
+                          'indexing_status': dataset.indexing_status(document)}
+                         for document in dataset.documents.values() if keyword in document['name']]
+                return self.reply(200, {'data': items[(page - 1) * limit:page * limit], 'total': len(items),
+                                        'has_more': page * limit < len(items), 'page': page, 'limit': limit})
+
+            if len(route) < 2 or route[0] != 'documents' or route[1] not in dataset.documents:
+                return self.reply(404, {'code': 'not_found', 'message': 'Document not found.'})
+            document = dataset.documents[route[1]]
+
+            if method == 'DELETE' and len(route) == 2:
+                del dataset.documents[route[1]]
+                return self.reply(204)
+
+            if len(route) == 3 and route[2] == 'segments':
+                if method == 'POST':
+                    if dataset.indexing_status(document) != 'completed':
+                        return self.reply(404, {'code': 'not_found', 'message': 'Document is not completed.'})
+                    created = []
+                    for segment in payload['segments']:
+                        item = {'id': str(uuid.uuid4()), 'content': segment['content'],
+                                'answer': segment.get('answer', ''), 'keywords': segment.get('keywords', []),
+                                'enabled': True}
+                        document['segments'][item['id']] = item
+                        created.append(item)
+                    return self.reply(200, {'data': created, 'doc_form': 'text_model'})
+                if method == 'GET':
+                    query = parse_qs(parsed.query)
+                    page = int(query.get('page', ['1'])[0])
+                    limit = int(query.get('limit', [str(LIST_PAGE_SIZE)])[0])
+                    items = list(document['segments'].values())
+                    selected = items[(page - 1) * limit:page * limit]
+                    return self.reply(200, {'data': selected, 'doc_form': 'text_model', 'total': len(items),
+                                            'has_more': page * limit < len(items), 'page': page, 'limit': limit})
+
+            if method == 'DELETE' and len(route) == 4 and route[2] == 'segments':
+                if document['segments'].pop(route[3], None) is None:
+                    return self.reply(404, {'code': 'not_found', 'message': 'Segment not found.'})
+                return self.reply(200, {'result': 'success'})
+
+        return self.reply(404, {'code': 'not_found', 'message': 'Not Found'})
+
+    def do_GET(self):
+        self.handle_api('GET')
+
+    def do_POST(self):
+        self.handle_api('POST')
+
+    def do_DELETE(self):
+        self.handle_api('DELETE')
+
+
+def create_stand_in_server(host: str = '127.0.0.1', port: int = 5001, api_key: str = 'dataset-test',
+                           latency: float = 0.0, fail_rate: float = 0.0,
+                           indexing_delay: float = 0.5) -> ThreadingHTTPServer:
+    """创建本地的Dify知识库API替身服务器（API地址为 http://host:port/v1）"""
+    server = ThreadingHTTPServer((host, port), StandInHandler)
+    server.daemon_threads = True
+    server.api_key = api_key
+    server.latency = latency
+    server.fail_rate = fail_rate
+    server.indexing_delay = indexing_delay
+    server.datasets = {}
+    server.counter = {}
+    return server
+
+
+def main():
+    """命令行入口"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Dify知识库同步")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sync_parser = subparsers.add_parser('sync', help="把处理结果中的问答对增量同步到Dify知识库")
+    sync_parser.add_argument('--output', default="已处理知识库", help="处理结果目录")
+    sync_parser.add_argument('--url', default=os.environ.get('DIFY_API_URL', 'http://localhost/v1'),
+                             help="Dify API地址（默认取环境变量 DIFY_API_URL）")
+    sync_parser.add_argument('--api-key', default=os.environ.get('DIFY_API_KEY'),
+                             help="知识库API密钥（默认取环境变量 DIFY_API_KEY）")
+    sync_parser.add_argument('--dataset', default=os.environ.get('DIFY_DATASET_ID'),
+                             help="知识库ID（默认取环境变量 DIFY_DATASET_ID）")
+    sync_parser.add_argument('--concurrency', type=int, default=8, help="同时进行的请求数（默认8）")
+    sync_parser.add_argument('--batch-size', type=int, default=50, help="每个请求添加的分段数（默认50）")
+    sync_parser.add_argument('--retries', type=int, default=5, help="单个请求的最多重试次数（默认5）")
+
+    serve_parser = subparsers.add_parser('serve', help="启动本地的Dify知识库API替身服务器，用于测试")
+    serve_parser.add_argument('--host', default='127.0.0.1', help="监听地址")
+    serve_parser.add_argument('--port', type=int, default=5001, help="监听端口（默认5001）")
+    serve_parser.add_argument('--api-key', default='dataset-test', help="接受的API密钥（默认 dataset-test）")
+    serve_parser.add_argument('--latency', type=float, default=0.0, help="每个请求的模拟延迟（秒）")
+    serve_parser.add_argument('--fail-rate', type=float, default=0.0, help="随机返回503的比例，用于测试重试")
+    serve_parser.add_argument('--indexing-delay', type=float, default=0.5, help="新建文档的模拟索引时间（秒）")
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        server = create_stand_in_server(args.host, args.port, args.api_key, args.latency,
+                                        args.fail_rate, args.indexing_delay)
+        logger.info(f"替身服务器已启动: http://{args.host}:{args.port}/v1（API密钥 {args.api_key}）")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            for dataset_id, dataset in server.datasets.items():
+                segments = sum(len(document['segments']) for document in dataset.documents.values())
+                logger.info(f"知识库 {dataset_id}: {len(dataset.documents)} 个文档，{segments} 个分段")
+            logger.info(f"请求数: {server.counter}")
+        return
+
+    if not args.api_key or not args.dataset:
+        parser.error("需要提供 --api-key 和 --dataset（或设置环境变量 DIFY_API_KEY、DIFY_DATASET_ID）")
+    stats = sync_to_dify(args.output, args.url, args.api_key, args.dataset,
+                         concurrency=args.concurrency, batch_size=args.batch_size, retries=args.retries)
+    logger.info(f"同步完成: 新建文档 {stats['documents_created']} 个，删除文档 {stats['documents_deleted']} 个，"
+                f"添加分段 {stats['segments_added']} 个，删除分段 {stats['segments_deleted']} 个，"
+                f"未变化 {stats['unchanged']} 个，失败 {stats['documents_failed']} 个；"
+                f"{stats['requests']} 个请求（重试 {stats['retries']} 次，{stats['connections']} 个连接），"
+                f"耗时 {stats['seconds']:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,67 +6,370 @@
 提取文本和图片内容，转换为Q&A格式
 """
 
+import time
+
+# 模块开始导入的时间，用于统计启动耗时（包括下面所有模块的导入）
+_IMPORT_STARTED = time.perf_counter()
+
 import os
-import sys
-import re
 import json
+import math
+import hashlib
+import argparse
+import importlib.util
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.util import Finalize
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from types import SimpleNamespace
+from typing import List, Dict, Any, Tuple, Optional, Iterator, TYPE_CHECKING
 import logging
 
-# 文档处理库
-try:
-    import docx
+from keyword_engine import TextMatchers, load_keyword_config
+from instrumentation import FileProfile, RunReport, profile_file, record_bytes, resume_profile, stage, timed_iter
+from output_writers import DEFAULT_OUTPUTS, OUTPUT_WRITERS, create_writers, tmp_path_for
+from records import DocumentRecord, QARecord, SectionRecord, TableRecord
+from corpus_snapshot import SNAPSHOT_NAME
+from supervisor import SupervisedPool, WorkerFailure
+
+if TYPE_CHECKING:
     from docx.document import Document
     from docx.oxml.table import CT_Tbl
+
+# 设置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+# 文档处理库按需加载：只处理Word文档的运行不需要导入PDF、Excel、PPT的解析库，
+# 缺少某个库也只禁用对应格式
+def _import_docx() -> SimpleNamespace:
+    import docx
+    from docx.oxml.table import CT_Tbl
     from docx.oxml.text.paragraph import CT_P
-    from docx.table import _Cell, Table
+    from docx.shared import Inches
     from docx.text.paragraph import Paragraph
-except ImportError:
-    print("请安装python-docx: pip install python-docx")
-    sys.exit(1)
-
-try:
-    import PyPDF2
-    import fitz  # PyMuPDF
-except ImportError:
-    print("请安装PDF处理库: pip install PyPDF2 PyMuPDF")
-    sys.exit(1)
-
-try:
-    import openpyxl
+    return SimpleNamespace(Document=docx.Document, CT_Tbl=CT_Tbl, CT_P=CT_P,
+                           Inches=Inches, Paragraph=Paragraph)
+
+
+def _import_pdf() -> SimpleNamespace:
+    try:
+        import pymupdf as fitz  # PyMuPDF >= 1.24
+    except ImportError:
+        import fitz  # PyMuPDF
+    return SimpleNamespace(open=fitz.open, Pixmap=fitz.Pixmap)
+
+
+def _import_excel() -> SimpleNamespace:
     from openpyxl import load_workbook
-except ImportError:
-    print("请安装openpyxl: pip install openpyxl")
-    sys.exit(1)
+    return SimpleNamespace(load_workbook=load_workbook)
+
 
-try:
+def _import_pptx() -> SimpleNamespace:
     from pptx import Presentation
     from pptx.enum.shapes import MSO_SHAPE_TYPE
-except ImportError:
-    print("请安装python-pptx: pip install python-pptx")
-    sys.exit(1)
-
-# 图像处理
-try:
-    from PIL import Image
-    import base64
-    from io import BytesIO
-except ImportError:
-    print("请安装Pillow: pip install Pillow")
-    sys.exit(1)
+    return SimpleNamespace(Presentation=Presentation, MSO_SHAPE_TYPE=MSO_SHAPE_TYPE)
+
+
+# 后端名称 -> (导入函数, 可选的顶层模块名, 安装提示)
+BACKENDS = {
+    'docx': (_import_docx, ('docx',), 'pip install python-docx'),
+    'pdf': (_import_pdf, ('pymupdf', 'fitz'), 'pip install PyMuPDF'),
+    'excel': (_import_excel, ('openpyxl',), 'pip install openpyxl'),
+    'pptx': (_import_pptx, ('pptx',), 'pip install python-pptx'),
+}
+
+# 文件扩展名 -> 所需后端
+FORMAT_BACKENDS = {
+    '.docx': 'docx',
+    '.doc': 'docx',
+    '.pdf': 'pdf',
+    '.xlsx': 'excel',
+    '.xls': 'excel',
+    '.pptx': 'pptx',
+    '.ppt': 'pptx'
+}
+
+_loaded_backends = {}
+# 后端名称 -> 导入耗时（秒），仅统计当前进程
+backend_load_times = {}
+
+
+def backend_available(name: str) -> bool:
+    """检查后端是否已安装（只查找模块，不导入）"""
+    if name in _loaded_backends:
+        return True
+    _, modules, _ = BACKENDS[name]
+    return any(importlib.util.find_spec(module) is not None for module in modules)
+
+
+def load_backend(name: str) -> SimpleNamespace:
+    """首次使用时导入后端并缓存"""
+    backend = _loaded_backends.get(name)
+    if backend is None:
+        importer, _, hint = BACKENDS[name]
+        started = time.perf_counter()
+        try:
+            backend = importer()
+        except ImportError as e:
+            raise ImportError(f"缺少{name}解析库，请安装: {hint}") from e
+        backend_load_times[name] = time.perf_counter() - started
+        logger.debug(f"已加载{name}解析库，耗时 {backend_load_times[name] * 1000:.0f} ms")
+        _loaded_backends[name] = backend
+    return backend
+
+
+# WordprocessingML中构成段落文本的元素（与python-docx的 CT_P.text、CT_R.text 取相同的元素）
+_W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_W_RUN = _W_NS + 'r'
+_W_HYPERLINK = _W_NS + 'hyperlink'
+_W_RUN_CONTENT = frozenset(_W_NS + name for name in ('br', 'cr', 'noBreakHyphen', 'ptab', 't', 'tab'))
+
+
+def word_paragraph_text(p) -> str:
+    """段落（w:p 元素）的文本，结果与python-docx的 Paragraph.text 相同
+
+    按子元素标签筛选，不再为每个段落和文本块各执行一次XPath查询；
+    换行、制表符等仍由python-docx的元素类转换为文本。
+    """
+    parts = []
+    for child in p:
+        if child.tag == _W_RUN:
+            parts.extend(str(item) for item in child if item.tag in _W_RUN_CONTENT)
+        elif child.tag == _W_HYPERLINK:
+            for run in child:
+                if run.tag == _W_RUN:
+                    parts.extend(str(item) for item in run if item.tag in _W_RUN_CONTENT)
+    return ''.join(parts)
+
+
+# 处理清单格式版本，格式不兼容时递增以触发全量重建
+MANIFEST_VERSION = 2
+
+
+class ImageBlobStore:
+    """按内容哈希寻址的图片存储
+
+    同一张图片（例如多个文档共用的Logo、截图）在整个知识库中只保存一份，
+    文档内容和Q&A中只记录哈希引用。
+    """
+
+    def __init__(self, root: Path, normalizer=None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        # 可选的图片规范化（缩放、重新编码、缩略图），见 image_normalizer.py
+        self.normalizer = normalizer
+        # 原始图片哈希 -> 规范化后的引用信息：同一进程中重复出现的图片只规范化一次
+        self._normalized = {}
+
+    def put(self, data: bytes, img_format: str) -> Dict[str, Any]:
+        """保存图片并返回引用信息"""
+        return self.put_many([(data, img_format)])[0]
+
+    def put_many(self, items: List[Tuple[Any, str]]) -> List[Dict[str, Any]]:
+        """保存一批图片，按输入顺序返回引用信息
+
+        启用规范化时在线程池中并行缩放和编码；输入可以是图片字节，
+        也可以是已解码的Pillow图片（例如由PDF像素直接构造）。
+        """
+        if self.normalizer is None:
+            return [self._write(data, img_format) for data, img_format in items]
+
+        keys = []
+        todo = {}
+        for data, img_format in items:
+            if isinstance(data, bytes):
+                key = hashlib.sha256(data).hexdigest()
+            else:
+                key = hashlib.sha256(f"{data.mode}{data.size}".encode() + data.tobytes()).hexdigest()
+            keys.append(key)
+            if key not in todo and not self._cached(key):
+                todo[key] = (data, (img_format or 'bin').lower())
+
+        for key, result in zip(todo, self.normalizer.map(list(todo.values()))):
+            info = self._write(result['data'], result['format'])
+            source = todo[key][0]
+            if isinstance(source, bytes):
+                info['original_size'] = len(source)
+            if 'width' in result:
+                info['width'] = result['width']
+                info['height'] = result['height']
+            if result.get('thumbnail'):
+                info['thumbnail'] = self._write(*result['thumbnail'])
+            self._normalized[key] = info
+
+        return [dict(self._normalized[key]) for key in keys]
+
+    def _cached(self, key: str) -> bool:
+        """缓存中有该图片、且图片文件（包括缩略图）仍在存储中
+
+        图片可能已被 remove_unreferenced 删除（例如监视模式或常驻进程池中，引用它的文档
+        被删除后又出现在新的文档中），此时需要重新写出。
+        """
+        info = self._normalized.get(key)
+        if info is None:
+            return False
+        if all((self.root / name).exists() for name in self.blob_names(info)):
+            return True
+        del self._normalized[key]
+        return False
 
-# 设置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+    def clear_cache(self):
+        """清空规范化结果的缓存"""
+        self._normalized.clear()
+
+    def _write(self, data: bytes, img_format: str) -> Dict[str, Any]:
+        """按内容哈希写入一个图片文件"""
+        img_format = (img_format or 'bin').lower()
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest, img_format)
+
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            # 先写临时文件再替换：并发写入同一哈希时内容相同，结果一致
+            tmp_path = tmp_path_for(path)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            record_bytes(written=len(data))
+
+        return {'hash': digest, 'format': img_format, 'size': len(data)}
+
+    def path_for(self, digest: str, img_format: str) -> Path:
+        """图片哈希对应的存储路径（按前两位分目录）"""
+        return self.root / digest[:2] / f"{digest}.{img_format}"
+
+    def blob_name(self, image: Dict[str, Any]) -> str:
+        """图片引用在存储目录中的相对路径"""
+        return self.path_for(image['hash'], image['format']).relative_to(self.root).as_posix()
+
+    def blob_names(self, image: Dict[str, Any]) -> List[str]:
+        """图片引用及其缩略图在存储目录中的相对路径"""
+        names = [self.blob_name(image)]
+        if image.get('thumbnail'):
+            names.append(self.blob_name(image['thumbnail']))
+        return names
+
+    def remove_unreferenced(self, referenced: set) -> int:
+        """删除不再被任何文档引用的图片，返回删除数量"""
+        removed = 0
+        for path in self.root.glob('*/*'):
+            if path.name.startswith('.'):
+                continue
+            if path.relative_to(self.root).as_posix() not in referenced:
+                path.unlink()
+                removed += 1
+        if removed:
+            self.clear_cache()
+        return removed
 
 class DocumentProcessor:
     """文档处理器主类"""
     
-    def __init__(self, input_dir: str, output_dir: str):
+    MANIFEST_NAME = 'manifest.json'
+    IMAGE_DIR_NAME = 'images'
+    CATALOG_NAME = 'knowledge_base.sqlite'
+    # SQLite存储时每个事务提交的文档数
+    CATALOG_BATCH_SIZE = 50
+    REPORT_NAME = 'run_report'
+    DEDUP_REPORT_NAME = 'dedup_report.json'
+    DEDUP_EXPORT_NAME = 'deduplicated_qa.jsonl'
+    # 单个文档按区间并行处理时，每个进程平均分到的区间数
+    PAGE_RANGES_PER_WORKER = 4
+    PROFILE_DIR_NAME = 'profiles'
+
+    def __init__(self, input_dir: str, output_dir: str, workers: int = 1, incremental: bool = True,
+                 stream_pdf: bool = False, memory_budget_mb: int = 256,
+                 stream_excel: bool = False, excel_chunk_rows: int = 100,
+                 index_dir: Optional[str] = None, storage: str = 'files',
+                 keywords_config: Optional[str] = None, profile: bool = False, report_top: int = 10,
+                 outputs: Optional[List[str]] = None, image_format: str = 'keep',
+                 image_max_dimension: int = 1600, thumbnail_size: int = 256, image_threads: int = 4,
+                 dedup: Optional[str] = None, dedup_threshold: float = 0.8,
+                 timeout: Optional[float] = None, memory_limit_mb: Optional[int] = None,
+                 chunk_size: int = 0, chunk_overlap: int = 100, chunk_unit: str = 'chars',
+                 vector_dir: Optional[str] = None, embedding_model: str = 'hashing', embedding_dim: int = 512,
+                 dify_url: Optional[str] = None, dify_api_key: Optional[str] = None,
+                 dataset_id: Optional[str] = None, upload_concurrency: int = 8, upload_batch_size: int = 50,
+                 page_workers: int = 1, split_min_pages: int = 50, snapshot: bool = False,
+                 queue_dir: Optional[str] = None, lease_ttl: float = 60.0, max_attempts: int = 3):
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
+        self.workers = max(1, workers)
+        self.incremental = incremental
+        # 流式PDF处理：逐页转换并写出，内存占用与页数无关
+        self.stream_pdf = stream_pdf
+        self.memory_budget_mb = memory_budget_mb
+        # Excel按行区间分块，每块重复表头，生成大小可控的表格Q&A
+        self.stream_excel = stream_excel
+        self.excel_chunk_rows = max(1, excel_chunk_rows)
+        # 本地BM25检索索引目录，处理完成后增量更新
+        self.index_dir = Path(index_dir) if index_dir else None
+        # 本地向量索引目录：向量按内容哈希缓存，只为新增或变化的问答对计算
+        self.vector_dir = Path(vector_dir) if vector_dir else None
+        self.embedding_model = embedding_model
+        self.embedding_dim = embedding_dim
+        self.embedder = None
+        # Dify知识库同步：设置知识库ID时，每次处理后把问答对的变化上传到知识库
+        self.dify_url = dify_url
+        self.dify_api_key = dify_api_key
+        self.dataset_id = dataset_id
+        self.upload_concurrency = upload_concurrency
+        self.upload_batch_size = upload_batch_size
+        # 输出存储：files 为每个文档按所选格式（--outputs）输出文件；sqlite 为单个数据库文件
+        if storage not in ('files', 'sqlite'):
+            raise ValueError(f"不支持的存储方式: {storage}")
+        self.storage = storage
+        self.catalog_path = self.output_dir / self.CATALOG_NAME
+        if storage == 'sqlite' and (stream_pdf or stream_excel):
+            logger.warning("SQLite存储由主进程批量写入，流式处理选项将被忽略")
+        # 知识库二进制快照：处理后更新，全库读取问答对时（去重、索引、同步等）直接从快照加载
+        self.snapshot = snapshot
+        if storage == 'sqlite' and snapshot:
+            logger.warning("SQLite存储已可按文档读取，不生成知识库快照")
+            self.snapshot = False
+        # 关键词词典和文本规则预编译一次，供Q&A转换重复使用
+        self.keywords_config = keywords_config
+        self.matchers = TextMatchers(load_keyword_config(keywords_config))
+        self.manifest_path = self.output_dir / self.MANIFEST_NAME
+        # 全库近似重复检测：flag 只标记，merge 删除重复项；None 为不检测
+        if dedup not in (None, 'flag', 'merge'):
+            raise ValueError(f"不支持的去重方式: {dedup}")
+        self.dedup = dedup
+        self.dedup_threshold = dedup_threshold
+        # 运行报告：每个文件各阶段的耗时、读写字节数和峰值内存
+        self.report = RunReport(top_n=report_top)
+        # 开启后每个文档都用cProfile记录，运行结束只保留最慢的 report_top 个
+        self.profile = profile
+        self.profile_dir = self.output_dir / self.PROFILE_DIR_NAME
+        # 图片规范化：keep 为原样保存；其他取值按最大边长缩放、按内容重新编码并生成缩略图
+        self.image_format = image_format
+        self.image_max_dimension = image_max_dimension
+        self.thumbnail_size = thumbnail_size
+        self.image_threads = image_threads
+        normalizer = None
+        if image_format != 'keep':
+            if importlib.util.find_spec('PIL') is None:
+                logger.warning("未安装Pillow（pip install Pillow），图片将原样保存")
+                self.image_format = 'keep'
+            else:
+                from image_normalizer import ImageNormalizer
+                normalizer = ImageNormalizer(image_format, image_max_dimension, thumbnail_size,
+                                             threads=image_threads)
+        self.image_store = ImageBlobStore(self.output_dir / self.IMAGE_DIR_NAME, normalizer)
+        # 检索用分块：章节正文按大小切分为相互重叠的分块，每块一个Q&A；0 为每个章节一个Q&A
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.chunk_unit = chunk_unit
+        self.chunker = None
+        if chunk_size > 0:
+            from chunker import Chunker
+            self.chunker = Chunker(chunk_size, chunk_overlap, chunk_unit)
+        # 单个大型PDF/PPT按页（幻灯片）区间拆分，由 page_workers 个进程并行处理
+        self.page_workers = max(1, page_workers)
+        self.split_min_pages = max(1, split_min_pages)
         
         # 支持的文件格式
         self.supported_formats = {
@@ -78,88 +381,685 @@ class DocumentProcessor:
             '.pptx': self.process_powerpoint,
             '.ppt': self.process_powerpoint
         }
+
+        # 解析库在首次使用时才导入；未安装的库只禁用对应格式
+        self.disabled_formats = {}
+        for ext, backend in FORMAT_BACKENDS.items():
+            if not backend_available(backend):
+                self.supported_formats.pop(ext)
+                self.disabled_formats[ext] = backend
+        for backend in sorted(set(self.disabled_formats.values())):
+            exts = ', '.join(ext for ext, name in self.disabled_formats.items() if name == backend)
+            logger.warning(f"未安装{backend}解析库（{BACKENDS[backend][2]}），已禁用格式: {exts}")
+        # 输出的Word文档同样依赖python-docx，缺失时跳过Word输出
+        self.word_output = 'docx' not in self.disabled_formats.values()
+        requested = list(outputs or DEFAULT_OUTPUTS)
+        if not self.word_output and 'docx' in requested:
+            requested.remove('docx')
+            logger.warning("未安装python-docx，跳过Word文档输出")
+        self.writers = create_writers(self, requested)
+        self.outputs = [writer.name for writer in self.writers]
+        self.word_output = 'docx' in self.outputs
+        if not self.writers and storage == 'files':
+            raise ValueError("没有可用的输出格式")
+        # 串行处理时由后台线程写出，与下一个文档的解析重叠（见 _process_serial）
+        self.write_executor = None
+        # 常驻进程池（监视模式在多次处理之间复用）；为None时每次运行临时创建
+        self.worker_pool = None
+        # 单个文件的处理时间和内存上限：设置任一项时每个文件都在受监督的工作进程中处理，
+        # 超限或崩溃的文件重试一次后被隔离，内容不变时以后的运行直接跳过
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.supervised = bool(timeout or memory_limit_mb)
+        # 分布式处理：待处理的文件写入共享目录中的工作队列，由其他主机上的工作进程领取处理
+        # （见 work_queue.py），本进程只汇总结果；结果由主进程写入的SQLite存储不支持
+        self.queue_dir = Path(queue_dir) if queue_dir else None
+        if self.queue_dir and storage == 'sqlite':
+            raise ValueError("分布式处理只支持 files 存储")
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max(1, max_attempts)
         
         self.processed_count = 0
+        self.skipped_count = 0
+        self.removed_count = 0
+        self.removed_documents = []
         
     def process_all_documents(self):
         """处理所有文档"""
         logger.info(f"开始处理目录: {self.input_dir}")
-        
-        for root, dirs, files in os.walk(self.input_dir):
-            for file in files:
-                file_path = Path(root) / file
+
+        with self.report.run.stage('plan'):
+            files = self.collect_documents()
+            manifest = self.load_manifest()
+            pending = self.plan_incremental_run(files, manifest)
+        self.process_pending(manifest, pending)
+
+    def process_pending(self, manifest: Dict[str, Any], pending: List[Tuple[Path, Dict[str, Any]]]):
+        """处理已规划的 (文件, 指纹) 列表，随后更新清单、图片存储、去重结果和检索索引"""
+        if self.queue_dir and pending:
+            logger.info(f"把 {len(pending)} 个文件写入工作队列: {self.queue_dir}")
+            results = self._process_distributed([file_path for file_path, _ in pending])
+        elif self.supervised and pending:
+            logger.info(f"使用 {self.workers} 个受监督的进程处理 {len(pending)} 个文件")
+            results = self._process_parallel([file_path for file_path, _ in pending])
+        elif self.workers > 1 and len(pending) > 1:
+            logger.info(f"使用 {self.workers} 个进程并行处理 {len(pending)} 个文件")
+            results = self._process_parallel([file_path for file_path, _ in pending])
+        else:
+            results = self._process_serial([file_path for file_path, _ in pending])
+
+        catalog = self.open_catalog() if self.storage == 'sqlite' else None
+        if catalog:
+            for key in self.removed_documents:
+                catalog.remove_document(key)
+
+        # 结果按文件顺序返回，计数与日志顺序与串行模式一致
+        updated = []
+        fresh_qa = {}
+        for (file_path, fingerprint), (_, result, error) in zip(pending, results):
+            if result:
+                self.report.add(result.pop('profile', None))
+            if error is None:
+                key = self.document_key(file_path)
+                self.processed_count += 1
+                self.record_outputs(manifest, file_path, fingerprint, result)
+                updated.append(key)
+                if catalog:
+                    with self.report.run.stage('catalog'):
+                        self.write_to_catalog(catalog, key, result.get('catalog'))
+                        if result.get('catalog'):
+                            fresh_qa[key] = result['catalog']['qa_pairs']
+                        if self.processed_count % self.CATALOG_BATCH_SIZE == 0:
+                            catalog.commit()
+            elif result and 'quarantine' in result:
+                # 隔离：内容不变时以后的运行不再重试
+                logger.error(f"隔离文件 {file_path}: {error}")
+                manifest.setdefault('quarantine', {})[self.document_key(file_path)] = dict(
+                    fingerprint, **result['quarantine'])
+            else:
+                # 保留旧的清单条目：指纹不匹配，下次运行会重试
+                logger.error(f"处理文件 {file_path} 时出错: {error}")
+
+        if catalog:
+            with self.report.run.stage('catalog'):
+                catalog.close()
+        # 文档已全部处理完，释放图片规范化的线程池（监视模式下一批处理时重新创建）
+        self.close()
+        manifest['storage'] = self.storage
+        manifest['outputs'] = self.outputs
+        manifest['image_options'] = self.image_options()
+        manifest['chunk_options'] = self.chunk_options()
+        # 去重方式变化时检索索引需要全量重建
+        dedup_changed = manifest.get('dedup') != self.dedup
+        manifest['dedup'] = self.dedup
+        # 向量化方式变化时向量索引需要重建
+        embedding_changed = manifest.get('embedding') != self.embedding_spec()
+        manifest['embedding'] = self.embedding_spec()
+        self.save_manifest(manifest)
+        if pending or self.removed_count:
+            with self.report.run.stage('images_gc'):
+                self.collect_image_garbage(manifest)
+
+        changed = bool(updated or self.removed_documents or dedup_changed)
+        if self.snapshot and (updated or self.removed_documents or not (self.output_dir / SNAPSHOT_NAME).exists()):
+            with self.report.run.stage('snapshot'):
+                self.update_snapshot()
+        index_stale = self.index_dir and (changed or not self.index_is_current())
+        deduplicated = None
+        if self.dedup and (changed or index_stale or not (self.output_dir / self.DEDUP_REPORT_NAME).exists()):
+            with self.report.run.stage('dedup'):
+                deduplicated = self.deduplicate()
+        elif not self.dedup and dedup_changed:
+            self.remove_outputs([self.DEDUP_REPORT_NAME, self.DEDUP_EXPORT_NAME])
+        if index_stale:
+            with self.report.run.stage('index'):
+                self.update_qa_index(manifest, updated, fresh_qa, deduplicated, rebuild=dedup_changed)
+        if self.vector_dir and (changed or embedding_changed or not (self.vector_dir / 'meta.json').exists()):
+            with self.report.run.stage('vectors'):
+                self.update_vector_index(deduplicated)
+        if self.dataset_id:
+            # 每次都与同步状态比较（没有变化时不发请求），上次上传失败的部分也会补传
+            with self.report.run.stage('upload'):
+                self.upload_to_dify(deduplicated)
+        self.removed_documents = []
+        self.report.quarantined = [dict(entry, file=key)
+                                   for key, entry in sorted(manifest.get('quarantine', {}).items())]
+        logger.info(f"处理完成，共处理 {self.processed_count} 个文件，"
+                    f"跳过未变化 {self.skipped_count} 个，清理已删除 {self.removed_count} 个")
+        if backend_load_times:
+            timings = ', '.join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in backend_load_times.items())
+            logger.info(f"解析库加载耗时（主进程）: {timings}")
+        self.write_run_report()
+
+    def write_run_report(self):
+        """写出运行报告；开启性能分析时只保留最慢文档的cProfile结果"""
+        summary = self.report.write(self.output_dir, self.REPORT_NAME)
+        self.report.log_summary(summary)
+        logger.info(f"运行报告: {self.output_dir / (self.REPORT_NAME + '.json')}")
+
+        if self.profile and self.profile_dir.exists():
+            keep = {f"{self.output_stem(self.input_dir / item['file'])}.prof" for item in self.report.slowest()}
+            for path in self.profile_dir.glob('*.prof'):
+                if path.name not in keep:
+                    path.unlink()
+            logger.info(f"最慢的 {len(keep)} 个文档的性能分析结果: {self.profile_dir}")
+
+    def collect_documents(self) -> List[Path]:
+        """收集所有支持的文档，按相对路径排序以保证处理顺序稳定"""
+        files = []
+        for root, dirs, names in os.walk(self.input_dir):
+            for name in names:
+                file_path = Path(root) / name
                 if file_path.suffix.lower() in self.supported_formats:
-                    try:
-                        logger.info(f"处理文件: {file_path}")
-                        self.process_single_document(file_path)
-                        self.processed_count += 1
-                    except Exception as e:
-                        logger.error(f"处理文件 {file_path} 时出错: {str(e)}")
-                        
-        logger.info(f"处理完成，共处理 {self.processed_count} 个文件")
-        
-    def process_single_document(self, file_path: Path):
-        """处理单个文档"""
+                    files.append(file_path)
+
+        files.sort(key=self.document_key)
+        return files
+
+    def document_key(self, file_path: Path) -> str:
+        """文档在清单中的键：相对于输入目录的POSIX路径"""
+        return file_path.relative_to(self.input_dir).as_posix()
+
+    def source_key(self, source_file: str) -> str:
+        """Q&A中记录的来源文档：输入目录中的文档为相对路径，其他为原路径"""
+        try:
+            return self.document_key(Path(source_file))
+        except ValueError:
+            return str(source_file)
+
+    def output_stem(self, file_path: Path) -> str:
+        """输出文件名前缀：原文件名 + 相对路径摘要
+
+        只依赖文档自身的相对路径，新增或删除其他文件不会改变它；
+        摘要用于区分不同目录下的同名文件（以及同名不同扩展名的文件）。
+        """
+        digest = hashlib.sha1(self.document_key(file_path).encode('utf-8')).hexdigest()[:8]
+        return f"{file_path.stem}_{digest}"
+
+    def load_manifest(self) -> Dict[str, Any]:
+        """读取输出目录中的处理清单"""
+        if self.manifest_path.exists():
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get('version') == MANIFEST_VERSION:
+                    return manifest
+                logger.warning(f"清单版本不匹配，将全量重建: {self.manifest_path}")
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取清单 {self.manifest_path} 时出错，将全量重建: {str(e)}")
+
+        return {'version': MANIFEST_VERSION, 'documents': {}}
+
+    def save_manifest(self, manifest: Dict[str, Any]):
+        """原子地写回处理清单"""
+        write_json_atomic(self.manifest_path, manifest)
+
+    def plan_incremental_run(self, files: List[Path], manifest: Dict[str, Any]) -> List[Tuple[Path, Dict[str, Any]]]:
+        """对比清单，返回需要处理的 (文件, 指纹) 列表，并清理已删除源文件的输出"""
+        documents = manifest['documents']
+        pending = []
+        seen = set()
+        # 切换存储方式、输出格式、图片规范化或分块配置后需要全部重新处理（旧的输出在 record_outputs 中清理）
+        incremental = (self.incremental and manifest.get('storage', 'files') == self.storage
+                       and (self.storage != 'files' or manifest.get('outputs', DEFAULT_OUTPUTS) == self.outputs)
+                       and manifest.get('image_options') == self.image_options()
+                       and manifest.get('chunk_options') == self.chunk_options())
+
+        for file_path in files:
+            seen.add(self.document_key(file_path))
+            fingerprint = self.check_changed(file_path, manifest, incremental)
+            if fingerprint is None:
+                self.skipped_count += 1
+            else:
+                pending.append((file_path, fingerprint))
+
+        for key in sorted(set(documents) - seen):
+            # 解析库缺失导致格式被禁用时保留已有输出
+            if Path(key).suffix.lower() in self.disabled_formats:
+                continue
+            self.remove_document(manifest, key)
+        for key in sorted(set(manifest.get('quarantine', {})) - seen):
+            del manifest['quarantine'][key]
+
+        return pending
+
+    def check_changed(self, file_path: Path, manifest: Dict[str, Any],
+                      incremental: bool = True) -> Optional[Dict[str, Any]]:
+        """文件相对清单有变化时返回新的指纹，未变化时返回None"""
+        stat = file_path.stat()
+        key = self.document_key(file_path)
+        entry = manifest['documents'].get(key)
+
+        # 已隔离且未修改的文件不再重试（--full 时重试）
+        quarantined = manifest.get('quarantine', {}).get(key)
+        if (incremental and quarantined
+                and quarantined['size'] == stat.st_size and quarantined['mtime_ns'] == stat.st_mtime_ns):
+            logger.warning(f"跳过已隔离的文件（{quarantined['reason']}）: {key}")
+            return None
+
+        # 大小和修改时间都未变化时无需读取文件内容
+        if (incremental and entry
+                and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns):
+            return None
+
+        fingerprint = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': file_sha256(file_path)
+        }
+
+        # 仅修改时间变化（例如重新同步）而内容相同
+        if incremental and entry and entry['sha256'] == fingerprint['sha256']:
+            entry.update(fingerprint)
+            return None
+        return fingerprint
+
+    def remove_document(self, manifest: Dict[str, Any], key: str):
+        """源文件已删除：清理其输出并从清单中移除"""
+        manifest.get('quarantine', {}).pop(key, None)
+        entry = manifest['documents'].pop(key, None)
+        if entry is None:
+            return
+        logger.info(f"源文件已删除，清理输出: {key}")
+        self.remove_outputs(entry['outputs'])
+        self.removed_documents.append(key)
+        self.removed_count += 1
+
+    def image_options(self) -> Optional[Dict[str, Any]]:
+        """图片规范化配置；原样保存时为None"""
+        normalizer = self.image_store.normalizer
+        return normalizer.options() if normalizer else None
+
+    def chunk_options(self) -> Optional[Dict[str, Any]]:
+        """分块配置；不分块时为None"""
+        return self.chunker.options() if self.chunker else None
+
+    def record_outputs(self, manifest: Dict[str, Any], file_path: Path,
+                       fingerprint: Dict[str, Any], result: Dict[str, Any]):
+        """更新清单条目，并删除旧版本遗留而本次未生成的输出"""
+        key = self.document_key(file_path)
+        names = [output.name for output in result['outputs']]
+        previous = manifest['documents'].get(key)
+        if previous:
+            self.remove_outputs([name for name in previous['outputs'] if name not in names])
+
+        manifest['documents'][key] = dict(fingerprint, outputs=names, images=result['images'])
+        manifest.get('quarantine', {}).pop(key, None)
+
+    def collect_image_garbage(self, manifest: Dict[str, Any]):
+        """清理图片存储中不再被任何文档引用的图片"""
+        referenced = set()
+        for entry in manifest['documents'].values():
+            referenced.update(entry.get('images', []))
+
+        removed = self.image_store.remove_unreferenced(referenced)
+        if removed:
+            logger.info(f"已清理 {removed} 张未被引用的图片")
+
+    def open_catalog(self):
+        """打开SQLite知识库目录"""
+        from catalog_store import CatalogStore
+        return CatalogStore(str(self.catalog_path))
+
+    def write_to_catalog(self, catalog, key: str, payload: Optional[Dict[str, Any]]):
+        """把一个文档的处理结果写入SQLite目录；没有Q&A时删除旧记录"""
+        if payload:
+            catalog.add_document(key, payload['content'], payload['qa_pairs'])
+        else:
+            catalog.remove_document(key)
+
+    def update_qa_index(self, manifest: Dict[str, Any], updated: List[str],
+                        fresh_qa: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                        deduplicated: Optional[List[Tuple[str, List[Dict[str, Any]]]]] = None,
+                        rebuild: bool = False):
+        """把本次处理和删除的文档同步到本地检索索引
+
+        启用去重时，一个文档的变化可能改变其他文档中Q&A的去重结果，
+        因此由去重后的全库语料（deduplicated）重建索引。
+        """
+        from qa_index import QAIndex, QA_OUTPUT_SUFFIXES, build_index, read_qa_output
+
+        # 索引不存在或版本不匹配时只能全量重建，不能在旧文件上增量追加
+        if deduplicated is not None or rebuild or not self.index_is_current():
+            index = build_index(str(self.output_dir), str(self.index_dir), deduplicated)
+            logger.info(f"已建立检索索引: {self.index_dir}（{index.num_rows} 个问答对）")
+            return
+
+        index = QAIndex.open(str(self.index_dir))
+        for key in self.removed_documents:
+            index.remove_document(key)
+        for key in updated:
+            qa_pairs = (fresh_qa or {}).get(key, [])
+            for name in manifest['documents'][key]['outputs']:
+                if name.endswith(QA_OUTPUT_SUFFIXES):
+                    qa_pairs = read_qa_output(self.output_dir / name)
+                    break
+            index.add_document(key, qa_pairs)
+        index.save()
+        logger.info(f"已更新检索索引: 更新 {len(updated)} 个文档，删除 {len(self.removed_documents)} 个文档")
+
+    def index_is_current(self) -> bool:
+        """检索索引存在且为当前版本"""
+        from qa_index import index_is_current
+        return index_is_current(self.index_dir)
+
+    def update_snapshot(self):
+        """更新知识库快照：只解析本次重新处理的文档，其余文档从旧快照复制"""
+        from corpus_snapshot import build_snapshot
+
+        stats = build_snapshot(str(self.output_dir))
+        logger.info(f"已更新知识库快照: {stats['documents']} 个文档，{stats['qa_pairs']} 个问答对，"
+                    f"{stats['bytes'] / 1024:.0f} KB（解析 {stats['parsed']} 个文档，耗时 {stats['seconds']:.2f} s）")
+
+    def embedding_spec(self) -> Optional[Dict[str, Any]]:
+        """向量化配置；未启用向量索引时为None"""
+        if not self.vector_dir:
+            return None
+        from vector_index import embedder_spec
+        return embedder_spec(self.embedding_model, self.embedding_dim)
+
+    def update_vector_index(self, deduplicated: Optional[List[Tuple[str, List[Dict[str, Any]]]]] = None):
+        """重建本地向量索引：缓存中已有的向量直接复用，只为新增或变化的问答对计算向量"""
+        from vector_index import build_vector_index, create_embedder
+
+        # 向量化器（可能是本地模型）只加载一次，监视模式下在多个批次间复用
+        if self.embedder is None:
+            self.embedder = create_embedder(self.embedding_spec())
+        stats = build_vector_index(str(self.output_dir), str(self.vector_dir),
+                                   documents=deduplicated, embedder=self.embedder)
+        logger.info(f"已更新向量索引: {self.vector_dir}（{stats['num_rows']} 个问答对，"
+                    f"新计算 {stats['embedded']} 个，复用缓存 {stats['cached']} 个）")
+
+    def upload_to_dify(self, deduplicated: Optional[List[Tuple[str, List[Dict[str, Any]]]]] = None):
+        """把问答对的变化同步到Dify知识库"""
+        from dify_uploader import sync_to_dify
+
+        stats = sync_to_dify(str(self.output_dir), self.dify_url, self.dify_api_key, self.dataset_id,
+                             documents=deduplicated, concurrency=self.upload_concurrency,
+                             batch_size=self.upload_batch_size)
+        logger.info(f"已同步到Dify知识库 {self.dataset_id}: 新建文档 {stats['documents_created']} 个，"
+                    f"删除文档 {stats['documents_deleted']} 个，添加分段 {stats['segments_added']} 个，"
+                    f"删除分段 {stats['segments_deleted']} 个，{stats['requests']} 个请求，"
+                    f"耗时 {stats['seconds']:.1f} s")
+        if stats['documents_failed']:
+            logger.warning(f"{stats['documents_failed']} 个文档同步失败，将在下次运行时重试")
+
+    def deduplicate(self) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        """对整个知识库做近似重复检测，写出报告和去重后的语料，返回去重后的 (文档, 问答对列表)"""
+        from dedup import apply_dedup, find_duplicates, write_jsonl, write_report
+        from qa_index import load_processed_outputs
+
+        documents = list(load_processed_outputs(str(self.output_dir)))
+        report = find_duplicates(
+            documents,
+            lambda qa: str(self.image_store.path_for(qa['image_hash'], qa['image_format'])),
+            self.dedup_threshold
+        )
+        report['mode'] = self.dedup
+        write_report(self.output_dir / self.DEDUP_REPORT_NAME, report)
+
+        deduplicated = list(apply_dedup(documents, report, self.dedup))
+        kept = write_jsonl(self.output_dir / self.DEDUP_EXPORT_NAME, deduplicated)
+        action = '删除' if self.dedup == 'merge' else '标记'
+        logger.info(f"近似重复检测: 共 {report['qa_pairs']} 个问答对，{action} {report['duplicates']} 个"
+                    f"（文本 {report['text_clusters']} 组，图片 {report['image_clusters']} 组，"
+                    f"答案共 {report['duplicate_answer_bytes'] / 1024:.0f} KB），去重后 {kept} 个")
+        return deduplicated
+
+    def close(self):
+        """关闭图片规范化的线程池并清空其结果缓存；之后再处理文档时会重新创建"""
+        if self.image_store.normalizer:
+            self.image_store.normalizer.close()
+        self.image_store.clear_cache()
+
+    def remove_outputs(self, names: List[str]):
+        """删除输出目录中的文件"""
+        for name in names:
+            try:
+                (self.output_dir / name).unlink()
+            except FileNotFoundError:
+                pass
+
+    def _process_one(self, file_path: Path) -> Tuple[Path, Optional[Dict[str, Any]], Optional[str]]:
+        """处理单个文档，返回 (文件路径, 处理结果, 错误信息)
+
+        处理结果中的 profile 为该文件的分阶段计时；出错时结果只包含 profile。
+        """
+        profile_path = self.profile_dir / f"{self.output_stem(file_path)}.prof" if self.profile else None
+        profile = None
+        try:
+            logger.info(f"处理文件: {file_path}")
+            with profile_file(self.document_key(file_path), profile_path) as profile:
+                result = self.process_single_document(file_path)
+            deferred = result.pop('deferred', None)
+            if deferred:
+                # 写出完成后再汇总计时（见 _finish_writes）
+                future = self.write_executor.submit(self.write_outputs, *deferred, profile)
+                result['pending'] = (future, profile)
+            else:
+                result['profile'] = profile.to_dict()
+            return file_path, result, None
+        except Exception as e:
+            return file_path, {'profile': profile.to_dict()} if profile else None, str(e)
+
+    def _process_serial(self, files: List[Path]):
+        """串行处理文档：写出在后台线程中进行，与下一个文档的解析重叠
+
+        同一时刻最多一个文档在写出，结果仍按输入顺序产出。进程的峰值内存在下一个
+        文档开始时重置，因此运行报告中相邻两个文档的峰值内存都包含重叠期间
+        （前一个文档写出、后一个文档解析）的内存，各文件的峰值并不互斥。
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.write_executor = executor
+            try:
+                previous = None
+                for file_path in files:
+                    current = self._process_one(file_path)
+                    if previous is not None:
+                        yield self._finish_writes(previous)
+                    previous = current
+                if previous is not None:
+                    yield self._finish_writes(previous)
+            finally:
+                self.write_executor = None
+
+    def _finish_writes(self, processed: Tuple[Path, Optional[Dict[str, Any]], Optional[str]]):
+        """等待后台写出完成，返回与 _process_one 相同结构的结果"""
+        file_path, result, error = processed
+        if result is None or 'pending' not in result:
+            return processed
+
+        future, profile = result.pop('pending')
+        try:
+            future.result()
+        except Exception as e:
+            return file_path, {'profile': profile.to_dict()}, str(e)
+        result['profile'] = profile.to_dict()
+        return file_path, result, None
+
+    def _process_parallel(self, files: List[Path]):
+        """使用进程池并行处理文档，按输入顺序产出结果"""
+        # chunksize=1: 各文件耗时差异很大，逐个分发以均衡负载
+        if self.worker_pool is not None:
+            results = self.worker_pool.map(_process_in_worker, files, chunksize=1)
+            yield from self._check_failures(files, results)
+            return
+        with self.create_worker_pool() as executor:
+            results = executor.map(_process_in_worker, files, chunksize=1)
+            yield from self._check_failures(files, results)
+
+    def _process_distributed(self, files: List[Path]):
+        """通过共享目录中的工作队列分发给各工作进程处理，全部完成后按输入顺序产出结果
+
+        工作进程按队列中记录的构造参数重建处理器，输出写入共享的输出目录，
+        完成报告中的输出文件名在这里还原为本机路径。
+        """
+        from work_queue import WorkQueue
+
+        queue = WorkQueue(str(self.queue_dir))
+        keys = [self.document_key(file_path) for file_path in files]
+        options = dict(self.worker_options(), timeout=self.timeout, memory_limit_mb=self.memory_limit_mb)
+        state = queue.start_run(keys, options, lease_ttl=self.lease_ttl, max_attempts=self.max_attempts)
+        try:
+            reports = queue.wait(state, keys)
+        finally:
+            queue.finish_run(state)
+        workers = {report['worker'] for report in reports.values()}
+        logger.info(f"工作队列处理完成：{len(reports)} 个文件，由 {len(workers)} 个工作进程处理")
+        for file_path, key in zip(files, keys):
+            report = reports[key]
+            result = report['result']
+            if result and 'outputs' in result:
+                result['outputs'] = [self.output_dir / name for name in result['outputs']]
+            yield file_path, result, report['error']
+
+    def _check_failures(self, files: List[Path], results: Iterator[Any]):
+        """把受监督进程池中被杀掉或崩溃的任务转换为带隔离信息的错误结果"""
+        for file_path, outcome in zip(files, results):
+            if not isinstance(outcome, WorkerFailure):
+                yield outcome
+                continue
+            profile = FileProfile(self.document_key(file_path))
+            profile.wall = outcome.elapsed
+            profile.error = outcome.reason
+            quarantine = {'reason': outcome.reason, 'attempts': outcome.attempts, 'time': time.time()}
+            yield file_path, {'profile': profile.to_dict(), 'quarantine': quarantine}, outcome.reason
+
+    def create_worker_pool(self):
+        """创建处理文档的进程池（每个工作进程初始化一个处理器）
+
+        设置了超时或内存上限时使用受监督的进程池，可以单独杀掉卡住的工作进程。
+        """
+        initargs = (str(self.input_dir), str(self.output_dir), self.worker_options())
+        if self.supervised:
+            return SupervisedPool(self.workers, initializer=_init_worker, initargs=initargs,
+                                  timeout=self.timeout, memory_limit_mb=self.memory_limit_mb)
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=initargs)
+
+    def worker_options(self) -> Dict[str, Any]:
+        """工作进程中重建处理器所需的构造参数"""
+        return {
+            'incremental': self.incremental,
+            'stream_pdf': self.stream_pdf,
+            'memory_budget_mb': self.memory_budget_mb,
+            'stream_excel': self.stream_excel,
+            'excel_chunk_rows': self.excel_chunk_rows,
+            'storage': self.storage,
+            'keywords_config': self.keywords_config,
+            'profile': self.profile,
+            'outputs': self.outputs,
+            'image_format': self.image_format,
+            'image_max_dimension': self.image_max_dimension,
+            'thumbnail_size': self.thumbnail_size,
+            'image_threads': self.image_threads,
+            'chunk_size': self.chunk_size,
+            'chunk_overlap': self.chunk_overlap,
+            'chunk_unit': self.chunk_unit,
+            'page_workers': self.page_workers,
+            'split_min_pages': self.split_min_pages
+        }
+
+    def page_ranges(self, count: int) -> List[Tuple[int, int]]:
+        """把 count 页（或幻灯片）拆分为并行处理的 [起始, 结束) 区间；不需要拆分时返回空列表
+
+        每个进程分到若干个区间，图片较多的页集中在一处时负载也能均衡。
+        """
+        if self.page_workers <= 1 or count < self.split_min_pages:
+            return []
+        if _worker_processor is not None:
+            # 只在主进程中拆分：进程池（--workers、受监督的进程池）的每个工作进程再各自启动
+            # page_workers 个进程会使进程数成倍超出CPU数、峰值内存也成倍增加
+            return []
+        size = max(1, math.ceil(count / (self.page_workers * self.PAGE_RANGES_PER_WORKER)))
+        return [(start, min(start + size, count)) for start in range(0, count, size)]
+
+    def map_page_ranges(self, kind: str, file_path: Path, ranges: List[Tuple[int, int]]) -> Iterator[Any]:
+        """并行处理文档的各个区间，按区间顺序产出结果
+
+        每个进程自行打开文件，图片直接写入（按内容寻址的）图片存储，
+        只把文本和图片引用传回。
+        """
+        initargs = (str(self.input_dir), str(self.output_dir), self.worker_options())
+        workers = min(self.page_workers, len(ranges))
+        logger.info(f"按区间并行处理: {file_path.name}（{len(ranges)} 个区间，{workers} 个进程）")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+            futures = [pool.submit(_process_range_in_worker, kind, str(file_path), start, end)
+                       for start, end in ranges]
+            for future in futures:
+                yield future.result()
+
+    def process_range(self, kind: str, file_path: Path, start: int, end: int) -> Any:
+        """处理文档的一个区间：pdf 返回各页结果列表，pptx 返回幻灯片的sections和图片"""
+        if kind == 'pdf':
+            return list(self.iter_pdf_page_range(file_path, start, end))
+        prs = load_backend('pptx').Presentation(file_path)
+        return self.extract_slides(prs, start, end)
+
+    def process_single_document(self, file_path: Path) -> Dict[str, Any]:
+        """处理单个文档，返回生成的输出文件和引用的图片"""
         file_ext = file_path.suffix.lower()
         processor = self.supported_formats.get(file_ext)
+        record_bytes(read=file_path.stat().st_size, stage_name='parse')
+
+        if file_ext == '.pdf' and self.stream_pdf and self.storage == 'files':
+            return self.save_streamed(file_path, 'pdf', self.iter_pdf_pages(file_path))
+        if file_ext in ('.xlsx', '.xls') and self.stream_excel and self.storage == 'files':
+            return self.save_streamed(file_path, 'excel', self.iter_excel_sections(file_path))
         
         if processor:
-            content = processor(file_path)
+            with stage('parse'):
+                content = processor(file_path)
             if content:
-                self.save_processed_content(file_path, content)
+                return self.save_processed_content(file_path, content)
         else:
             logger.warning(f"不支持的文件格式: {file_ext}")
+
+        return {'outputs': [], 'images': []}
             
-    def process_word(self, file_path: Path) -> Dict[str, Any]:
+    def process_word(self, file_path: Path) -> Optional[DocumentRecord]:
         """处理Word文档"""
         try:
-            doc = docx.Document(file_path)
-            content = {
-                'title': file_path.stem,
-                'source_file': str(file_path),
-                'type': 'word',
-                'sections': [],
-                'images': []
-            }
-            
-            current_section = {
-                'heading': '',
-                'content': '',
-                'tables': [],
-                'images': []
-            }
+            lib = load_backend('docx')
+            doc = lib.Document(file_path)
+            content = DocumentRecord(file_path.stem, str(file_path), 'word')
             
-            # 处理段落和表格
+            current_section = SectionRecord('')
+            # 当前section的正文行，结束时一次拼接
+            lines = []
+            # 样式ID -> 样式名称：样式解析要查找样式表，每种样式只解析一次
+            style_names = {}
+
+            def close_section():
+                if lines or current_section.tables:
+                    current_section.content = ''.join(lines)
+                    content.sections.append(current_section)
+
+            # 只遍历一遍正文XML，段落直接从元素读取文本，不创建Paragraph对象
             for element in doc.element.body:
-                if isinstance(element, CT_P):
-                    paragraph = Paragraph(element, doc)
-                    text = paragraph.text.strip()
-                    
+                if isinstance(element, lib.CT_P):
+                    text = word_paragraph_text(element).strip()
+
                     if text:
                         # 检查是否为标题
-                        if paragraph.style.name.startswith('Heading') or self.is_heading(text):
-                            if current_section['content'] or current_section['tables']:
-                                content['sections'].append(current_section.copy())
-                            current_section = {
-                                'heading': text,
-                                'content': '',
-                                'tables': [],
-                                'images': []
-                            }
+                        style_id = element.style
+                        if style_id not in style_names:
+                            style_names[style_id] = lib.Paragraph(element, doc).style.name
+                        if style_names[style_id].startswith('Heading') or self.is_heading(text):
+                            close_section()
+                            current_section = SectionRecord(text)
+                            lines = []
                         else:
-                            current_section['content'] += text + '\n'
-                            
-                elif isinstance(element, CT_Tbl):
-                    table = Table(element, doc)
-                    table_data = self.extract_table_data(table)
-                    current_section['tables'].append(table_data)
-            
+                            lines.append(text + '\n')
+
+                elif isinstance(element, lib.CT_Tbl):
+                    current_section.tables.append(self.extract_table_data(element))
+
             # 添加最后一个section
-            if current_section['content'] or current_section['tables']:
-                content['sections'].append(current_section)
+            close_section()
                 
             # 提取图片
-            content['images'] = self.extract_word_images(doc)
+            with stage('images'):
+                content.images = self.extract_word_images(doc)
             
             return content
             
@@ -167,233 +1067,321 @@ class DocumentProcessor:
             logger.error(f"处理Word文档 {file_path} 时出错: {str(e)}")
             return None
             
-    def process_pdf(self, file_path: Path) -> Dict[str, Any]:
+    def process_pdf(self, file_path: Path) -> Optional[DocumentRecord]:
         """处理PDF文档"""
         try:
-            content = {
-                'title': file_path.stem,
-                'source_file': str(file_path),
-                'type': 'pdf',
-                'sections': [],
-                'images': []
-            }
-            
-            # 使用PyMuPDF处理PDF
-            doc = fitz.open(file_path)
+            content = DocumentRecord(file_path.stem, str(file_path), 'pdf')
+
+            for page in self.iter_pdf_pages(file_path):
+                if page['section']:
+                    content.sections.append(page['section'])
+                content.images.extend(page['images'])
+
+            return content
             
-            for page_num in range(len(doc)):
+        except Exception as e:
+            logger.error(f"处理PDF文档 {file_path} 时出错: {str(e)}")
+            return None
+
+    def iter_pdf_pages(self, file_path: Path) -> Iterator[Dict[str, Any]]:
+        """逐页读取PDF，产出每页的文本section和图片引用
+
+        页数达到 split_min_pages 且 page_workers 大于1时按页区间并行处理，
+        结果仍按页序产出。
+        """
+        if self.page_workers > 1:
+            doc = load_backend('pdf').open(file_path)
+            try:
+                count = len(doc)
+            finally:
+                doc.close()
+            ranges = self.page_ranges(count)
+            if ranges:
+                for pages in self.map_page_ranges('pdf', file_path, ranges):
+                    yield from pages
+                return
+        yield from self.iter_pdf_page_range(file_path)
+
+    def iter_pdf_page_range(self, file_path: Path, start: int = 0,
+                            end: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """逐页读取PDF的 [start, end) 页
+
+        图片在提取时立即写入图片存储，不在内存中累积；同一xref被多页引用时
+        只光栅化一次，后续页直接复用已保存的引用。
+        """
+        budget_bytes = self.memory_budget_mb * 1024 * 1024
+        # xref -> 图片引用；None表示该xref无法或不应提取
+        extracted = {}
+
+        # 使用PyMuPDF处理PDF
+        fitz = load_backend('pdf')
+        doc = fitz.open(file_path)
+        try:
+            end = len(doc) if end is None else min(end, len(doc))
+            for page_num in range(start, end):
                 page = doc.load_page(page_num)
-                
+                section = None
+                images = []
+
                 # 提取文本
                 text = page.get_text()
                 if text.strip():
-                    section = {
-                        'heading': f'第{page_num + 1}页',
-                        'content': text,
-                        'tables': [],
-                        'images': []
-                    }
-                    content['sections'].append(section)
-                
-                # 提取图片
-                image_list = page.get_images()
-                for img_index, img in enumerate(image_list):
-                    try:
+                    section = SectionRecord(f'第{page_num + 1}页', text)
+
+                # 提取图片：本页首次出现的图片先逐个光栅化，再一起写入图片存储
+                # （启用规范化时在线程池中并行缩放和编码）
+                page_images = page.get_images()
+                with stage('images'):
+                    new = []
+                    for img in page_images:
                         xref = img[0]
-                        pix = fitz.Pixmap(doc, xref)
-                        if pix.n < 5:  # GRAY or RGB
-                            img_data = pix.tobytes("png")
-                            img_info = {
-                                'page': page_num + 1,
-                                'index': img_index,
-                                'data': base64.b64encode(img_data).decode(),
-                                'format': 'png'
-                            }
-                            content['images'].append(img_info)
-                        pix = None
-                    except Exception as e:
-                        logger.warning(f"提取PDF图片时出错: {str(e)}")
-            
+                        if xref not in extracted:
+                            extracted[xref] = None
+                            source = self.extract_pdf_image(doc, img, budget_bytes)
+                            if source:
+                                new.append((xref, source))
+                    if new:
+                        infos = self.image_store.put_many([source for _, source in new])
+                        for (xref, _), info in zip(new, infos):
+                            extracted[xref] = info
+
+                for img_index, img in enumerate(page_images):
+                    xref = img[0]
+                    if extracted[xref]:
+                        img_info = {
+                            'page': page_num + 1,
+                            'index': img_index
+                        }
+                        img_info.update(extracted[xref])
+                        images.append(img_info)
+
+                yield {'page': page_num + 1, 'section': section, 'images': images}
+        finally:
             doc.close()
-            return content
-            
+
+    def extract_pdf_image(self, doc, img: tuple, budget_bytes: int) -> Optional[Tuple[Any, str]]:
+        """光栅化PDF中的一张图片，返回 (图片数据, 格式)，供写入图片存储"""
+        xref, width, height = img[0], img[2], img[3]
+        # 预估像素缓冲区大小（按RGBA计），超出内存预算的图片直接跳过
+        if width * height * 4 > budget_bytes:
+            logger.warning(f"PDF图片 xref={xref} ({width}x{height}) 超出内存预算，已跳过")
+            return None
+
+        try:
+            pix = load_backend('pdf').Pixmap(doc, xref)
+            if pix.n < 5:  # GRAY or RGB
+                if self.image_store.normalizer is not None:
+                    # 规范化时直接使用像素数据，省去一次PNG编码和解码
+                    from image_normalizer import image_from_pixels
+                    image = image_from_pixels(pix.n, bool(pix.alpha), pix.width, pix.height, pix.samples)
+                    if image is not None:
+                        return image, 'png'
+                return pix.tobytes("png"), 'png'
+            return None
         except Exception as e:
-            logger.error(f"处理PDF文档 {file_path} 时出错: {str(e)}")
+            logger.warning(f"提取PDF图片时出错: {str(e)}")
             return None
             
-    def process_excel(self, file_path: Path) -> Dict[str, Any]:
+    def process_excel(self, file_path: Path) -> Optional[DocumentRecord]:
         """处理Excel文档"""
         try:
-            workbook = load_workbook(file_path, data_only=True)
-            content = {
-                'title': file_path.stem,
-                'source_file': str(file_path),
-                'type': 'excel',
-                'sections': [],
-                'images': []
-            }
-            
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                
-                # 提取工作表数据
-                sheet_data = []
-                for row in sheet.iter_rows(values_only=True):
-                    if any(cell is not None for cell in row):
-                        sheet_data.append([str(cell) if cell is not None else '' for cell in row])
-                
-                if sheet_data:
-                    section = {
-                        'heading': f'工作表: {sheet_name}',
-                        'content': '',
-                        'tables': [{'data': sheet_data}],
-                        'images': []
-                    }
-                    content['sections'].append(section)
-            
+            content = DocumentRecord(file_path.stem, str(file_path), 'excel')
+
+            for chunk in self.iter_excel_sections(file_path):
+                content.sections.append(chunk['section'])
+
             return content
             
         except Exception as e:
             logger.error(f"处理Excel文档 {file_path} 时出错: {str(e)}")
             return None
+
+    def iter_excel_sections(self, file_path: Path) -> Iterator[Dict[str, Any]]:
+        """以只读模式逐行读取工作表，按行区间分块产出section
+
+        每个工作表第一条非空行作为表头，在每个分块中重复；只读模式下
+        openpyxl不构建整个工作表的单元格对象，内存占用与行数无关。
+        """
+        workbook = load_backend('excel').load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for sheet_name in workbook.sheetnames:
+                sheet = workbook[sheet_name]
+                headers = None
+                rows = []
+                first_row = 0
+
+                # 提取工作表数据
+                for row_num, row in enumerate(sheet.iter_rows(values_only=True), 1):
+                    if not any(cell is not None for cell in row):
+                        continue
+
+                    row_data = [str(cell) if cell is not None else '' for cell in row]
+                    if headers is None:
+                        headers = row_data
+                        continue
+
+                    if not rows:
+                        first_row = row_num
+                    rows.append(row_data)
+                    if len(rows) >= self.excel_chunk_rows:
+                        yield self._excel_chunk(sheet_name, headers, rows, first_row, row_num)
+                        rows = []
+
+                if rows:
+                    yield self._excel_chunk(sheet_name, headers, rows, first_row, row_num)
+        finally:
+            # 只读模式会保持文件句柄打开，需要显式关闭
+            workbook.close()
+
+    def _excel_chunk(self, sheet_name: str, headers: List[str], rows: List[List[str]],
+                     first_row: int, last_row: int) -> Dict[str, Any]:
+        """构造一个Excel行区间分块"""
+        section = SectionRecord(f'工作表: {sheet_name} (第{first_row}-{last_row}行)',
+                                tables=[TableRecord(headers, rows)])
+        return {'section': section, 'images': []}
             
-    def process_powerpoint(self, file_path: Path) -> Dict[str, Any]:
+    def process_powerpoint(self, file_path: Path) -> Optional[DocumentRecord]:
         """处理PowerPoint文档"""
         try:
-            prs = Presentation(file_path)
-            content = {
-                'title': file_path.stem,
-                'source_file': str(file_path),
-                'type': 'powerpoint',
-                'sections': [],
-                'images': []
-            }
-            
-            for slide_num, slide in enumerate(prs.slides):
-                slide_content = {
-                    'heading': f'幻灯片 {slide_num + 1}',
-                    'content': '',
-                    'tables': [],
-                    'images': []
-                }
-                
-                # 提取文本
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        slide_content['content'] += shape.text + '\n'
-                    
-                    # 提取图片
-                    if shape.shape_type == MSO_SHAPE_TYPE.PICTURE:
-                        try:
-                            image = shape.image
-                            img_data = base64.b64encode(image.blob).decode()
-                            img_info = {
-                                'slide': slide_num + 1,
-                                'data': img_data,
-                                'format': image.ext
-                            }
-                            content['images'].append(img_info)
-                        except Exception as e:
-                            logger.warning(f"提取PPT图片时出错: {str(e)}")
-                
-                if slide_content['content'].strip():
-                    content['sections'].append(slide_content)
-            
+            prs = load_backend('pptx').Presentation(file_path)
+            content = DocumentRecord(file_path.stem, str(file_path), 'powerpoint')
+
+            # 幻灯片较多时按区间并行处理，结果按幻灯片顺序合并
+            count = len(prs.slides)
+            ranges = self.page_ranges(count)
+            parts = self.map_page_ranges('pptx', file_path, ranges) if ranges else [self.extract_slides(prs, 0, count)]
+            for part in parts:
+                content.sections.extend(part['sections'])
+                content.images.extend(part['images'])
+
             return content
             
         except Exception as e:
             logger.error(f"处理PowerPoint文档 {file_path} 时出错: {str(e)}")
             return None
 
+    def extract_slides(self, prs, start: int, end: int) -> Dict[str, List[Any]]:
+        """提取第 [start, end) 张幻灯片的文本section和图片"""
+        lib = load_backend('pptx')
+        content = {'sections': [], 'images': []}
+
+        # 幻灯片中的图片先收集，处理完所有幻灯片后一起写入图片存储
+        pictures = []
+        for slide_num, slide in enumerate(islice(prs.slides, start, end), start):
+            slide_content = SectionRecord(f'幻灯片 {slide_num + 1}')
+            
+            # 提取文本
+            for shape in slide.shapes:
+                if hasattr(shape, "text"):
+                    slide_content.content += shape.text + '\n'
+                
+                # 提取图片
+                if shape.shape_type == lib.MSO_SHAPE_TYPE.PICTURE:
+                    try:
+                        with stage('images'):
+                            image = shape.image
+                            pictures.append((slide_num + 1, image.blob, image.ext))
+                    except Exception as e:
+                        logger.warning(f"提取PPT图片时出错: {str(e)}")
+            
+            if slide_content.content.strip():
+                content['sections'].append(slide_content)
+
+        with stage('images'):
+            infos = self.image_store.put_many([(blob, ext) for _, blob, ext in pictures])
+        for (slide, _, _), info in zip(pictures, infos):
+            img_info = {'slide': slide}
+            img_info.update(info)
+            content['images'].append(img_info)
+        
+        return content
+
     def is_heading(self, text: str) -> bool:
         """判断文本是否为标题"""
-        # 简单的标题判断逻辑
-        heading_patterns = [
-            r'^第[一二三四五六七八九十\d]+[章节部分]',
-            r'^\d+[\.\s]',
-            r'^[一二三四五六七八九十]+[\.\s]',
-            r'^问题[:：]',
-            r'^解决方案[:：]',
-            r'^步骤[:：]',
-            r'^注意[:：]'
-        ]
-
-        for pattern in heading_patterns:
-            if re.match(pattern, text.strip()):
-                return True
+        # 简单的标题判断逻辑（规则见 keyword_engine.HEADING_PATTERNS）
+        stripped = text.strip()
+        if self.matchers.heading.match(stripped):
+            return True
 
         # 如果文本很短且包含关键词，可能是标题
-        if len(text.strip()) < 50 and any(keyword in text for keyword in ['问题', '解决', '步骤', '方法', '设置', '配置']):
+        if len(stripped) < 50 and self.matchers.heading_keywords.contains_any(text):
             return True
 
         return False
 
-    def extract_table_data(self, table: Table) -> Dict[str, Any]:
-        """提取表格数据"""
-        table_data = {
-            'headers': [],
-            'rows': []
-        }
+    def extract_table_data(self, table: 'CT_Tbl') -> TableRecord:
+        """提取表格数据
+
+        结果与python-docx的 row.cells 相同：横向合并的单元格按跨越的列数重复，
+        纵向合并的后续单元格取合并起始单元格的内容。逐行扫描一遍，纵向合并通过
+        上一行各网格列起始单元格的内容直接查到，不再逐格向上回溯。
+        """
+        table_data = TableRecord()
 
-        for i, row in enumerate(table.rows):
+        # 上一行：网格列偏移 -> (单元格文本, 跨越列数)，纵向合并时为合并起始单元格
+        above = None
+        for i, tr in enumerate(table.tr_lst):
             row_data = []
-            for cell in row.cells:
-                row_data.append(cell.text.strip())
+            current = {}
+            offset = tr.grid_before
+            for tc in tr.tc_lst:
+                tc_pr = tc.tcPr
+                span = 1 if tc_pr is None else tc_pr.grid_span
+                if tc_pr is not None and tc_pr.vMerge_val == 'continue':
+                    if above is None:
+                        raise ValueError("no tr above topmost tr in w:tbl")
+                    if offset not in above:
+                        raise ValueError(f"no `tc` element at grid_offset={offset}")
+                    cell = above[offset]
+                else:
+                    cell = ('\n'.join(word_paragraph_text(p) for p in tc.p_lst).strip(), span)
+                current[offset] = cell
+                row_data.extend([cell[0]] * cell[1])
+                offset += span
+            above = current
 
             if i == 0:
-                table_data['headers'] = row_data
+                table_data.headers = row_data
             else:
-                table_data['rows'].append(row_data)
+                table_data.rows.append(row_data)
 
         return table_data
 
-    def extract_word_images(self, doc: Document) -> List[Dict[str, Any]]:
+    def extract_word_images(self, doc: 'Document') -> List[Dict[str, Any]]:
         """从Word文档中提取图片"""
         images = []
+        sources = []
 
         try:
             # 获取文档中的所有图片关系
             for rel in doc.part.rels.values():
                 if "image" in rel.target_ref:
                     try:
-                        image_data = rel.target_part.blob
-                        img_info = {
-                            'data': base64.b64encode(image_data).decode(),
-                            'format': rel.target_ref.split('.')[-1],
-                            'relation_id': rel.rId
-                        }
-                        images.append(img_info)
+                        sources.append((rel.rId, rel.target_part.blob, rel.target_ref.split('.')[-1]))
                     except Exception as e:
                         logger.warning(f"提取Word图片时出错: {str(e)}")
         except Exception as e:
             logger.warning(f"处理Word图片关系时出错: {str(e)}")
 
+        # 一起写入图片存储（启用规范化时在线程池中并行处理）
+        infos = self.image_store.put_many([(blob, ext) for _, blob, ext in sources])
+        for (relation_id, _, _), info in zip(sources, infos):
+            img_info = {'relation_id': relation_id}
+            img_info.update(info)
+            images.append(img_info)
+
         return images
 
-    def convert_to_qa_format(self, content: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def convert_to_qa_format(self, content: DocumentRecord) -> List[QARecord]:
         """将内容转换为Q&A格式"""
         qa_pairs = []
 
         # 基于文档标题生成基础上下文
         base_context = f"文档来源：{content['title']}"
+        source = self.source_key(content['source_file'])
 
         for section in content['sections']:
-            heading = section['heading']
-            text_content = section['content']
-            tables = section.get('tables', [])
-
-            # 处理文本内容
-            if text_content.strip():
-                # 尝试识别问题和答案
-                qa_pair = self.extract_qa_from_text(heading, text_content, base_context)
-                if qa_pair:
-                    qa_pairs.append(qa_pair)
-
-            # 处理表格内容
-            for table in tables:
-                table_qa = self.extract_qa_from_table(heading, table, base_context)
-                if table_qa:
-                    qa_pairs.append(table_qa)
+            qa_pairs.extend(self.convert_section_to_qa(section, base_context, source))
 
         # 处理图片内容
         for i, image in enumerate(content.get('images', [])):
@@ -403,42 +1391,90 @@ class DocumentProcessor:
 
         return qa_pairs
 
-    def extract_qa_from_text(self, heading: str, content: str, base_context: str) -> Dict[str, Any]:
-        """从文本中提取Q&A"""
-        # 清理内容
-        content = re.sub(r'\n+', '\n', content.strip())
+    def convert_section_to_qa(self, section: SectionRecord, base_context: str,
+                              source: Optional[str] = None) -> List[QARecord]:
+        """将单个section转换为Q&A"""
+        qa_pairs = []
+        heading = section['heading']
+        text_content = section['content']
+        tables = section.get('tables', [])
+
+        # 处理文本内容
+        if text_content.strip() and self.chunker:
+            qa_pairs.extend(self.chunk_qa_from_text(heading, text_content, base_context, source))
+        elif text_content.strip():
+            # 尝试识别问题和答案
+            qa_pair = self.extract_qa_from_text(heading, text_content, base_context)
+            if qa_pair:
+                qa_pairs.append(qa_pair)
+
+        # 处理表格内容
+        for table in tables:
+            table_qa = self.extract_qa_from_table(heading, table, base_context)
+            if table_qa:
+                qa_pairs.append(table_qa)
 
-        # 尝试识别问题模式
-        question_patterns = [
-            r'问题[:：](.+?)(?=解决|答案|方法|步骤|$)',
-            r'故障[:：](.+?)(?=解决|修复|处理|$)',
-            r'错误[:：](.+?)(?=解决|修复|处理|$)',
-            r'如何(.+?)(?=\n|$)',
-            r'怎样(.+?)(?=\n|$)'
-        ]
+        return qa_pairs
 
+    def extract_qa_from_text(self, heading: str, content: str, base_context: str) -> QARecord:
+        """从文本中提取Q&A"""
+        # 清理内容
+        content = self.matchers.newlines.sub('\n', content.strip())
+
+        return QARecord(
+            question=self.section_question(heading, content),
+            answer=self.enhance_answer(content, base_context),
+            keywords=self.extract_keywords(content),
+            source=base_context,
+            type='text'
+        )
+
+    def section_question(self, heading: str, content: str) -> str:
+        """由章节标题和（已清理的）正文生成通用化的问题"""
         question = heading if heading else "相关问题"
-        answer = content
 
-        # 尝试从内容中提取更具体的问题
-        for pattern in question_patterns:
-            match = re.search(pattern, content, re.DOTALL | re.IGNORECASE)
+        # 尝试从内容中提取更具体的问题（规则见 keyword_engine.QUESTION_PATTERNS）
+        for pattern in self.matchers.questions:
+            match = pattern.search(content)
             if match:
                 question = match.group(1).strip()
                 break
 
         # 生成通用化的问题
-        generalized_question = self.generalize_question(question, content)
+        return self.generalize_question(question, content)
 
-        return {
-            'question': generalized_question,
-            'answer': self.enhance_answer(answer, base_context),
-            'keywords': self.extract_keywords(content),
-            'source': base_context,
-            'type': 'text'
-        }
+    def chunk_qa_from_text(self, heading: str, content: str, base_context: str,
+                           source: Optional[str]) -> List[QARecord]:
+        """把章节正文切分为检索用分块，每个分块一个Q&A
 
-    def extract_qa_from_table(self, heading: str, table: Dict[str, Any], base_context: str) -> Dict[str, Any]:
+        问题由整个章节生成，多个分块时加上序号；chunk 中记录来源文档、章节、
+        分块序号和分块在章节正文（_data.json 中的 sections[].content）中的偏移。
+        """
+        question = self.section_question(heading, self.matchers.newlines.sub('\n', content.strip()))
+        chunks = self.chunker.split(content)
+        qa_pairs = []
+        for i, chunk in enumerate(chunks):
+            text = self.matchers.newlines.sub('\n', chunk['text'])
+            qa_pairs.append(QARecord(
+                question=question if len(chunks) == 1 else f"{question}（第{i + 1}部分）",
+                answer=self.enhance_answer(text, base_context),
+                keywords=self.extract_keywords(text),
+                source=base_context,
+                type='text',
+                chunk={
+                    'source': source,
+                    'section': heading,
+                    'index': i,
+                    'count': len(chunks),
+                    'start': chunk['start'],
+                    'end': chunk['end'],
+                    'size': chunk['size'],
+                    'unit': self.chunker.unit
+                }
+            ))
+        return qa_pairs
+
+    def extract_qa_from_table(self, heading: str, table: TableRecord, base_context: str) -> Optional[QARecord]:
         """从表格中提取Q&A"""
         headers = table.get('headers', [])
         rows = table.get('rows', [])
@@ -460,15 +1496,15 @@ class DocumentProcessor:
 
         question = f"关于{heading}的详细信息"
 
-        return {
-            'question': question,
-            'answer': table_content,
-            'keywords': headers + [heading],
-            'source': base_context,
-            'type': 'table'
-        }
+        return QARecord(
+            question=question,
+            answer=table_content,
+            keywords=headers + [heading],
+            source=base_context,
+            type='table'
+        )
 
-    def create_image_qa(self, doc_title: str, image: Dict[str, Any], index: int, base_context: str) -> Dict[str, Any]:
+    def create_image_qa(self, doc_title: str, image: Dict[str, Any], index: int, base_context: str) -> QARecord:
         """为图片创建Q&A"""
         question = f"{doc_title}中的图片{index + 1}"
 
@@ -482,31 +1518,25 @@ class DocumentProcessor:
         elif 'slide' in image:
             answer += f"位于第{image['slide']}张幻灯片。"
 
-        return {
-            'question': question,
-            'answer': answer,
-            'keywords': [doc_title, '图片', '图像'],
-            'source': base_context,
-            'type': 'image',
-            'image_data': image['data'],
-            'image_format': img_format
-        }
+        return QARecord(
+            question=question,
+            answer=answer,
+            keywords=[doc_title, '图片', '图像'],
+            source=base_context,
+            type='image',
+            image_hash=image['hash'],
+            image_format=img_format
+        )
 
     def generalize_question(self, question: str, content: str) -> str:
         """将具体问题泛化为通用问题"""
-        # 移除具体的数字、日期、名称等
+        # 移除具体的数字、日期、名称等（规则见 keyword_engine.GENERALIZE_RULES）
         generalized = question
-
-        # 替换具体数字为通用描述
-        generalized = re.sub(r'\d{4}-\d{2}-\d{2}', '[日期]', generalized)
-        generalized = re.sub(r'\d+', '[数字]', generalized)
-
-        # 替换具体名称为通用描述
-        generalized = re.sub(r'小区\d+', '[小区名称]', generalized)
-        generalized = re.sub(r'用户\w+', '[用户名]', generalized)
+        for pattern, replacement in self.matchers.generalize_rules:
+            generalized = pattern.sub(replacement, generalized)
 
         # 添加常见问题前缀
-        if not any(prefix in generalized for prefix in ['如何', '怎样', '什么', '为什么', '问题']):
+        if not self.matchers.question_prefixes.contains_any(generalized):
             if '设置' in content or '配置' in content:
                 generalized = f"如何{generalized}"
             elif '错误' in content or '故障' in content:
@@ -521,8 +1551,7 @@ class DocumentProcessor:
         enhanced = f"{base_context}\n\n{answer}"
 
         # 确保SQL语句被保留
-        sql_pattern = r'(SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP)\s+.*?;'
-        sql_matches = re.findall(sql_pattern, answer, re.IGNORECASE | re.DOTALL)
+        sql_matches = self.matchers.sql.findall(answer)
 
         if sql_matches:
             enhanced += "\n\n相关SQL语句：\n"
@@ -531,7 +1560,7 @@ class DocumentProcessor:
 
         # 确保操作步骤被突出显示
         if '步骤' in answer:
-            steps = re.findall(r'步骤\s*\d+[:：](.+?)(?=步骤\s*\d+|$)', answer, re.DOTALL)
+            steps = self.matchers.steps.findall(answer)
             if steps:
                 enhanced += "\n\n操作步骤：\n"
                 for i, step in enumerate(steps, 1):
@@ -541,119 +1570,390 @@ class DocumentProcessor:
 
     def extract_keywords(self, content: str) -> List[str]:
         """提取关键词"""
-        # 技术关键词
-        tech_keywords = [
-            'SRMS', 'SQL', 'IE', 'Edge', 'Login', 'Batch', 'Journal',
-            'Demand Note', 'SPS', 'Occupant', 'Building ID', 'CashType',
-            'Synergis', 'Community App', 'Facility Booking'
-        ]
-
-        # 操作关键词
-        action_keywords = [
-            '设置', '配置', '登录', '删除', '更新', '导出', '列印', '解锁',
-            '修复', '处理', '解决', '安装', '注册', '上传', '下载'
-        ]
-
-        found_keywords = []
-        content_lower = content.lower()
-
-        for keyword in tech_keywords + action_keywords:
-            if keyword.lower() in content_lower:
-                found_keywords.append(keyword)
-
-        # 提取其他重要词汇
-        important_words = re.findall(r'[\u4e00-\u9fff]{2,}', content)
-        found_keywords.extend(list(set(important_words))[:10])  # 限制数量
-
-        return list(set(found_keywords))
-
-    def save_processed_content(self, original_file: Path, content: Dict[str, Any]):
-        """保存处理后的内容"""
+        # 技术和操作关键词（词典见 keyword_engine，可通过配置文件扩充）
+        found_keywords = self.matchers.keywords.find(content)
+
+        # 提取其他重要词汇（按出现顺序取前10个，保证结果稳定）
+        important_words = self.matchers.cjk_words.findall(content)
+        found_keywords.extend(list(dict.fromkeys(important_words))[:10])  # 限制数量
+
+        return list(dict.fromkeys(found_keywords))
+
+    def save_processed_content(self, original_file: Path, content: DocumentRecord) -> Dict[str, Any]:
+        """保存处理后的内容，返回生成的输出文件和引用的图片"""
         # 转换为Q&A格式
-        qa_pairs = self.convert_to_qa_format(content)
+        with stage('qa'):
+            qa_pairs = self.convert_to_qa_format(content)
+
+        images = sorted({name for image in content.get('images', []) for name in self.image_store.blob_names(image)})
 
         if not qa_pairs:
             logger.warning(f"文件 {original_file} 没有生成有效的Q&A内容")
-            return
-
-        # 生成输出文件名
-        output_filename = f"{self.processed_count:02d}_{original_file.stem}_processed.docx"
-        output_path = self.output_dir / output_filename
+            return {'outputs': [], 'images': images}
+
+        # SQLite存储：结果交给主进程批量写入数据库
+        if self.storage == 'sqlite':
+            return {'outputs': [], 'images': images, 'catalog': {'content': content, 'qa_pairs': qa_pairs}}
+
+        # 输出文件名只依赖文档相对路径，与处理顺序和并发无关，写出前即可确定
+        if self.write_executor is not None:
+            return {'outputs': [writer.path_for(original_file) for writer in self.writers], 'images': images,
+                    'deferred': (original_file, content, qa_pairs)}
+
+        return {'outputs': self.write_outputs(original_file, content, qa_pairs), 'images': images}
+
+    def write_outputs(self, original_file: Path, content: DocumentRecord, qa_pairs: List[QARecord],
+                      profile=None) -> List[Path]:
+        """依次调用所选的写出器；profile 为在写出线程中继续计时的文件"""
+        if profile is not None:
+            with resume_profile(profile):
+                return self.write_outputs(original_file, content, qa_pairs)
+
+        outputs = []
+        for writer in self.writers:
+            with stage(writer.name):
+                path = writer.write(original_file, content, qa_pairs)
+                record_bytes(written=path.stat().st_size)
+            outputs.append(path)
+
+        logger.info(f"已保存处理结果: {outputs[0]}")
+        return outputs
+
+    def save_streamed(self, original_file: Path, doc_type: str,
+                      parts: Iterator[Dict[str, Any]]) -> Dict[str, Any]:
+        """流式保存：逐个分块（PDF页、Excel行区间）转换为Q&A并立即写出
+
+        每个分块的文本和Q&A写入输出后即释放，图片在提取时已落盘，因此内存
+        占用只与单个分块相关，与文档总页数/行数无关。
+        """
+        title = original_file.stem
+        base_context = f"文档来源：{title}"
+        source = self.source_key(original_file)
+
+        raw_meta = {
+            'title': title,
+            'source_file': str(original_file),
+            'type': doc_type
+        }
+        sessions = []
+        qa_count = 0
+        image_count = 0
+        images = set()
 
-        # 创建Word文档
-        self.create_word_document(qa_pairs, output_path, content['title'])
+        try:
+            for writer in self.writers:
+                with stage(writer.name):
+                    sessions.append((writer, writer.open(original_file, raw_meta)))
+
+            # 生成器读取下一个分块的耗时计入解析阶段
+            for part in timed_iter(parts, 'parse'):
+                part_qa = []
+                with stage('qa'):
+                    if part['section']:
+                        part_qa.extend(self.convert_section_to_qa(part['section'], base_context, source))
+                    for image in part['images']:
+                        images.update(self.image_store.blob_names(image))
+                        part_qa.append(self.create_image_qa(title, image, image_count, base_context))
+                        image_count += 1
+                qa_count += len(part_qa)
+
+                for writer, session in sessions:
+                    with stage(writer.name):
+                        if part['section']:
+                            session.add_section(part['section'])
+                        for image in part['images']:
+                            session.add_image(image)
+                        for qa in part_qa:
+                            session.add_qa(qa)
+        except Exception:
+            for _, session in sessions:
+                session.abort()
+            raise
+
+        if not qa_count:
+            for _, session in sessions:
+                session.abort()
+            logger.warning(f"文件 {original_file} 没有生成有效的Q&A内容")
+            return {'outputs': [], 'images': sorted(images)}
 
-        # 保存JSON格式的原始数据（用于调试）
-        json_path = self.output_dir / f"{self.processed_count:02d}_{original_file.stem}_data.json"
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump({
-                'original_file': str(original_file),
-                'qa_pairs': qa_pairs,
-                'raw_content': content
-            }, f, ensure_ascii=False, indent=2)
+        outputs = []
+        for writer, session in sessions:
+            with stage(writer.name):
+                path = session.close()
+                record_bytes(written=path.stat().st_size)
+            outputs.append(path)
 
-        logger.info(f"已保存处理结果: {output_path}")
+        logger.info(f"已保存处理结果: {outputs[0]}")
+        return {'outputs': outputs, 'images': sorted(images)}
 
     def create_word_document(self, qa_pairs: List[Dict[str, Any]], output_path: Path, title: str):
         """创建Word文档"""
-        doc = docx.Document()
-
-        # 添加标题
-        doc.add_heading(f'知识库文档：{title}', 0)
-
-        # 添加说明
-        doc.add_paragraph(f'本文档包含 {len(qa_pairs)} 个问答对，来源于原始文档的处理和整理。')
+        doc, summary_para = self.begin_word_document(title)
 
         for i, qa in enumerate(qa_pairs, 1):
-            # 添加问题
-            question_para = doc.add_heading(f'Q{i}: {qa["question"]}', level=2)
-
-            # 添加答案
-            answer_para = doc.add_paragraph()
-            answer_para.add_run('A: ').bold = True
-            answer_para.add_run(qa['answer'])
-
-            # 如果有图片，添加图片
-            if qa.get('type') == 'image' and qa.get('image_data'):
-                try:
-                    # 解码base64图片数据
-                    img_data = base64.b64decode(qa['image_data'])
-                    img_stream = BytesIO(img_data)
+            self.add_qa_to_word_document(doc, qa, i)
 
-                    # 添加图片到文档
-                    doc.add_picture(img_stream, width=docx.shared.Inches(4))
-                except Exception as e:
-                    logger.warning(f"添加图片到Word文档时出错: {str(e)}")
+        self.finish_word_document(doc, summary_para, len(qa_pairs), output_path)
 
-            # 添加关键词
-            if qa.get('keywords'):
-                keywords_para = doc.add_paragraph()
-                keywords_para.add_run('关键词: ').italic = True
-                keywords_para.add_run(', '.join(qa['keywords']))
+    def begin_word_document(self, title: str):
+        """创建Word文档并写入标题，返回 (文档, 说明段落)"""
+        doc = load_backend('docx').Document()
 
-            # 添加分隔线
-            doc.add_paragraph('─' * 50)
+        # 添加标题
+        doc.add_heading(f'知识库文档：{title}', 0)
 
-        # 保存文档
-        doc.save(output_path)
+        # 添加说明（问答对数量在文档完成时填写）
+        summary_para = doc.add_paragraph()
+
+        return doc, summary_para
+
+    def add_qa_to_word_document(self, doc, qa: Dict[str, Any], number: int):
+        """向Word文档追加一个问答对"""
+        # 添加问题
+        doc.add_heading(f'Q{number}: {qa["question"]}', level=2)
+
+        # 添加答案
+        answer_para = doc.add_paragraph()
+        answer_para.add_run('A: ').bold = True
+        answer_para.add_run(qa['answer'])
+
+        # 如果有图片，添加图片
+        if qa.get('type') == 'image' and qa.get('image_hash'):
+            try:
+                # 从图片存储中读取
+                picture = str(self.image_store.path_for(qa['image_hash'], qa['image_format']))
+                if qa['image_format'] == 'webp':
+                    # Word不支持WebP，嵌入时转换为PNG
+                    from image_normalizer import to_png_stream
+                    picture = to_png_stream(picture)
+
+                # 添加图片到文档
+                doc.add_picture(picture, width=load_backend('docx').Inches(4))
+            except Exception as e:
+                logger.warning(f"添加图片到Word文档时出错: {str(e)}")
+
+        # 添加关键词
+        if qa.get('keywords'):
+            keywords_para = doc.add_paragraph()
+            keywords_para.add_run('关键词: ').italic = True
+            keywords_para.add_run(', '.join(qa['keywords']))
+
+        # 添加分隔线
+        doc.add_paragraph('─' * 50)
+
+    def finish_word_document(self, doc, summary_para, qa_count: int, output_path: Path):
+        """填写问答对数量并保存Word文档"""
+        summary_para.text = f'本文档包含 {qa_count} 个问答对，来源于原始文档的处理和整理。'
+
+        # 先保存到临时文件再替换，中断或并发写出时不会留下不完整的文档
+        tmp_path = tmp_path_for(output_path)
+        try:
+            doc.save(tmp_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        os.replace(tmp_path, output_path)
+
+
+def file_sha256(file_path: Path, chunk_size: int = 1 << 20) -> str:
+    """分块计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_json_atomic(path: Path, data: Any):
+    """先写临时文件再替换，避免中断时留下半截JSON"""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+# 进程池工作进程中的处理器实例（每个进程初始化一次）
+_worker_processor = None
+
+
+def _init_worker(input_dir: str, output_dir: str, options: Dict[str, Any]):
+    """进程池工作进程初始化"""
+    global _worker_processor
+    _worker_processor = DocumentProcessor(input_dir, output_dir, **options)
+    # 工作进程退出时关闭图片规范化的线程池
+    Finalize(_worker_processor, _worker_processor.close, exitpriority=10)
+
+
+def _process_in_worker(file_path: Path) -> Tuple[Path, Optional[Dict[str, Any]], Optional[str]]:
+    """在工作进程中处理单个文档"""
+    return _worker_processor._process_one(file_path)
+
+
+def _process_range_in_worker(kind: str, file_path: str, start: int, end: int) -> Any:
+    """在工作进程中处理文档的一个页/幻灯片区间"""
+    return _worker_processor.process_range(kind, Path(file_path), start, end)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="知识库文档预处理")
+    parser.add_argument('--input', default="待处理知识库", help="输入目录")
+    parser.add_argument('--output', default="已处理知识库", help="输出目录")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="并行处理的进程数（默认1，即串行处理）")
+    parser.add_argument('--full', action='store_true',
+                        help="忽略处理清单，重新处理所有文档")
+    parser.add_argument('--stream-pdf', action='store_true',
+                        help="逐页流式处理PDF，内存占用与页数无关")
+    parser.add_argument('--memory-budget-mb', type=int, default=256,
+                        help="单张PDF图片光栅化允许的最大内存（MB，默认256）")
+    parser.add_argument('--stream-excel', action='store_true',
+                        help="流式处理Excel，逐个行区间分块转换并写出")
+    parser.add_argument('--excel-chunk-rows', type=int, default=100,
+                        help="Excel每个分块的数据行数（默认100，表头在每块中重复）")
+    parser.add_argument('--storage', choices=['files', 'sqlite'], default='files',
+                        help="输出存储方式：files 每个文档输出.docx和JSON；sqlite 写入单个数据库（含FTS5全文索引）")
+    parser.add_argument('--keywords-config', metavar='FILE',
+                        help="关键词词典配置文件（JSON），覆盖默认的技术/操作/标题关键词")
+    parser.add_argument('--index', nargs='?', const='', default=None, metavar='DIR',
+                        help="处理完成后增量更新本地BM25检索索引（默认目录为输出目录下的 qa_index）")
+    parser.add_argument('--snapshot', action='store_true',
+                        help="处理完成后更新知识库二进制快照（输出目录下的 knowledge_base.snap），加快全库加载")
+    parser.add_argument('--vectors', nargs='?', const='', default=None, metavar='DIR',
+                        help="处理完成后更新本地向量索引（默认目录为输出目录下的 vector_index）")
+    parser.add_argument('--embedding-model', default='hashing',
+                        help="向量化方式：hashing 为特征哈希（默认，无需模型），其他值为本地sentence-transformers模型名称或目录")
+    parser.add_argument('--embedding-dim', type=int, default=512,
+                        help="特征哈希的向量维度（默认512）")
+    parser.add_argument('--upload', action='store_true',
+                        help="处理完成后把问答对的变化同步到Dify知识库（只上传新增和变化的部分）")
+    parser.add_argument('--dify-url', default=os.environ.get('DIFY_API_URL', 'http://localhost/v1'),
+                        help="Dify API地址（默认取环境变量 DIFY_API_URL）")
+    parser.add_argument('--dify-api-key', default=os.environ.get('DIFY_API_KEY'),
+                        help="Dify知识库API密钥（默认取环境变量 DIFY_API_KEY）")
+    parser.add_argument('--dataset-id', default=os.environ.get('DIFY_DATASET_ID'),
+                        help="Dify知识库ID（默认取环境变量 DIFY_DATASET_ID）")
+    parser.add_argument('--upload-concurrency', type=int, default=8,
+                        help="同步时同时进行的请求数（默认8）")
+    parser.add_argument('--upload-batch-size', type=int, default=50,
+                        help="同步时每个请求添加的分段数（默认50）")
+    parser.add_argument('--outputs', nargs='+', choices=list(OUTPUT_WRITERS),
+                        default=DEFAULT_OUTPUTS, metavar='FORMAT',
+                        help="输出格式，可任意组合：docx json jsonl markdown（默认 docx json）")
+    parser.add_argument('--image-format', choices=['keep', 'auto', 'webp', 'jpeg', 'png'], default='keep',
+                        help="图片规范化：keep 原样保存（默认）；auto 截图用无损PNG、照片用JPEG；"
+                             "webp/jpeg/png 统一使用该格式")
+    parser.add_argument('--image-max-dimension', type=int, default=1600,
+                        help="规范化时图片的最大边长（像素，默认1600）")
+    parser.add_argument('--thumbnail-size', type=int, default=256,
+                        help="规范化时生成的缩略图最大边长（像素，默认256，0为不生成）")
+    parser.add_argument('--image-threads', type=int, default=4,
+                        help="图片规范化的线程数（默认4）")
+    parser.add_argument('--dedup', choices=['flag', 'merge'],
+                        help="全库近似重复检测：flag 标记重复的问答对，merge 删除重复项并记录合并来源"
+                             "（结果见 dedup_report.json 和 deduplicated_qa.jsonl）")
+    parser.add_argument('--dedup-threshold', type=float, default=0.8,
+                        help="答案文本的相似度阈值（MinHash估计的Jaccard相似度，默认0.8）")
+    parser.add_argument('--chunk-size', type=int, default=0,
+                        help="检索用分块的最大大小：章节正文按此大小切分为多个Q&A（默认0，即每个章节一个Q&A）")
+    parser.add_argument('--chunk-overlap', type=int, default=100,
+                        help="相邻分块的重叠大小（默认100，不超过分块大小的一半）")
+    parser.add_argument('--chunk-unit', choices=['chars', 'tokens'], default='chars',
+                        help="分块大小的单位：chars 字符数（默认）；tokens 估算的token数（每个汉字或英文单词计1）")
+    parser.add_argument('--page-workers', type=int, default=1,
+                        help="单个大型PDF/PPT按页（幻灯片）区间拆分后并行处理的进程数（默认1，不拆分）")
+    parser.add_argument('--split-min-pages', type=int, default=50,
+                        help="页数（幻灯片数）达到此值的文档才按区间拆分（默认50）")
+    parser.add_argument('--timeout', type=float,
+                        help="单个文件的最长处理时间（秒）；超时的工作进程被杀掉并重试一次，仍失败的文件被隔离")
+    parser.add_argument('--memory-limit-mb', type=int,
+                        help="单个工作进程的内存上限（MB）；超出时同样杀掉、重试并隔离")
+    parser.add_argument('--queue', nargs='?', const='', default=None, metavar='DIR',
+                        help="分布式处理：把待处理的文件写入共享目录中的工作队列（默认为输出目录下的 work_queue），"
+                             "由 work_queue.py work 启动的工作进程领取处理，本进程等待并汇总结果")
+    parser.add_argument('--lease-ttl', type=float, default=60.0,
+                        help="分布式处理时工作进程租约的有效期（秒，默认60）；超过此时间没有续约视为工作进程失联")
+    parser.add_argument('--max-attempts', type=int, default=3,
+                        help="分布式处理时同一个文件最多被领取的次数（默认3），之后隔离该文件")
+    parser.add_argument('--watch', action='store_true',
+                        help="监视模式：常驻运行，输入目录中的文档新增、修改或删除后自动增量处理")
+    parser.add_argument('--poll-interval', type=float, default=2.0,
+                        help="监视模式下扫描输入目录的间隔（秒，默认2）")
+    parser.add_argument('--debounce', type=float, default=3.0,
+                        help="监视模式下文件大小和修改时间保持不变多久才视为写入完成（秒，默认3）")
+    parser.add_argument('--queue-size', type=int, default=100,
+                        help="监视模式下待处理队列的容量（默认100）")
+    parser.add_argument('--profile', action='store_true',
+                        help="用cProfile记录每个文档的处理过程，保留最慢文档的结果（输出目录下的 profiles）")
+    parser.add_argument('--report-top', type=int, default=10,
+                        help="运行报告中列出的最慢文件数，也是保留性能分析结果的文档数（默认10）")
+    return parser.parse_args(argv)
 
 
 def main():
     """主函数"""
-    input_directory = "待处理知识库"
-    output_directory = "已处理知识库"
+    args = parse_args()
+    input_directory = args.input
+    output_directory = args.output
 
     if not os.path.exists(input_directory):
         logger.error(f"输入目录不存在: {input_directory}")
         return
 
-    processor = DocumentProcessor(input_directory, output_directory)
-    processor.process_all_documents()
+    index_directory = None
+    if args.index is not None:
+        index_directory = args.index or os.path.join(output_directory, 'qa_index')
+    if args.upload and not (args.dify_api_key and args.dataset_id):
+        logger.error("同步到Dify需要提供 --dify-api-key 和 --dataset-id（或设置环境变量 DIFY_API_KEY、DIFY_DATASET_ID）")
+        return
+
+    queue_directory = None
+    if args.queue is not None:
+        queue_directory = args.queue or os.path.join(output_directory, 'work_queue')
+
+    vector_directory = None
+    if args.vectors is not None:
+        vector_directory = args.vectors or os.path.join(output_directory, 'vector_index')
+
+    processor = DocumentProcessor(input_directory, output_directory, workers=args.workers,
+                                  incremental=not args.full, stream_pdf=args.stream_pdf,
+                                  memory_budget_mb=args.memory_budget_mb,
+                                  stream_excel=args.stream_excel,
+                                  excel_chunk_rows=args.excel_chunk_rows,
+                                  index_dir=index_directory, storage=args.storage,
+                                  keywords_config=args.keywords_config,
+                                  profile=args.profile, report_top=args.report_top,
+                                  outputs=args.outputs, image_format=args.image_format,
+                                  image_max_dimension=args.image_max_dimension,
+                                  thumbnail_size=args.thumbnail_size, image_threads=args.image_threads,
+                                  dedup=args.dedup, dedup_threshold=args.dedup_threshold,
+                                  timeout=args.timeout, memory_limit_mb=args.memory_limit_mb,
+                                  chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+                                  chunk_unit=args.chunk_unit, vector_dir=vector_directory,
+                                  embedding_model=args.embedding_model, embedding_dim=args.embedding_dim,
+                                  dify_url=args.dify_url, dify_api_key=args.dify_api_key,
+                                  dataset_id=args.dataset_id if args.upload else None,
+                                  upload_concurrency=args.upload_concurrency,
+                                  upload_batch_size=args.upload_batch_size,
+                                  page_workers=args.page_workers, split_min_pages=args.split_min_pages,
+                                  snapshot=args.snapshot, queue_dir=queue_directory,
+                                  lease_ttl=args.lease_ttl, max_attempts=args.max_attempts)
+    logger.info(f"启动耗时: {(time.perf_counter() - _IMPORT_STARTED) * 1000:.0f} ms")
+    if args.watch:
+        from watcher import DirectoryWatcher
+        DirectoryWatcher(processor, poll_interval=args.poll_interval, debounce=args.debounce,
+                         queue_size=args.queue_size).run()
+    else:
+        processor.process_all_documents()
 
     print(f"\n处理完成！")
     print(f"输入目录: {input_directory}")
     print(f"输出目录: {output_directory}")
     print(f"处理文件数: {processor.processed_count}")
+    print(f"跳过未变化: {processor.skipped_count}")
+    print(f"清理已删除: {processor.removed_count}")
+    if processor.report.quarantined:
+        print(f"已隔离: {len(processor.report.quarantined)}（详见 {processor.REPORT_NAME}.json）")
 
 
 if __name__ == "__main__":
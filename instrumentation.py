@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+处理流程的分阶段计时与运行报告
+记录每个文件各阶段（解析、图片、Q&A转换、Word/JSON写出等）的墙钟时间、
+CPU时间、读写字节数和进程峰值内存，汇总为JSON/CSV运行报告
+"""
+
+import os
+import csv
+import json
+import time
+import resource
+import cProfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterator, Iterable
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 报告中各阶段的固定顺序；未列出的阶段排在后面
+STAGES = ['parse', 'images', 'qa', 'docx', 'json', 'jsonl', 'markdown']
+
+# 每个线程当前正在计时的文件（写出线程与解析线程分别计时不同的文件）
+_local = threading.local()
+
+
+class FileProfile:
+    """单个文件（或整次运行）的分阶段计时
+
+    阶段可以嵌套，计时是独占的：子阶段的耗时从父阶段中扣除，
+    因此各阶段之和加上 other 等于总耗时。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stages = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        # 该文件处理期间的峰值常驻内存；无法单独统计时为None
+        self.peak_rss_mb = None
+        self.error = None
+        # 计时栈：[阶段名, 开始墙钟, 开始CPU, 子阶段墙钟, 子阶段CPU]
+        self._stack = []
+
+    def _entry(self, name: str) -> Dict[str, float]:
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = self.stages[name] = {'wall': 0.0, 'cpu': 0.0, 'bytes_read': 0, 'bytes_written': 0}
+        return entry
+
+    @contextmanager
+    def stage(self, name: str):
+        frame = [name, time.perf_counter(), time.thread_time(), 0.0, 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            wall = time.perf_counter() - frame[1]
+            cpu = time.thread_time() - frame[2]
+            entry = self._entry(name)
+            entry['wall'] += wall - frame[3]
+            entry['cpu'] += cpu - frame[4]
+            if self._stack:
+                self._stack[-1][3] += wall
+                self._stack[-1][4] += cpu
+
+    def add_bytes(self, read: int = 0, written: int = 0, stage_name: Optional[str] = None):
+        """把读写字节数计入指定阶段（默认为当前阶段）"""
+        if stage_name is None:
+            stage_name = self._stack[-1][0] if self._stack else 'other'
+        entry = self._entry(stage_name)
+        entry['bytes_read'] += read
+        entry['bytes_written'] += written
+        self.bytes_read += read
+        self.bytes_written += written
+
+    def to_dict(self) -> Dict[str, Any]:
+        stages = {name: dict(values) for name, values in self.stages.items()}
+        other = self.wall - sum(values['wall'] for values in stages.values())
+        if other > 0:
+            stages.setdefault('other', {'wall': 0.0, 'cpu': 0.0, 'bytes_read': 0, 'bytes_written': 0})
+            stages['other']['wall'] += other
+        return {
+            'file': self.name,
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'peak_rss_mb': self.peak_rss_mb,
+            'error': self.error,
+            'stages': stages
+        }
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存（MB）；峰值被 reset_peak_rss 重置后为重置以来的峰值"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# 各次 reset_peak_rss 之前的峰值：重置后进程的VmHWM和ru_maxrss都不再包含它们
+_process_peak_mb = 0.0
+
+
+def process_peak_rss_mb() -> float:
+    """进程整个生命周期的峰值常驻内存（MB），不受 reset_peak_rss 影响"""
+    return max(_process_peak_mb, peak_rss_mb())
+
+
+def reset_peak_rss() -> bool:
+    """把进程的峰值常驻内存重置为当前值（Linux 4.0+ 的 /proc/self/clear_refs）
+
+    ru_maxrss 是整个进程生命周期的峰值，串行处理时最大的文件之后的每个文件都会报告
+    同一个值；每个文件开始前重置，结束时读到的才是该文件处理期间的峰值。
+    峰值是整个进程的：与其他文件的处理重叠的部分（例如串行处理时前一个文件在
+    后台写出）同时计入两个文件。不支持时返回False。
+    """
+    global _process_peak_mb
+    _process_peak_mb = process_peak_rss_mb()
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+@contextmanager
+def profile_file(name: str, profile_path: Optional[Path] = None):
+    """为一个文件开启计时；指定 profile_path 时同时用cProfile记录调用明细"""
+    profile = FileProfile(name)
+    previous, _local.profile = getattr(_local, 'profile', None), profile
+    profiler = cProfile.Profile() if profile_path else None
+    # 无法重置峰值时不填写该文件的峰值内存，避免把进程峰值误当作该文件的
+    per_file_peak = reset_peak_rss()
+    started_wall = time.perf_counter()
+    started_cpu = time.thread_time()
+
+    if profiler:
+        profiler.enable()
+    try:
+        yield profile
+    except Exception as e:
+        profile.error = str(e)
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+            profile_path.parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(str(profile_path))
+        profile.wall = time.perf_counter() - started_wall
+        profile.cpu = time.thread_time() - started_cpu
+        profile.peak_rss_mb = peak_rss_mb() if per_file_peak else None
+        _local.profile = previous
+
+
+@contextmanager
+def resume_profile(profile: FileProfile):
+    """在当前线程继续为已结束计时的文件计时（例如在写出线程中写出该文件）
+
+    期间的耗时累加到该文件的总耗时上。
+    """
+    previous, _local.profile = getattr(_local, 'profile', None), profile
+    started_wall = time.perf_counter()
+    started_cpu = time.thread_time()
+    try:
+        yield profile
+    finally:
+        profile.wall += time.perf_counter() - started_wall
+        profile.cpu += time.thread_time() - started_cpu
+        if profile.peak_rss_mb is not None:
+            profile.peak_rss_mb = max(profile.peak_rss_mb, peak_rss_mb())
+        _local.profile = previous
+
+
+def current_profile() -> Optional[FileProfile]:
+    """当前线程正在计时的文件"""
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def stage(name: str):
+    """在当前文件的计时中记录一个阶段；没有正在计时的文件时不做任何事"""
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        yield
+        return
+    with profile.stage(name):
+        yield
+
+
+def record_bytes(read: int = 0, written: int = 0, stage_name: Optional[str] = None):
+    """把读写字节数计入当前文件的指定阶段（默认为当前阶段）"""
+    profile = getattr(_local, 'profile', None)
+    if profile is not None:
+        profile.add_bytes(read, written, stage_name)
+
+
+def timed_iter(items: Iterable[Any], name: str) -> Iterator[Any]:
+    """逐项迭代时把生成下一项的耗时计入指定阶段（用于流式生成器）"""
+    iterator = iter(items)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def percentile(values: List[float], q: float) -> float:
+    """线性插值百分位数"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class RunReport:
+    """汇总一次运行中所有文件的计时，写出JSON和CSV报告"""
+
+    def __init__(self, top_n: int = 10):
+        self.top_n = top_n
+        self.files = []
+        # 被隔离的文件（超时、超出内存上限或使工作进程崩溃）
+        self.quarantined = []
+        self.run = FileProfile('<run>')
+        self.started = time.perf_counter()
+
+    def add(self, profile: Optional[Dict[str, Any]]):
+        if profile:
+            self.files.append(profile)
+
+    def slowest(self) -> List[Dict[str, Any]]:
+        return sorted(self.files, key=lambda item: item['wall'], reverse=True)[:self.top_n]
+
+    def stage_names(self) -> List[str]:
+        names = {name for item in self.files for name in item['stages']}
+        return [name for name in STAGES if name in names] + sorted(names - set(STAGES))
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        stages = {}
+        for name in self.stage_names():
+            walls = [item['stages'][name]['wall'] for item in self.files if name in item['stages']]
+            stages[name] = {
+                'files': len(walls),
+                'wall_total': sum(walls),
+                'cpu_total': sum(item['stages'][name]['cpu'] for item in self.files if name in item['stages']),
+                'bytes_read': sum(item['stages'][name]['bytes_read'] for item in self.files if name in item['stages']),
+                'bytes_written': sum(item['stages'][name]['bytes_written']
+                                     for item in self.files if name in item['stages']),
+                'p50': percentile(walls, 0.5),
+                'p90': percentile(walls, 0.9),
+                'p99': percentile(walls, 0.99),
+                'max': max(walls)
+            }
+
+        walls = [item['wall'] for item in self.files]
+        total_read = sum(item['bytes_read'] for item in self.files)
+        return {
+            'elapsed': elapsed,
+            'files': len(self.files),
+            'failed': sum(1 for item in self.files if item['error']),
+            'files_per_sec': len(self.files) / elapsed if elapsed else 0.0,
+            'mb_read_per_sec': total_read / 1024 / 1024 / elapsed if elapsed else 0.0,
+            'bytes_read': total_read,
+            'bytes_written': sum(item['bytes_written'] for item in self.files),
+            'peak_rss_mb': max([item['peak_rss_mb'] for item in self.files if item['peak_rss_mb'] is not None]
+                               + [process_peak_rss_mb()]),
+            'file_wall': {
+                'p50': percentile(walls, 0.5),
+                'p90': percentile(walls, 0.9),
+                'p99': percentile(walls, 0.99),
+                'max': max(walls, default=0.0)
+            },
+            'stages': stages,
+            'run_stages': self.run.to_dict()['stages'],
+            'quarantined': self.quarantined
+        }
+
+    def write(self, output_dir: Path, name: str = 'run_report') -> Dict[str, Any]:
+        """写出 <name>.json（汇总+最慢文件+明细）和 <name>.csv（每文件一行）"""
+        summary = self.summary()
+        report = {
+            'summary': summary,
+            'slowest': [{'file': item['file'], 'wall': item['wall'], 'error': item['error']}
+                        for item in self.slowest()],
+            'files': self.files
+        }
+
+        tmp_path = output_dir / f".{name}.json.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, output_dir / f"{name}.json")
+
+        stage_names = self.stage_names()
+        tmp_path = output_dir / f".{name}.csv.tmp"
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['file', 'wall', 'cpu', 'bytes_read', 'bytes_written', 'peak_rss_mb', 'error']
+                            + [f"{stage_name}_wall" for stage_name in stage_names])
+            for item in self.files:
+                writer.writerow([item['file'], f"{item['wall']:.6f}", f"{item['cpu']:.6f}",
+                                 item['bytes_read'], item['bytes_written'], f"{item['peak_rss_mb']:.1f}" if item['peak_rss_mb'] is not None else '',
+                                 item['error'] or '']
+                                + [f"{item['stages'][stage_name]['wall']:.6f}" if stage_name in item['stages'] else ''
+                                   for stage_name in stage_names])
+        os.replace(tmp_path, output_dir / f"{name}.csv")
+
+        return summary
+
+    def log_summary(self, summary: Dict[str, Any]):
+        """在日志中输出各阶段耗时占比、最慢的文件和被隔离的文件"""
+        for item in summary['quarantined']:
+            logger.warning(f"已隔离: {item['file']}（{item['reason']}）")
+        if not self.files:
+            return
+        total = sum(stage_summary['wall_total'] for stage_summary in summary['stages'].values()) or 1.0
+        parts = ', '.join(f"{name} {values['wall_total']:.2f}s ({values['wall_total'] / total:.0%})"
+                          for name, values in summary['stages'].items())
+        logger.info(f"阶段耗时: {parts}")
+        logger.info(f"吞吐: {summary['files_per_sec']:.2f} 文件/秒, {summary['mb_read_per_sec']:.2f} MB/秒, "
+                    f"峰值内存 {summary['peak_rss_mb']:.0f} MB")
+        for item in self.slowest()[:3]:
+            logger.info(f"较慢文件: {item['file']} {item['wall']:.2f}s")
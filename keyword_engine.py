@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+关键词与文本模式匹配引擎
+关键词词典编译为Aho-Corasick自动机，标题/问题/SQL/步骤等正则在启动时预编译，
+供 document_processor.py 的Q&A转换流程使用
+"""
+
+import re
+import json
+from collections import deque
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 默认词典；可通过JSON配置文件覆盖或扩充（键名相同）
+DEFAULT_KEYWORD_CONFIG = {
+    # 技术关键词
+    'tech_keywords': [
+        'SRMS', 'SQL', 'IE', 'Edge', 'Login', 'Batch', 'Journal',
+        'Demand Note', 'SPS', 'Occupant', 'Building ID', 'CashType',
+        'Synergis', 'Community App', 'Facility Booking'
+    ],
+    # 操作关键词
+    'action_keywords': [
+        '设置', '配置', '登录', '删除', '更新', '导出', '列印', '解锁',
+        '修复', '处理', '解决', '安装', '注册', '上传', '下载'
+    ],
+    # 短文本中出现即视为标题的词
+    'heading_keywords': ['问题', '解决', '步骤', '方法', '设置', '配置'],
+    # 已带有这些词的问题不再添加"如何"等前缀
+    'question_prefixes': ['如何', '怎样', '什么', '为什么', '问题']
+}
+
+# 标题判断规则（任一匹配即为标题）
+HEADING_PATTERNS = [
+    r'^第[一二三四五六七八九十\d]+[章节部分]',
+    r'^\d+[\.\s]',
+    r'^[一二三四五六七八九十]+[\.\s]',
+    r'^问题[:：]',
+    r'^解决方案[:：]',
+    r'^步骤[:：]',
+    r'^注意[:：]'
+]
+
+# 从内容中提取具体问题的规则（按顺序取第一个匹配）
+QUESTION_PATTERNS = [
+    r'问题[:：](.+?)(?=解决|答案|方法|步骤|$)',
+    r'故障[:：](.+?)(?=解决|修复|处理|$)',
+    r'错误[:：](.+?)(?=解决|修复|处理|$)',
+    r'如何(.+?)(?=\n|$)',
+    r'怎样(.+?)(?=\n|$)'
+]
+
+# 问题泛化的替换规则（按顺序执行）
+GENERALIZE_RULES = [
+    # 替换具体数字为通用描述
+    (r'\d{4}-\d{2}-\d{2}', '[日期]'),
+    (r'\d+', '[数字]'),
+    # 替换具体名称为通用描述
+    (r'小区\d+', '[小区名称]'),
+    (r'用户\w+', '[用户名]')
+]
+
+SQL_PATTERN = r'(SELECT|INSERT|UPDATE|DELETE|CREATE|ALTER|DROP)\s+.*?;'
+STEP_PATTERN = r'步骤\s*\d+[:：](.+?)(?=步骤\s*\d+|$)'
+CJK_WORD_PATTERN = r'[\u4e00-\u9fff]{2,}'
+
+
+class KeywordAutomaton:
+    """多关键词子串匹配的Aho-Corasick自动机
+
+    构建时把goto/fail函数展开为完整的状态转移表（DFA），扫描时每个字符
+    只做一次字典查找，耗时与文本长度成正比，与词典大小基本无关。
+    词典较小时逐个子串查找（C实现）反而更快，因此低于阈值时直接使用。
+    """
+
+    # 词典条目数低于此值时使用逐个子串查找
+    SCAN_THRESHOLD = 64
+
+    def __init__(self, keywords: List[str], case_sensitive: bool = False):
+        self.keywords = list(keywords)
+        self.case_sensitive = case_sensitive
+        self._needles = [self._normalize(keyword) for keyword in self.keywords]
+        self._use_automaton = len(self.keywords) >= self.SCAN_THRESHOLD
+        if self._use_automaton:
+            self._build()
+
+    def _normalize(self, text: str) -> str:
+        return text if self.case_sensitive else text.lower()
+
+    def _build(self):
+        goto = [{}]
+        outputs = [[]]
+        for i, needle in enumerate(self._needles):
+            if not needle:
+                continue
+            state = 0
+            for char in needle:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = goto[state][char] = len(goto)
+                    goto.append({})
+                    outputs.append([])
+                state = next_state
+            outputs[state].append(i)
+
+        # 按广度优先顺序计算失败链接，并把转移展开为完整DFA
+        fail = [0] * len(goto)
+        delta = [None] * len(goto)
+        delta[0] = dict(goto[0])
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            delta[state] = dict(delta[fail[state]])
+            delta[state].update(goto[state])
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            for char, next_state in goto[state].items():
+                fail[next_state] = delta[fail[state]].get(char, 0) if state else 0
+                queue.append(next_state)
+
+        self._delta = delta
+        self._outputs = outputs
+
+    def find(self, text: str) -> List[str]:
+        """返回在文本中出现过的关键词（按词典顺序，不重复）"""
+        text = self._normalize(text)
+        if not self._use_automaton:
+            return [keyword for keyword, needle in zip(self.keywords, self._needles) if needle and needle in text]
+
+        hits = set()
+        state = 0
+        delta = self._delta
+        outputs = self._outputs
+        for char in text:
+            state = delta[state].get(char, 0)
+            if outputs[state]:
+                hits.update(outputs[state])
+        return [self.keywords[i] for i in sorted(hits)]
+
+    def contains_any(self, text: str) -> bool:
+        """文本中是否出现任一关键词"""
+        text = self._normalize(text)
+        if not self._use_automaton:
+            return any(needle and needle in text for needle in self._needles)
+
+        state = 0
+        delta = self._delta
+        outputs = self._outputs
+        for char in text:
+            state = delta[state].get(char, 0)
+            if outputs[state]:
+                return True
+        return False
+
+
+def load_keyword_config(path: Optional[str] = None) -> Dict[str, List[str]]:
+    """读取关键词配置；未指定文件时使用默认词典
+
+    配置文件为JSON对象，键名与 DEFAULT_KEYWORD_CONFIG 相同，
+    出现的键整体替换默认词典，未出现的键保持默认。
+    """
+    config = {key: list(values) for key, values in DEFAULT_KEYWORD_CONFIG.items()}
+    if not path:
+        return config
+
+    with open(Path(path), 'r', encoding='utf-8') as f:
+        overrides = json.load(f)
+
+    for key, values in overrides.items():
+        if key not in config:
+            logger.warning(f"关键词配置中未知的键: {key}")
+            continue
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"关键词配置 {key} 必须是字符串列表")
+        config[key] = values
+    return config
+
+
+class TextMatchers:
+    """Q&A转换用到的全部匹配器，构造时一次性编译"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = config or load_keyword_config()
+
+        self.keywords = KeywordAutomaton(config['tech_keywords'] + config['action_keywords'])
+        self.heading_keywords = KeywordAutomaton(config['heading_keywords'], case_sensitive=True)
+        self.question_prefixes = KeywordAutomaton(config['question_prefixes'], case_sensitive=True)
+
+        # 标题规则合并为一个正则，一次match完成判断
+        self.heading = re.compile('|'.join(f'(?:{pattern})' for pattern in HEADING_PATTERNS))
+        self.questions = [re.compile(pattern, re.DOTALL | re.IGNORECASE) for pattern in QUESTION_PATTERNS]
+        self.generalize_rules = [(re.compile(pattern), replacement) for pattern, replacement in GENERALIZE_RULES]
+        self.sql = re.compile(SQL_PATTERN, re.IGNORECASE | re.DOTALL)
+        self.steps = re.compile(STEP_PATTERN, re.DOTALL)
+        self.cjk_words = re.compile(CJK_WORD_PATTERN)
+        self.newlines = re.compile(r'\n+')
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+处理结果的输出写出器
+每种输出格式（Word、JSON、JSONL、Markdown）一个写出器，运行时可任意组合；
+写出器既支持整篇写出，也支持流式处理时逐条追加
+"""
+
+import os
+import json
+import shutil
+import socket
+import tempfile
+from pathlib import Path
+from typing import List, Dict, Any, TYPE_CHECKING
+import logging
+
+from records import json_default
+
+if TYPE_CHECKING:
+    from document_processor import DocumentProcessor
+
+logger = logging.getLogger(__name__)
+
+# 默认输出：与早期版本一致的Word文档和调试用JSON
+DEFAULT_OUTPUTS = ['docx', 'json']
+
+
+def tmp_path_for(path: Path) -> Path:
+    """同目录下的临时文件路径，写完后 os.replace 到 path
+
+    文件名包含主机名和进程号：分布式处理时租约过期的工作进程仍在写出，
+    另一台主机上接手的进程写同一个输出也不会共用临时文件，最终文件总是完整的一份。
+    """
+    return path.with_name(f".{path.name}.{socket.gethostname()}.{os.getpid()}.tmp")
+
+
+class StreamingJsonWriter:
+    """增量写出与 save_processed_content 相同结构的 _data.json
+
+    Q&A直接写入目标临时文件；原始内容的sections和images先写入同目录下的
+    暂存文件，关闭时再拼接到末尾，因此任何时刻只有当前条目在内存中。
+    """
+
+    def __init__(self, path: Path, header: Dict[str, Any], raw_meta: Dict[str, Any]):
+        self.path = path
+        self.tmp_path = tmp_path_for(path)
+        self.raw_meta = raw_meta
+        self.counts = {'qa_pairs': 0, 'sections': 0, 'images': 0}
+
+        self.file = open(self.tmp_path, 'w', encoding='utf-8')
+        self.sections_spool = tempfile.TemporaryFile('w+', encoding='utf-8', dir=path.parent)
+        self.images_spool = tempfile.TemporaryFile('w+', encoding='utf-8', dir=path.parent)
+
+        self.file.write('{\n')
+        for key, value in header.items():
+            self.file.write(f'  {json.dumps(key)}: {json.dumps(value, ensure_ascii=False)},\n')
+        self.file.write('  "qa_pairs": [')
+
+    def _write_item(self, stream, kind: str, item: Dict[str, Any], indent: int):
+        """以与 json.dump(indent=2) 一致的缩进写入数组元素"""
+        prefix = ' ' * indent
+        text = json.dumps(item, ensure_ascii=False, indent=2, default=json_default).replace('\n', '\n' + prefix)
+        stream.write((',\n' if self.counts[kind] else '\n') + prefix + text)
+        self.counts[kind] += 1
+
+    def add_qa(self, qa: Dict[str, Any]):
+        self._write_item(self.file, 'qa_pairs', qa, 4)
+
+    def add_section(self, section: Dict[str, Any]):
+        self._write_item(self.sections_spool, 'sections', section, 6)
+
+    def add_image(self, image: Dict[str, Any]):
+        self._write_item(self.images_spool, 'images', image, 6)
+
+    def _close_array(self, kind: str, indent: int) -> str:
+        return ('\n' + ' ' * indent + ']') if self.counts[kind] else ']'
+
+    def close(self) -> Path:
+        """拼接暂存内容并原子地替换目标文件"""
+        self.file.write(self._close_array('qa_pairs', 2) + ',\n  "raw_content": {\n')
+        for key, value in self.raw_meta.items():
+            self.file.write(f'    {json.dumps(key)}: {json.dumps(value, ensure_ascii=False)},\n')
+
+        for kind, spool in (('sections', self.sections_spool), ('images', self.images_spool)):
+            self.file.write(f'    "{kind}": [')
+            spool.seek(0)
+            shutil.copyfileobj(spool, self.file)
+            spool.close()
+            self.file.write(self._close_array(kind, 4) + (',\n' if kind == 'sections' else '\n'))
+
+        self.file.write('  }\n}')
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def abort(self):
+        """放弃写出，删除临时文件"""
+        self.sections_spool.close()
+        self.images_spool.close()
+        self.file.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+
+class TextSession:
+    """逐行写出的文本输出：先写临时文件，关闭时原子替换"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.tmp_path = tmp_path_for(path)
+        self.file = open(self.tmp_path, 'w', encoding='utf-8')
+        self.qa_count = 0
+
+    def add_section(self, section: Dict[str, Any]):
+        pass
+
+    def add_image(self, image: Dict[str, Any]):
+        pass
+
+    def close(self) -> Path:
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def abort(self):
+        self.file.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+
+class JsonlSession(TextSession):
+    """每行一个问答对的JSON对象"""
+
+    def __init__(self, path: Path, document: str):
+        super().__init__(path)
+        self.document = document
+
+    def add_qa(self, qa: Dict[str, Any]):
+        record = dict(qa, document=self.document)
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.qa_count += 1
+
+
+class MarkdownSession(TextSession):
+    """Markdown格式的问答文档，图片以相对路径引用图片存储"""
+
+    def __init__(self, path: Path, title: str, image_path):
+        super().__init__(path)
+        self.image_path = image_path
+        self.file.write(f'# 知识库文档：{title}\n\n')
+
+    def add_qa(self, qa: Dict[str, Any]):
+        self.qa_count += 1
+        lines = [f'## Q{self.qa_count}: {qa["question"]}', '', f'**A:** {qa["answer"]}', '']
+        if qa.get('type') == 'image' and qa.get('image_hash'):
+            lines += [f'![{qa["question"]}]({self.image_path(qa)})', '']
+        if qa.get('keywords'):
+            lines += [f'*关键词: {", ".join(qa["keywords"])}*', '']
+        lines += ['---', '', '']
+        self.file.write('\n'.join(lines))
+
+
+class DocxSession:
+    """逐条追加问答对的Word文档，关闭时填写问答对数量并保存"""
+
+    def __init__(self, processor: 'DocumentProcessor', path: Path, title: str):
+        self.processor = processor
+        self.path = path
+        self.doc, self.summary_para = processor.begin_word_document(title)
+        self.qa_count = 0
+
+    def add_section(self, section: Dict[str, Any]):
+        pass
+
+    def add_image(self, image: Dict[str, Any]):
+        pass
+
+    def add_qa(self, qa: Dict[str, Any]):
+        self.qa_count += 1
+        self.processor.add_qa_to_word_document(self.doc, qa, self.qa_count)
+
+    def close(self) -> Path:
+        self.processor.finish_word_document(self.doc, self.summary_para, self.qa_count, self.path)
+        return self.path
+
+    def abort(self):
+        self.doc = None
+
+
+class OutputWriter:
+    """输出写出器基类
+
+    open 返回一个会话（add_section / add_image / add_qa / close / abort），
+    流式处理时逐条追加；write 一次写出整篇文档，默认通过会话实现。
+    """
+
+    name = ''
+    suffix = ''
+
+    def __init__(self, processor: 'DocumentProcessor'):
+        self.processor = processor
+
+    def path_for(self, original_file: Path) -> Path:
+        return self.processor.output_dir / f"{self.processor.output_stem(original_file)}{self.suffix}"
+
+    def open(self, original_file: Path, meta: Dict[str, Any]):
+        raise NotImplementedError
+
+    def write(self, original_file: Path, content: Dict[str, Any], qa_pairs: List[Dict[str, Any]]) -> Path:
+        meta = {key: content[key] for key in ('title', 'source_file', 'type')}
+        session = self.open(original_file, meta)
+        try:
+            for section in content.get('sections', []):
+                session.add_section(section)
+            for image in content.get('images', []):
+                session.add_image(image)
+            for qa in qa_pairs:
+                session.add_qa(qa)
+        except Exception:
+            session.abort()
+            raise
+        return session.close()
+
+
+class DocxOutputWriter(OutputWriter):
+    """Word文档：每个问答对一个标题和段落，图片嵌入文档"""
+
+    name = 'docx'
+    suffix = '_processed.docx'
+
+    def open(self, original_file: Path, meta: Dict[str, Any]) -> DocxSession:
+        return DocxSession(self.processor, self.path_for(original_file), meta['title'])
+
+
+class JsonOutputWriter(OutputWriter):
+    """调试用JSON：问答对和原始内容"""
+
+    name = 'json'
+    suffix = '_data.json'
+
+    def open(self, original_file: Path, meta: Dict[str, Any]) -> StreamingJsonWriter:
+        return StreamingJsonWriter(self.path_for(original_file), {'original_file': str(original_file)}, meta)
+
+    def write(self, original_file: Path, content: Dict[str, Any], qa_pairs: List[Dict[str, Any]]) -> Path:
+        path = self.path_for(original_file)
+        tmp_path = tmp_path_for(path)
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'original_file': str(original_file),
+                    'qa_pairs': qa_pairs,
+                    'raw_content': content
+                }, f, ensure_ascii=False, indent=2, default=json_default)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        os.replace(tmp_path, path)
+        return path
+
+
+class JsonlOutputWriter(OutputWriter):
+    """JSONL：每行一个问答对，适合直接导入知识库"""
+
+    name = 'jsonl'
+    suffix = '_qa.jsonl'
+
+    def open(self, original_file: Path, meta: Dict[str, Any]) -> JsonlSession:
+        return JsonlSession(self.path_for(original_file), self.processor.document_key(original_file))
+
+
+class MarkdownOutputWriter(OutputWriter):
+    """Markdown：与Word文档相同的结构，生成速度快且便于审阅"""
+
+    name = 'markdown'
+    suffix = '.md'
+
+    def open(self, original_file: Path, meta: Dict[str, Any]) -> MarkdownSession:
+        return MarkdownSession(self.path_for(original_file), meta['title'], self.image_link)
+
+    def image_link(self, qa: Dict[str, Any]) -> str:
+        store = self.processor.image_store
+        path = store.path_for(qa['image_hash'], qa['image_format'])
+        return path.relative_to(self.processor.output_dir).as_posix()
+
+
+# 输出格式名称 -> 写出器（按此顺序写出）
+OUTPUT_WRITERS = {
+    'docx': DocxOutputWriter,
+    'json': JsonOutputWriter,
+    'jsonl': JsonlOutputWriter,
+    'markdown': MarkdownOutputWriter,
+}
+
+
+def create_writers(processor: 'DocumentProcessor', names: List[str]) -> List[OutputWriter]:
+    """按固定顺序创建所选格式的写出器"""
+    unknown = set(names) - set(OUTPUT_WRITERS)
+    if unknown:
+        raise ValueError(f"不支持的输出格式: {', '.join(sorted(unknown))}")
+    return [writer(processor) for name, writer in OUTPUT_WRITERS.items() if name in names]
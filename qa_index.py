@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Q&A本地检索索引
+基于BM25对 document_processor.py 生成的问答对建立倒排索引，
+用于离线检查检索效果和延迟
+"""
+
+import os
+import re
+import json
+import math
+import time
+import argparse
+from collections import Counter
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("请安装numpy: pip install numpy")
+
+logger = logging.getLogger(__name__)
+
+# 索引格式版本，格式不兼容时递增
+INDEX_VERSION = 1
+
+# 中文按字符二元组切分，英文和数字按整词切分
+TOKEN_PATTERN = re.compile(r'[\u4e00-\u9fff]+|[a-z0-9]+')
+
+# 段数量或已删除比例超过阈值时合并为单个段
+MAX_SEGMENTS = 8
+MAX_DELETED_RATIO = 0.25
+
+
+def tokenize(text: str) -> List[str]:
+    """将文本切分为检索词：中文字符二元组 + 小写英文/数字词"""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        run = match.group()
+        if run[0] >= '\u4e00':
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def qa_text(qa: Dict[str, Any]) -> str:
+    """参与索引的问答文本"""
+    return '\n'.join([qa.get('question', ''), qa.get('answer', ''), ' '.join(qa.get('keywords', []))])
+
+
+class QAIndex:
+    """分段的BM25倒排索引
+
+    每个段是一个按词项排序的CSR矩阵（indptr/docs/tf三个.npy文件），以内存映射
+    方式读取。更新文档时旧行只做删除标记，新行写入新的段；段过多或删除比例
+    过高时整体重建为单个段。问答原文保存在 docs.jsonl 中，按偏移量随机读取。
+    """
+
+    def __init__(self, index_dir: str, k1: float = 1.5, b: float = 0.75):
+        self.index_dir = Path(index_dir)
+        self.k1 = k1
+        self.b = b
+
+        self.terms = []
+        self.vocab = {}
+        self.df = np.zeros(0, dtype=np.int32)
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.deleted = np.zeros(0, dtype=bool)
+        self.doc_offsets = np.zeros(0, dtype=np.int64)
+        self.sources = {}
+        self.segments = []
+        self.next_segment = 1
+
+        # 尚未写入段的新行：(source, qa, 词频)
+        self.pending = []
+        self._norm = None
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.doc_len)
+
+    @classmethod
+    def open(cls, index_dir: str, **kwargs) -> 'QAIndex':
+        """打开已有索引，不存在时返回空索引"""
+        index = cls(index_dir, **kwargs)
+        meta_path = index.index_dir / 'meta.json'
+        if not meta_path.exists():
+            return index
+
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION:
+            # 旧格式的 docs.jsonl 和段文件不能与新写入的行混用，清空后从空索引开始
+            logger.warning(f"索引版本不匹配，已清空旧索引，需要全量重建: {index.index_dir}")
+            clear_index_dir(index.index_dir)
+            return index
+
+        index.k1, index.b = meta['k1'], meta['b']
+        index.next_segment = meta['next_segment']
+        with open(index.index_dir / 'vocab.json', 'r', encoding='utf-8') as f:
+            index.terms = json.load(f)
+        index.vocab = {term: i for i, term in enumerate(index.terms)}
+        with open(index.index_dir / 'sources.json', 'r', encoding='utf-8') as f:
+            index.sources = json.load(f)
+
+        index.df = np.load(index.index_dir / 'df.npy')
+        index.doc_len = np.load(index.index_dir / 'doc_len.npy')
+        index.deleted = np.load(index.index_dir / 'deleted.npy')
+        index.doc_offsets = np.load(index.index_dir / 'doc_offsets.npy')
+        for name in meta['segments']:
+            index.segments.append(tuple(
+                np.load(index.index_dir / f"{name}.{part}.npy", mmap_mode='r')
+                for part in ('indptr', 'docs', 'tf')
+            ) + (name,))
+        return index
+
+    def add_document(self, source: str, qa_pairs: Iterable[Dict[str, Any]]):
+        """添加（或替换）一个源文档的全部问答对"""
+        self.remove_document(source)
+        for qa in qa_pairs:
+            self.pending.append((source, qa, Counter(tokenize(qa_text(qa)))))
+
+    def remove_document(self, source: str):
+        """删除一个源文档的问答对（标记删除，并同步词项文档频率）"""
+        self.pending = [item for item in self.pending if item[0] != source]
+        rows = self.sources.pop(source, [])
+        if not rows:
+            return
+
+        for row in rows:
+            self.deleted[row] = True
+            for term in set(tokenize(qa_text(self.read_row(row)))):
+                term_id = self.vocab.get(term)
+                if term_id is not None:
+                    self.df[term_id] -= 1
+        self._norm = None
+
+    def read_row(self, row: int) -> Dict[str, Any]:
+        """读取一行对应的问答记录"""
+        with open(self.index_dir / 'docs.jsonl', 'rb') as f:
+            f.seek(int(self.doc_offsets[row]))
+            return json.loads(f.readline())
+
+    def save(self):
+        """写出新增的段和元数据，必要时合并所有段"""
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        if self.pending:
+            self._flush_pending()
+
+        live = self.num_rows - int(self.deleted.sum())
+        if len(self.segments) > MAX_SEGMENTS or (self.num_rows and live < self.num_rows * (1 - MAX_DELETED_RATIO)):
+            self.compact()
+            return
+
+        self._write_metadata()
+
+    def _flush_pending(self):
+        """把待写入的新行追加到 docs.jsonl 并生成一个新段"""
+        base = self.num_rows
+        doc_len = []
+        offsets = []
+        term_ids = []
+        rows = []
+        tfs = []
+
+        with open(self.index_dir / 'docs.jsonl', 'ab') as f:
+            for i, (source, qa, counts) in enumerate(self.pending):
+                row = base + i
+                offsets.append(f.tell())
+                record = dict(qa, document=source)
+                f.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+                self.sources.setdefault(source, []).append(row)
+                doc_len.append(sum(counts.values()))
+                for term, tf in counts.items():
+                    term_id = self.vocab.get(term)
+                    if term_id is None:
+                        term_id = self.vocab[term] = len(self.terms)
+                        self.terms.append(term)
+                    term_ids.append(term_id)
+                    rows.append(row)
+                    tfs.append(tf)
+
+        self.doc_len = np.concatenate([self.doc_len, np.asarray(doc_len, dtype=np.int32)])
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(doc_len), dtype=bool)])
+        self.doc_offsets = np.concatenate([self.doc_offsets, np.asarray(offsets, dtype=np.int64)])
+
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        rows = np.asarray(rows, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float32)
+        self.df = np.concatenate([self.df, np.zeros(len(self.terms) - len(self.df), dtype=np.int32)])
+        np.add.at(self.df, term_ids, 1)
+
+        # 按词项、行号排序得到词项主序的CSR
+        order = np.lexsort((rows, term_ids))
+        indptr = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(self.terms)), out=indptr[1:])
+
+        name = f"seg_{self.next_segment:04d}"
+        self.next_segment += 1
+        arrays = (indptr, rows[order], tfs[order])
+        for part, array in zip(('indptr', 'docs', 'tf'), arrays):
+            np.save(self.index_dir / f"{name}.{part}.npy", array)
+        self.segments.append(arrays + (name,))
+        self.pending = []
+        self._norm = None
+
+    def compact(self):
+        """丢弃已删除的行，把所有段合并为一个新段"""
+        live_rows = np.flatnonzero(~self.deleted)
+        records = [self.read_row(int(row)) for row in live_rows]
+        old_segments = [segment[-1] for segment in self.segments]
+        docs_path = self.index_dir / 'docs.jsonl'
+
+        self.terms = []
+        self.vocab = {}
+        self.df = np.zeros(0, dtype=np.int32)
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.deleted = np.zeros(0, dtype=bool)
+        self.doc_offsets = np.zeros(0, dtype=np.int64)
+        self.sources = {}
+        self.segments = []
+        self.pending = []
+        if docs_path.exists():
+            docs_path.unlink()
+
+        for record in records:
+            source = record.pop('document')
+            self.pending.append((source, record, Counter(tokenize(qa_text(record)))))
+        if self.pending:
+            self._flush_pending()
+        self._write_metadata()
+
+        for name in old_segments:
+            for part in ('indptr', 'docs', 'tf'):
+                (self.index_dir / f"{name}.{part}.npy").unlink(missing_ok=True)
+
+    def _write_metadata(self):
+        """写出元数据；meta.json 最后替换，保证读者看到完整的一致状态"""
+        def replace_npy(name: str, array):
+            tmp_path = self.index_dir / f".{name}.tmp.npy"
+            np.save(tmp_path, array)
+            os.replace(tmp_path, self.index_dir / name)
+
+        def replace_json(name: str, data):
+            tmp_path = self.index_dir / f".{name}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_dir / name)
+
+        replace_npy('df.npy', self.df)
+        replace_npy('doc_len.npy', self.doc_len)
+        replace_npy('deleted.npy', self.deleted)
+        replace_npy('doc_offsets.npy', self.doc_offsets)
+        replace_json('vocab.json', self.terms)
+        replace_json('sources.json', self.sources)
+        replace_json('meta.json', {
+            'version': INDEX_VERSION,
+            'k1': self.k1,
+            'b': self.b,
+            'num_rows': self.num_rows,
+            'segments': [segment[-1] for segment in self.segments],
+            'next_segment': self.next_segment
+        })
+
+    def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """返回与查询最相关的k个问答对（附带document和score字段）"""
+        live = self.num_rows - int(self.deleted.sum())
+        if not live:
+            return []
+
+        if self._norm is None:
+            avgdl = float(self.doc_len[~self.deleted].mean()) or 1.0
+            self._norm = (self.k1 * (1 - self.b + self.b * self.doc_len / avgdl)).astype(np.float32)
+
+        scores = np.zeros(self.num_rows, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None or self.df[term_id] <= 0:
+                continue
+            df = int(self.df[term_id])
+            idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+
+            for indptr, docs, tfs, _ in self.segments:
+                if term_id + 1 >= len(indptr):
+                    continue
+                start, end = indptr[term_id], indptr[term_id + 1]
+                if start == end:
+                    continue
+                rows = docs[start:end]
+                tf = tfs[start:end]
+                # 同一词项在一个段内每行只出现一次，可以直接按下标累加
+                scores[rows] += idf * tf * (self.k1 + 1) / (tf + self._norm[rows])
+
+        scores[self.deleted] = 0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = np.sort(candidates[np.argpartition(-scores[candidates], k - 1)[:k]])
+        # 稳定排序：同分时按行号（即写入顺序）排列
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+        results = []
+        for row in candidates:
+            record = self.read_row(int(row))
+            record['score'] = float(scores[row])
+            results.append(record)
+        return results
+
+
+# 处理结果中包含问答对的输出文件（_data.json 或 _qa.jsonl，按此顺序优先）
+QA_OUTPUT_SUFFIXES = ('_data.json', '_qa.jsonl')
+
+
+def read_qa_output(path: Path) -> List[Dict[str, Any]]:
+    """读取一个输出文件中的问答对"""
+    with open(path, 'r', encoding='utf-8') as f:
+        if str(path).endswith('.jsonl'):
+            qa_pairs = [json.loads(line) for line in f if line.strip()]
+            for qa in qa_pairs:
+                qa.pop('document', None)
+            return qa_pairs
+        return json.load(f)['qa_pairs']
+
+
+def load_processed_outputs(output_dir: str) -> Iterable[Tuple[str, List[Dict[str, Any]]]]:
+    """读取处理结果，产出 (源文档标识, 问答对列表)
+
+    有处理清单时以清单中的相对路径为源文档标识，与增量更新保持一致；
+    否则退回到 _data.json 中记录的原始文件路径。有知识库快照时，输出文件
+    未变的文档直接从快照读取，只有快照生成后重新处理过的文档解析JSON。
+    """
+    output_dir = Path(output_dir)
+    manifest_path = output_dir / 'manifest.json'
+    if manifest_path.exists():
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        # SQLite存储方式：从数据库读取
+        if manifest.get('storage') == 'sqlite':
+            yield from _load_from_catalog(output_dir / 'knowledge_base.sqlite')
+            return
+
+        from corpus_snapshot import CorpusSnapshot, document_fingerprint
+
+        snapshot = CorpusSnapshot.open(str(output_dir))
+        try:
+            for source, entry in sorted(manifest.get('documents', {}).items()):
+                names = [name for name in entry['outputs'] if name.endswith(QA_OUTPUT_SUFFIXES)]
+                if names:
+                    names.sort(key=lambda name: not name.endswith(QA_OUTPUT_SUFFIXES[0]))
+                    path = output_dir / names[0]
+                    qa_pairs = snapshot.qa_pairs(source, document_fingerprint(entry, path)) if snapshot else None
+                    yield source, read_qa_output(path) if qa_pairs is None else qa_pairs
+        finally:
+            if snapshot:
+                snapshot.close()
+        return
+
+    for json_path in sorted(output_dir.glob('*_data.json')):
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        yield data['original_file'], data['qa_pairs']
+
+
+def _load_from_catalog(db_path: Path) -> Iterable[Tuple[str, List[Dict[str, Any]]]]:
+    """从SQLite知识库目录按文档读取问答对"""
+    from catalog_store import CatalogStore
+
+    store = CatalogStore(str(db_path))
+    try:
+        source, qa_pairs = None, []
+        for qa in store.iter_qa_pairs():
+            document = qa.pop('document')
+            if document != source and qa_pairs:
+                yield source, qa_pairs
+                qa_pairs = []
+            source = document
+            qa_pairs.append(qa)
+        if qa_pairs:
+            yield source, qa_pairs
+    finally:
+        store.close()
+
+
+def clear_index_dir(index_dir: Path):
+    """删除索引目录中的全部文件"""
+    if index_dir.exists():
+        for path in index_dir.iterdir():
+            if path.is_file():
+                path.unlink()
+
+
+def index_is_current(index_dir: Path) -> bool:
+    """索引存在且为当前版本（可以增量更新）"""
+    try:
+        with open(index_dir / 'meta.json', 'r', encoding='utf-8') as f:
+            return json.load(f).get('version') == INDEX_VERSION
+    except (FileNotFoundError, ValueError):
+        return False
+
+
+def build_index(output_dir: str, index_dir: str,
+                documents: Optional[Iterable[Tuple[str, List[Dict[str, Any]]]]] = None) -> QAIndex:
+    """从处理结果目录全量建立索引；指定 documents 时改用给定的 (文档标识, 问答对列表)"""
+    index = QAIndex(index_dir)
+    clear_index_dir(Path(index_dir))
+
+    if documents is None:
+        documents = load_processed_outputs(output_dir)
+    for source, qa_pairs in documents:
+        index.add_document(source, qa_pairs)
+    index.save()
+    return index
+
+
+def main():
+    """命令行入口"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Q&A本地检索索引")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="从处理结果全量建立索引")
+    build_parser.add_argument('--output', default="已处理知识库", help="处理结果目录")
+    build_parser.add_argument('--index', help="索引目录（默认为处理结果目录下的 qa_index）")
+
+    query_parser = subparsers.add_parser('query', help="查询索引")
+    query_parser.add_argument('query', help="查询文本")
+    query_parser.add_argument('-k', type=int, default=5, help="返回结果数")
+    query_parser.add_argument('--index', default=os.path.join("已处理知识库", "qa_index"), help="索引目录")
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        index_dir = args.index or os.path.join(args.output, 'qa_index')
+        started = time.perf_counter()
+        index = build_index(args.output, index_dir)
+        logger.info(f"索引建立完成: {index.num_rows} 个问答对，{len(index.terms)} 个词项，"
+                    f"耗时 {time.perf_counter() - started:.2f} s")
+        return
+
+    index = QAIndex.open(args.index)
+    started = time.perf_counter()
+    results = index.search(args.query, args.k)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    for rank, result in enumerate(results, 1):
+        print(f"{rank}. [{result['score']:.3f}] {result['question']}  ({result['document']})")
+    print(f"\n共 {len(results)} 条结果，耗时 {elapsed_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
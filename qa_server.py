@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Q&A本地查询服务
+把 document_processor.py 生成的全部问答对和关键词加载到内存，通过HTTP
+（TCP端口或Unix套接字）提供关键词查询和全文检索，可作为工作流平台响应
+缓慢时的本地后备。重复查询由有容量上限的LRU缓存直接返回；处理程序写出
+新的结果后在后台重新加载语料并原子切换，正在处理的请求不受影响。
+每个响应都带有本次耗时和最近请求的P50/P99延迟
+"""
+
+import os
+import re
+import json
+import math
+import time
+import signal
+import argparse
+import threading
+import socketserver
+from collections import Counter, OrderedDict, deque, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+import logging
+
+from instrumentation import percentile
+from qa_index import load_processed_outputs, qa_text, tokenize
+
+logger = logging.getLogger(__name__)
+
+# 延迟统计只保留最近的若干个请求
+LATENCY_WINDOW = 10000
+# 响应中的P50/P99每隔若干个请求或若干秒才重新计算一次，避免每个请求都排序整个窗口
+PERCENTILE_REFRESH_REQUESTS = 100
+PERCENTILE_REFRESH_SECONDS = 1.0
+# 单次查询最多返回的结果数
+MAX_RESULTS = 100
+# 关键词查询时分隔多个关键词
+KEYWORD_SEPARATOR = re.compile(r'[\s,，;；、]+')
+
+
+def corpus_signature(output_dir: Path) -> Tuple:
+    """处理结果的版本标识：处理程序每次运行结束时原子地替换处理清单，
+    去重语料同样整体替换，两者的修改时间和大小不变即语料未变"""
+    signature = []
+    for name in ('manifest.json', 'deduplicated_qa.jsonl'):
+        try:
+            stat = (output_dir / name).stat()
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append((name, None, None))
+    return tuple(signature)
+
+
+def load_corpus_documents(output_dir: Path) -> Iterable[Tuple[str, List[Dict[str, Any]]]]:
+    """读取要提供查询的问答对：启用了去重时使用去重后的语料，否则读取全部处理结果"""
+    manifest_path = output_dir / 'manifest.json'
+    dedup_path = output_dir / 'deduplicated_qa.jsonl'
+    dedup = None
+    if manifest_path.exists():
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            dedup = json.load(f).get('dedup')
+    if dedup and dedup_path.exists():
+        documents = OrderedDict()
+        with open(dedup_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    qa = json.loads(line)
+                    if qa.get('duplicate_of'):
+                        continue
+                    documents.setdefault(qa.pop('document'), []).append(qa)
+        return documents.items()
+    return load_processed_outputs(str(output_dir))
+
+
+class QACorpus:
+    """内存中的只读语料快照：问答对列表、BM25倒排表和关键词表
+
+    快照建立后不再修改，重新加载时建立新的快照再整体替换，
+    因此查询线程无需加锁。
+    """
+
+    def __init__(self, documents: Iterable[Tuple[str, List[Dict[str, Any]]]], version: Any = None,
+                 k1: float = 1.5, b: float = 0.75):
+        self.version = version
+        self.k1 = k1
+        self.b = b
+        self.records = []
+        # 检索词 -> [(行号, 词频)]
+        self.postings = defaultdict(list)
+        # 小写关键词 -> [行号]
+        self.keywords = defaultdict(list)
+        lengths = []
+        for document, qa_pairs in documents:
+            for qa in qa_pairs:
+                row = len(self.records)
+                keywords = list(qa.get('keywords', []))
+                self.records.append({
+                    'question': qa.get('question', ''),
+                    'answer': qa.get('answer', ''),
+                    'keywords': keywords,
+                    'document': document
+                })
+                counts = Counter(tokenize(qa_text(qa)))
+                for term, tf in counts.items():
+                    self.postings[term].append((row, tf))
+                lengths.append(sum(counts.values()))
+                for keyword in set(keyword.lower() for keyword in keywords):
+                    self.keywords[keyword].append(row)
+        self.postings = dict(self.postings)
+        self.keywords = dict(self.keywords)
+        avgdl = (sum(lengths) / len(lengths)) if lengths else 1.0
+        self.norm = [k1 * (1 - b + b * length / (avgdl or 1.0)) for length in lengths]
+        self.documents = len({record['document'] for record in self.records})
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """BM25全文检索"""
+        scores = defaultdict(float)
+        total = len(self.records)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            for row, tf in postings:
+                scores[row] += idf * tf * (self.k1 + 1) / (tf + self.norm[row])
+        return self._top(scores, k)
+
+    def lookup(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """关键词查询：按命中的关键词个数排序（不区分大小写，完全匹配）"""
+        scores = defaultdict(float)
+        for keyword in set(part.lower() for part in KEYWORD_SEPARATOR.split(query) if part):
+            for row in self.keywords.get(keyword, ()):
+                scores[row] += 1.0
+        return self._top(scores, k)
+
+    def _top(self, scores: Dict[int, float], k: int) -> List[Dict[str, Any]]:
+        # 同分时按行号（即处理结果中的顺序）排列
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [dict(self.records[row], score=round(score, 4)) for row, score in ranked]
+
+
+class LRUCache:
+    """有容量上限的LRU缓存（线程安全）"""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(0, capacity)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any) -> Optional[Any]:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Any, value: Any):
+        if not self.capacity:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self.entries), 'capacity': self.capacity, 'hits': self.hits,
+                    'misses': self.misses, 'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0}
+
+
+class QAService:
+    """查询服务：持有当前的语料快照、结果缓存和延迟统计，并在后台检查语料更新"""
+
+    def __init__(self, output_dir: str, cache_size: int = 1024, reload_interval: float = 2.0):
+        self.output_dir = Path(output_dir)
+        self.reload_interval = reload_interval
+        self.cache = LRUCache(cache_size)
+        self.corpus = None
+        self.loaded_at = 0.0
+        self.reloads = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        # 最近一次计算的P50/P99（毫秒），以及计算时的请求数和时间
+        self.percentiles = {'p50': 0.0, 'p99': 0.0}
+        self.percentiles_requests = 0
+        self.percentiles_at = 0.0
+        self.stats_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.reload_thread = None
+
+    def load(self) -> bool:
+        """语料有变化时建立新的快照并替换当前快照，返回是否重新加载"""
+        signature = corpus_signature(self.output_dir)
+        if self.corpus is not None and signature == self.corpus.version:
+            return False
+        started = time.perf_counter()
+        corpus = QACorpus(load_corpus_documents(self.output_dir), version=signature)
+        # 先替换快照再清空缓存：缓存键带有语料版本，旧快照的结果不会再被命中
+        self.corpus = corpus
+        self.cache.clear()
+        self.loaded_at = time.time()
+        self.reloads += 1
+        logger.info(f"已加载语料: {corpus.documents} 个文档，{len(corpus)} 个问答对，"
+                    f"耗时 {time.perf_counter() - started:.2f} s")
+        return True
+
+    def start_reloading(self):
+        """启动后台线程，定期检查处理结果是否更新"""
+        self.reload_thread = threading.Thread(target=self._reload_loop, name='qa-reload', daemon=True)
+        self.reload_thread.start()
+
+    def _reload_loop(self):
+        while not self.stop_event.wait(self.reload_interval):
+            try:
+                self.load()
+            except Exception as e:
+                # 处理程序可能正在写出，下次检查时再试；旧快照继续提供服务
+                logger.warning(f"重新加载语料失败，继续使用当前版本: {str(e)}")
+
+    def query(self, text: str, mode: str = 'text', k: int = 5) -> Dict[str, Any]:
+        """执行一次查询；mode 为 text（全文检索）或 keyword（关键词查询）"""
+        started = time.perf_counter()
+        # 取一次快照引用，查询期间即使发生重新加载也使用同一个版本
+        corpus = self.corpus
+        k = max(1, min(k, MAX_RESULTS))
+        key = (corpus.version, mode, ' '.join(text.split()).lower(), k)
+        results = self.cache.get(key)
+        cached = results is not None
+        if not cached:
+            results = corpus.lookup(text, k) if mode == 'keyword' else corpus.search(text, k)
+            self.cache.put(key, results)
+        elapsed = time.perf_counter() - started
+        return {
+            'query': text,
+            'mode': mode,
+            'cached': cached,
+            'results': results,
+            'latency_ms': self.record_latency(elapsed)
+        }
+
+    def record_latency(self, elapsed: float) -> Dict[str, float]:
+        """记录一次请求的耗时，返回本次耗时和最近请求的P50/P99（毫秒）
+
+        P50/P99 最多每 PERCENTILE_REFRESH_REQUESTS 个请求或每 PERCENTILE_REFRESH_SECONDS 秒
+        重新计算一次，其余请求返回上次的结果；排序在锁外进行。
+        """
+        now = time.monotonic()
+        latencies = None
+        with self.stats_lock:
+            self.requests += 1
+            self.latencies.append(elapsed)
+            if (self.requests - self.percentiles_requests >= PERCENTILE_REFRESH_REQUESTS
+                    or now - self.percentiles_at >= PERCENTILE_REFRESH_SECONDS):
+                # 先占下这次计算，其他线程继续使用上次的结果
+                self.percentiles_requests = self.requests
+                self.percentiles_at = now
+                latencies = list(self.latencies)
+            percentiles = self.percentiles
+        if latencies is not None:
+            percentiles = {
+                'p50': round(percentile(latencies, 0.5) * 1000, 3),
+                'p99': round(percentile(latencies, 0.99) * 1000, 3)
+            }
+            with self.stats_lock:
+                self.percentiles = percentiles
+        return {'request': round(elapsed * 1000, 3), **percentiles}
+
+    def stats(self) -> Dict[str, Any]:
+        corpus = self.corpus
+        with self.stats_lock:
+            latencies = list(self.latencies)
+            requests = self.requests
+        return {
+            'output_dir': str(self.output_dir),
+            'documents': corpus.documents,
+            'qa_pairs': len(corpus),
+            'loaded_at': self.loaded_at,
+            'reloads': self.reloads,
+            'requests': requests,
+            'cache': self.cache.stats(),
+            'latency_ms': {
+                'p50': round(percentile(latencies, 0.5) * 1000, 3),
+                'p99': round(percentile(latencies, 0.99) * 1000, 3),
+                'max': round(max(latencies, default=0.0) * 1000, 3)
+            }
+        }
+
+
+class QARequestHandler(BaseHTTPRequestHandler):
+    """GET /search?q=…&k=5&mode=text|keyword，GET /stats，GET /health"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'QAServer/1.0'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def reply(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        parsed = urlsplit(self.path)
+        params = parse_qs(parsed.query)
+        if parsed.path == '/search':
+            text = params.get('q', [''])[0]
+            mode = params.get('mode', ['text'])[0]
+            if not text.strip() or mode not in ('text', 'keyword'):
+                return self.reply(400, {'error': "需要参数 q，mode 为 text 或 keyword"})
+            try:
+                k = int(params.get('k', ['5'])[0])
+            except ValueError:
+                return self.reply(400, {'error': "参数 k 必须是整数"})
+            return self.reply(200, service.query(text, mode, k))
+        if parsed.path == '/stats':
+            return self.reply(200, service.stats())
+        if parsed.path == '/health':
+            return self.reply(200, {'status': 'ok', 'qa_pairs': len(service.corpus)})
+        return self.reply(404, {'error': f"未知路径: {parsed.path}"})
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """监听Unix套接字的HTTP服务器"""
+
+    daemon_threads = True
+
+
+def create_server(service: QAService, host: str = '127.0.0.1', port: int = 8765,
+                  socket_path: Optional[str] = None) -> socketserver.BaseServer:
+    """创建HTTP服务器；指定 socket_path 时监听Unix套接字"""
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, QARequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), QARequestHandler)
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def main():
+    """命令行入口"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Q&A本地查询服务")
+    parser.add_argument('--output', default="已处理知识库", help="处理结果目录")
+    parser.add_argument('--host', default='127.0.0.1', help="监听地址（默认127.0.0.1）")
+    parser.add_argument('--port', type=int, default=8765, help="监听端口（默认8765）")
+    parser.add_argument('--socket', metavar='PATH', help="改为监听Unix套接字")
+    parser.add_argument('--cache-size', type=int, default=1024, help="结果缓存的最大条数（默认1024，0为不缓存）")
+    parser.add_argument('--reload-interval', type=float, default=2.0,
+                        help="检查处理结果是否更新的间隔（秒，默认2）")
+    args = parser.parse_args()
+
+    service = QAService(args.output, args.cache_size, args.reload_interval)
+    service.load()
+    server = create_server(service, args.host, args.port, args.socket)
+    # serve_forever 所在线程不能调用 shutdown，收到SIGTERM时在另一个线程中停止
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    service.start_reloading()
+    address = args.socket or f"http://{args.host}:{args.port}"
+    logger.info(f"查询服务已启动: {address}（缓存容量 {args.cache_size}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop_event.set()
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+        stats = service.stats()
+        logger.info(f"查询服务已停止: 共 {stats['requests']} 个请求，缓存命中率 {stats['cache']['hit_rate']:.0%}，"
+                    f"P50 {stats['latency_ms']['p50']} ms，P99 {stats['latency_ms']['p99']} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+处理结果的记录类型
+文档、章节、表格和问答对使用 __slots__ 定长记录代替字典：字段名只在类上保存一次，
+每个实例没有 __dict__。记录同时实现映射接口（下标、get、keys、items 等），
+原有按键读取的代码无需修改；字段顺序与写出的JSON一致，未设置的可选字段不出现
+"""
+
+from collections.abc import MutableMapping
+from typing import List, Dict, Any, Iterator, Optional
+
+
+class Record(MutableMapping):
+    """定长记录的基类：__slots__ 即字段及其在JSON中的顺序"""
+
+    __slots__ = ()
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.__slots__:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any):
+        if key not in self.__slots__:
+            raise KeyError(f"{type(self).__name__} 没有字段 {key!r}")
+        setattr(self, key, value)
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        delattr(self, key)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.__slots__ and hasattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return (name for name in self.__slots__ if hasattr(self, name))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self)
+        return f"{type(self).__name__}({fields})"
+
+    def copy(self) -> 'Record':
+        record = object.__new__(type(self))
+        for name in self:
+            setattr(record, name, getattr(self, name))
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为普通字典（嵌套的记录一并转换），键的顺序与JSON输出一致"""
+        return {name: to_plain(getattr(self, name)) for name in self}
+
+
+class TableRecord(Record):
+    """表格：第一行为表头，其余为数据行"""
+
+    __slots__ = ('headers', 'rows')
+
+    def __init__(self, headers: Optional[List[str]] = None, rows: Optional[List[List[str]]] = None):
+        self.headers = [] if headers is None else headers
+        self.rows = [] if rows is None else rows
+
+
+class SectionRecord(Record):
+    """章节：标题、正文、表格和图片"""
+
+    __slots__ = ('heading', 'content', 'tables', 'images')
+
+    def __init__(self, heading: str, content: str = '', tables: Optional[List[TableRecord]] = None,
+                 images: Optional[List[Dict[str, Any]]] = None):
+        self.heading = heading
+        self.content = content
+        self.tables = [] if tables is None else tables
+        self.images = [] if images is None else images
+
+
+class DocumentRecord(Record):
+    """一个源文档的解析结果"""
+
+    __slots__ = ('title', 'source_file', 'type', 'sections', 'images')
+
+    def __init__(self, title: str, source_file: str, type: str,
+                 sections: Optional[List[SectionRecord]] = None, images: Optional[List[Dict[str, Any]]] = None):
+        self.title = title
+        self.source_file = source_file
+        self.type = type
+        self.sections = [] if sections is None else sections
+        self.images = [] if images is None else images
+
+
+class QARecord(Record):
+    """问答对；chunk（分块来源）和 image_hash/image_format（图片Q&A）为可选字段"""
+
+    __slots__ = ('question', 'answer', 'keywords', 'source', 'type', 'chunk', 'image_hash', 'image_format')
+
+    def __init__(self, question: str, answer: str, keywords: List[str], source: str, type: str,
+                 chunk: Optional[Dict[str, Any]] = None, image_hash: Optional[str] = None,
+                 image_format: Optional[str] = None):
+        self.question = question
+        self.answer = answer
+        self.keywords = keywords
+        self.source = source
+        self.type = type
+        if chunk is not None:
+            self.chunk = chunk
+        if image_hash is not None:
+            self.image_hash = image_hash
+            self.image_format = image_format
+
+
+def to_plain(value: Any) -> Any:
+    """把记录（以及列表中的记录）转换为普通的字典和列表"""
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [to_plain(item) for item in value]
+    return value
+
+
+def json_default(value: Any) -> Any:
+    """json.dump 的 default：记录按字段顺序输出为JSON对象"""
+    if isinstance(value, Record):
+        return {name: getattr(value, name) for name in value}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+检索效果评测
+用一组标注了期望来源文档的真实问题（评测问题集），在处理结果上运行内置的
+BM25（或关键词）检索，统计 recall@k、命中率@k、MRR 和每个问题的检索延迟百分位；
+可以对比两次处理的结果，依据数据决定 is_heading、问题泛化和关键词词典等
+修改是否接受。全部在本机运行，不需要网络或工作流平台
+"""
+
+import sys
+import json
+import time
+import hashlib
+import argparse
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+import logging
+
+from instrumentation import percentile
+from qa_server import MAX_RESULTS, QACorpus, load_corpus_documents
+
+logger = logging.getLogger(__name__)
+
+# 结果格式版本，格式不兼容时递增
+RESULT_VERSION = 1
+
+DEFAULT_GOLDEN = '评测问题集.jsonl'
+DEFAULT_KS = [1, 3, 5, 10]
+EVAL_MODES = ('text', 'keyword')
+
+
+def load_golden(path: str) -> List[Dict[str, Any]]:
+    """读取评测问题集：每行一个JSON对象
+
+    question 为问题，expected 为期望的来源文档（一个或多个；可以写完整的相对路径、
+    文件名或不带扩展名的文件名），id 和 mode（text/keyword）可选。
+    """
+    queries = []
+    seen = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path} 第{line_number}行不是有效的JSON: {str(e)}")
+            expected = item.get('expected')
+            if isinstance(expected, str):
+                expected = [expected]
+            if not item.get('question') or not expected:
+                raise ValueError(f"{path} 第{line_number}行缺少 question 或 expected")
+            mode = item.get('mode', 'text')
+            if mode not in EVAL_MODES:
+                raise ValueError(f"{path} 第{line_number}行的检索方式无效: {mode}")
+            query_id = str(item.get('id') or item['question'])
+            if query_id in seen:
+                raise ValueError(f"{path} 第{line_number}行的问题重复: {query_id}")
+            seen.add(query_id)
+            queries.append({'id': query_id, 'question': item['question'], 'expected': expected, 'mode': mode})
+    return queries
+
+
+def matches(document: str, expected: str) -> bool:
+    """检索到的文档是否为期望的文档：完整相对路径、文件名或不带扩展名的文件名相同
+
+    在Windows上处理的结果中，文档路径以反斜杠分隔。
+    """
+    if document == expected:
+        return True
+    name = document.replace('\\', '/').rsplit('/', 1)[-1]
+    return name == expected or name.rsplit('.', 1)[0] == expected
+
+
+def rank_documents(results: List[Dict[str, Any]]) -> List[str]:
+    """把按得分排列的问答对合并为文档排名（每个文档取其最高得分的问答对）"""
+    ranked = []
+    seen = set()
+    for result in results:
+        if result['document'] not in seen:
+            seen.add(result['document'])
+            ranked.append(result['document'])
+    return ranked
+
+
+def evaluate_query(corpus: QACorpus, query: Dict[str, Any], ks: List[int], repeat: int) -> Dict[str, Any]:
+    """运行一个问题，返回文档排名、首个期望文档的名次、各k的召回率和检索延迟"""
+    search = corpus.lookup if query['mode'] == 'keyword' else corpus.search
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results = search(query['question'], MAX_RESULTS)
+        timings.append(time.perf_counter() - started)
+
+    documents = rank_documents(results)
+    # 期望文档 -> 名次（从1开始；未检索到为None）
+    ranks = {}
+    for expected in query['expected']:
+        ranks[expected] = next((i for i, document in enumerate(documents, 1) if matches(document, expected)), None)
+    found = [rank for rank in ranks.values() if rank]
+    first = min(found) if found else None
+    return {
+        'id': query['id'],
+        'question': query['question'],
+        'mode': query['mode'],
+        'expected': query['expected'],
+        'retrieved': documents[:max(ks)],
+        'rank': first,
+        'reciprocal_rank': 1.0 / first if first else 0.0,
+        'recall': {str(k): sum(1 for rank in found if rank <= k) / len(ranks) for k in ks},
+        'latency_ms': percentile(timings, 0.5) * 1000
+    }
+
+
+def summarize(rows: List[Dict[str, Any]], ks: List[int]) -> Dict[str, Any]:
+    """汇总：平均召回率、命中率（至少一个期望文档在前k个中）、MRR 和延迟百分位"""
+    count = len(rows) or 1
+    latencies = [row['latency_ms'] for row in rows]
+    return {
+        'queries': len(rows),
+        'recall': {str(k): sum(row['recall'][str(k)] for row in rows) / count for k in ks},
+        'hit_rate': {str(k): sum(1 for row in rows if row['rank'] and row['rank'] <= k) / count for k in ks},
+        'mrr': sum(row['reciprocal_rank'] for row in rows) / count,
+        'not_found': sum(1 for row in rows if not row['rank']),
+        'latency_ms': {
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies, default=0.0)
+        }
+    }
+
+
+def evaluate(output_dir: str, golden_path: str, ks: Optional[List[int]] = None, repeat: int = 3) -> Dict[str, Any]:
+    """在一个处理结果目录上运行评测问题集"""
+    ks = sorted(set(ks or DEFAULT_KS))
+    queries = load_golden(golden_path)
+    started = time.perf_counter()
+    corpus = QACorpus(load_corpus_documents(Path(output_dir)))
+    load_seconds = time.perf_counter() - started
+
+    documents = {record['document'] for record in corpus.records}
+    for query in queries:
+        unknown = [expected for expected in query['expected']
+                   if not any(matches(document, expected) for document in documents)]
+        if unknown:
+            logger.warning(f"问题 {query['id']} 的期望文档不在语料中: {', '.join(unknown)}")
+
+    rows = [evaluate_query(corpus, query, ks, max(1, repeat)) for query in queries]
+    with open(golden_path, 'rb') as f:
+        golden_digest = hashlib.sha256(f.read()).hexdigest()
+    return {
+        'version': RESULT_VERSION,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'output_dir': str(output_dir),
+        'golden': {'path': str(golden_path), 'sha256': golden_digest, 'queries': len(queries)},
+        'corpus': {'documents': corpus.documents, 'qa_pairs': len(corpus), 'load_seconds': load_seconds},
+        'ks': ks,
+        'summary': summarize(rows, ks),
+        'queries': rows
+    }
+
+
+def print_results(results: Dict[str, Any], show_misses: bool = True):
+    """打印汇总指标和未命中的问题"""
+    summary = results['summary']
+    corpus = results['corpus']
+    print(f"语料: {results['output_dir']}（{corpus['documents']} 个文档，{corpus['qa_pairs']} 个问答对）")
+    print(f"问题: {summary['queries']} 个，未检索到期望文档 {summary['not_found']} 个")
+    for k in results['ks']:
+        print(f"  recall@{k:<3} {summary['recall'][str(k)]:.3f}   命中率@{k:<3} {summary['hit_rate'][str(k)]:.3f}")
+    print(f"  MRR        {summary['mrr']:.3f}")
+    latency = summary['latency_ms']
+    print(f"  延迟 P50 {latency['p50']:.2f} ms  P90 {latency['p90']:.2f} ms  "
+          f"P99 {latency['p99']:.2f} ms  最大 {latency['max']:.2f} ms")
+
+    if show_misses:
+        top = results['ks'][-1]
+        misses = [row for row in results['queries'] if not row['rank'] or row['rank'] > top]
+        for row in misses:
+            got = ', '.join(row['retrieved'][:3]) or '（无结果）'
+            print(f"  未进入前{top}: {row['id']}  期望 {', '.join(row['expected'])}  实际 {got}")
+
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.0,
+                    latency_threshold: float = 1.0) -> Dict[str, Any]:
+    """对比两次评测：召回率、命中率或MRR下降超过 threshold（绝对值），
+    或P99延迟增长超过 latency_threshold（相对值）时标记为回退；并列出名次变化的问题"""
+    if baseline['golden']['sha256'] != current['golden']['sha256']:
+        logger.warning("两次评测使用的问题集不同，只对比共同的问题，汇总指标仅供参考")
+
+    metrics = []
+    for k in current['ks']:
+        if str(k) in baseline['summary']['recall']:
+            metrics.append((f"recall@{k}", baseline['summary']['recall'][str(k)], current['summary']['recall'][str(k)]))
+            metrics.append((f"hit_rate@{k}", baseline['summary']['hit_rate'][str(k)],
+                            current['summary']['hit_rate'][str(k)]))
+    metrics.append(('mrr', baseline['summary']['mrr'], current['summary']['mrr']))
+
+    rows = [{'metric': name, 'baseline': old, 'current': new, 'change': new - old,
+             'regressed': new - old < -threshold - 1e-9} for name, old, new in metrics]
+    for name in ('p50', 'p99'):
+        old = baseline['summary']['latency_ms'][name]
+        new = current['summary']['latency_ms'][name]
+        change = (new - old) / old if old else 0.0
+        rows.append({'metric': f"latency_{name}_ms", 'baseline': old, 'current': new, 'change': change,
+                     'regressed': name == 'p99' and change > latency_threshold})
+
+    # 名次变化的问题：未检索到视为无穷大
+    previous = {row['id']: row for row in baseline['queries']}
+    changes = []
+    for row in current['queries']:
+        old = previous.get(row['id'])
+        if old is None or old['rank'] == row['rank']:
+            continue
+        old_rank = old['rank'] or float('inf')
+        new_rank = row['rank'] or float('inf')
+        changes.append({'id': row['id'], 'baseline_rank': old['rank'], 'current_rank': row['rank'],
+                        'improved': new_rank < old_rank})
+    return {'metrics': rows, 'queries': changes}
+
+
+def print_comparison(comparison: Dict[str, Any]) -> bool:
+    """打印对比表，返回是否存在回退"""
+    for row in comparison['metrics']:
+        flag = '  <-- 回退' if row['regressed'] else ''
+        if row['metric'].startswith('latency'):
+            print(f"{row['metric']:18} {row['baseline']:8.2f} -> {row['current']:8.2f} ({row['change']:+.1%}){flag}")
+        else:
+            print(f"{row['metric']:18} {row['baseline']:8.3f} -> {row['current']:8.3f} ({row['change']:+.3f}){flag}")
+
+    def rank(value):
+        return value if value else '-'
+
+    for change in comparison['queries']:
+        label = '改善' if change['improved'] else '变差'
+        print(f"  {label}: {change['id']}  名次 {rank(change['baseline_rank'])} -> {rank(change['current_rank'])}")
+    regressions = [row for row in comparison['metrics'] if row['regressed']]
+    improved = sum(1 for change in comparison['queries'] if change['improved'])
+    print(f"\n{len(comparison['queries'])} 个问题名次变化（改善 {improved} 个，变差 "
+          f"{len(comparison['queries']) - improved} 个），{len(regressions)} 项指标回退")
+    return bool(regressions)
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+    if results.get('version') != RESULT_VERSION:
+        raise ValueError(f"评测结果文件版本不匹配: {path}")
+    return results
+
+
+def results_for(path: str, golden: str, ks: List[int], repeat: int) -> Dict[str, Any]:
+    """处理结果目录直接评测；否则作为已保存的评测结果JSON读取"""
+    if Path(path).is_dir():
+        return evaluate(path, golden, ks, repeat)
+    return load_results(path)
+
+
+def main():
+    """命令行入口"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="检索效果评测")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_eval_args(sub):
+        sub.add_argument('--golden', default=DEFAULT_GOLDEN, help=f"评测问题集（默认 {DEFAULT_GOLDEN}）")
+        sub.add_argument('-k', type=int, nargs='+', default=DEFAULT_KS, help="统计的k值（默认 1 3 5 10）")
+        sub.add_argument('--repeat', type=int, default=3, help="每个问题检索次数，延迟取中位数（默认3）")
+
+    run_parser = subparsers.add_parser('run', help="在处理结果上运行评测问题集")
+    run_parser.add_argument('--output', default="已处理知识库", help="处理结果目录")
+    add_eval_args(run_parser)
+    run_parser.add_argument('--save', help="保存评测结果JSON")
+    run_parser.add_argument('--baseline', help="与已保存的评测结果对比，存在回退时以非零状态退出")
+    run_parser.add_argument('--threshold', type=float, default=0.0,
+                            help="召回率、命中率、MRR下降超过该值（绝对值）即为回退（默认0）")
+    run_parser.add_argument('--latency-threshold', type=float, default=1.0,
+                            help="P99延迟增长超过该比例即为回退（默认1.0，即100%%）")
+
+    compare_parser = subparsers.add_parser('compare', help="对比两次处理的检索效果（处理结果目录或已保存的评测结果）")
+    compare_parser.add_argument('baseline', help="基线：处理结果目录或评测结果JSON")
+    compare_parser.add_argument('current', help="本次：处理结果目录或评测结果JSON")
+    add_eval_args(compare_parser)
+    compare_parser.add_argument('--threshold', type=float, default=0.0,
+                                help="召回率、命中率、MRR下降超过该值（绝对值）即为回退（默认0）")
+    compare_parser.add_argument('--latency-threshold', type=float, default=1.0,
+                                help="P99延迟增长超过该比例即为回退（默认1.0）")
+
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        baseline = results_for(args.baseline, args.golden, args.k, args.repeat)
+        current = results_for(args.current, args.golden, args.k, args.repeat)
+        print_results(baseline, show_misses=False)
+        print_results(current, show_misses=False)
+        print()
+        regressed = print_comparison(compare_results(current, baseline, args.threshold, args.latency_threshold))
+        sys.exit(1 if regressed else 0)
+
+    results = evaluate(args.output, args.golden, args.k, args.repeat)
+    print_results(results)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        logger.info(f"评测结果已保存: {args.save}")
+
+    if args.baseline:
+        print()
+        regressed = print_comparison(compare_results(results, load_results(args.baseline),
+                                                     args.threshold, args.latency_threshold))
+        sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+受监督的工作进程池
+每个文件在独立的工作进程中处理，主进程监督每次处理的墙钟时间和工作进程的
+常驻内存：超时、超出内存上限或进程崩溃（例如解析库段错误）时杀掉该进程并
+换一个新进程重试，重试仍失败的文件作为失败结果返回，其余文件不受影响
+"""
+
+import time
+import multiprocessing
+from multiprocessing import connection
+from collections import deque
+from typing import Any, Optional, Callable, Iterable, Iterator
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 检查内存和超时的最长间隔（秒）
+CHECK_INTERVAL = 0.5
+
+
+class WorkerFailure:
+    """工作进程被杀掉或崩溃导致的失败（普通异常由任务函数自行处理）"""
+
+    def __init__(self, reason: str, attempts: int, elapsed: float):
+        self.reason = reason
+        self.attempts = attempts
+        self.elapsed = elapsed
+
+    def __repr__(self) -> str:
+        return f"WorkerFailure({self.reason!r}, attempts={self.attempts})"
+
+
+def process_rss_mb(pid: int) -> Optional[float]:
+    """进程当前的常驻内存（MB）；无法读取 /proc 时返回None"""
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def _worker_main(conn, initializer: Optional[Callable], initargs: tuple, func: Callable):
+    """工作进程主循环：逐个接收 (序号, 任务) 并返回 (序号, 结果)"""
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        index, item = task
+        conn.send((index, func(item)))
+
+
+class _Worker:
+    """一个工作进程及其正在处理的任务"""
+
+    def __init__(self, context, initializer, initargs, func):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, initializer, initargs, func),
+                                       daemon=True)
+        self.process.start()
+        child_conn.close()
+        # 正在处理的 (序号, 任务, 第几次尝试) 和开始时间
+        self.task = None
+        self.started = 0.0
+
+    def assign(self, task: tuple):
+        self.task = task
+        self.started = time.monotonic()
+        try:
+            self.conn.send(task[:2])
+        except OSError:
+            # 进程刚好退出：任务保持分配状态，由监督循环按崩溃处理并重试
+            pass
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class SupervisedPool:
+    """固定数量的工作进程，每个进程一次只处理一个任务
+
+    接口与 ProcessPoolExecutor.map 相同，结果按输入顺序产出；被杀掉或崩溃的任务
+    重试 retries 次后产出 WorkerFailure。工作进程在首次使用时启动，
+    出现失败时只替换出问题的那个进程。
+    """
+
+    def __init__(self, max_workers: int, initializer: Optional[Callable] = None, initargs: tuple = (),
+                 timeout: Optional[float] = None, memory_limit_mb: Optional[int] = None, retries: int = 1):
+        self.max_workers = max(1, max_workers)
+        self.initializer = initializer
+        self.initargs = initargs
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.retries = retries
+        self.context = multiprocessing.get_context()
+        self.func = None
+        self.workers = []
+        if memory_limit_mb and process_rss_mb(multiprocessing.current_process().pid) is None:
+            logger.warning("无法读取进程内存（需要 /proc），内存上限不生效")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self.context, self.initializer, self.initargs, self.func)
+
+    def map(self, func: Callable, items: Iterable[Any], chunksize: int = 1) -> Iterator[Any]:
+        """并行执行 func(item)，按输入顺序产出结果或 WorkerFailure"""
+        items = list(items)
+        if func is not self.func:
+            # 任务函数随进程启动传入，换函数时重建工作进程
+            self.shutdown()
+            self.func = func
+        queue = deque((index, item, 1) for index, item in enumerate(items))
+        results = {}
+        next_index = 0
+
+        while next_index < len(items):
+            for worker in [worker for worker in self.workers
+                           if worker.task is None and not worker.process.is_alive()]:
+                # 空闲时退出的进程（例如上一批之后被外部杀掉）：直接换新进程，不计入重试次数
+                logger.warning(f"工作进程空闲时已退出（退出码 {worker.process.exitcode}），换新的工作进程")
+                worker.kill()
+                self.workers.remove(worker)
+            while queue and len(self.workers) < min(self.max_workers, len(items)):
+                self.workers.append(self._spawn())
+            for worker in self.workers:
+                if worker.task is None and queue:
+                    worker.assign(queue.popleft())
+
+            busy = [worker for worker in self.workers if worker.task is not None]
+            ready = connection.wait([worker.conn for worker in busy]
+                                    + [worker.process.sentinel for worker in busy], timeout=CHECK_INTERVAL)
+            now = time.monotonic()
+            for worker in busy:
+                index, item, attempt = worker.task
+                reason = None
+                if worker.conn in ready:
+                    try:
+                        _, results[index] = worker.conn.recv()
+                        worker.task = None
+                        continue
+                    except (EOFError, OSError):
+                        worker.process.join(timeout=1)
+                        reason = f"工作进程异常退出（退出码 {worker.process.exitcode}）"
+                elif worker.process.sentinel in ready:
+                    worker.process.join()
+                    reason = f"工作进程异常退出（退出码 {worker.process.exitcode}）"
+                elif self.timeout and now - worker.started > self.timeout:
+                    reason = f"处理超时（超过 {self.timeout:g} 秒）"
+                elif self.memory_limit_mb:
+                    rss = process_rss_mb(worker.process.pid)
+                    if rss is not None and rss > self.memory_limit_mb:
+                        reason = f"内存超出上限（{rss:.0f} MB > {self.memory_limit_mb} MB）"
+                if reason is None:
+                    continue
+
+                elapsed = now - worker.started
+                worker.kill()
+                self.workers.remove(worker)
+                if attempt <= self.retries:
+                    logger.warning(f"{reason}，换新的工作进程重试: {item}")
+                    queue.appendleft((index, item, attempt + 1))
+                else:
+                    results[index] = WorkerFailure(reason, attempt, elapsed)
+
+            while next_index in results:
+                yield results.pop(next_index)
+                next_index += 1
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        """关闭所有工作进程"""
+        for worker in self.workers:
+            if worker.task is not None:
+                worker.kill()
+            else:
+                worker.close()
+        self.workers = []
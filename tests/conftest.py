@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 模块位于仓库根目录（没有安装为包）
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""chunker.Chunker：分块大小上限、覆盖全文、相邻重叠和结构保持"""
+
+import random
+
+import pytest
+
+from chunker import Chunker, HEADING_LINE
+
+WORDS = ['系统', '小区', '批次', '收据', '打印', 'Batch', 'POST', 'SRMS', '用户', '权限', '设置', '数据']
+
+
+def random_document(rng: random.Random, paragraphs: int) -> str:
+    """标题、编号步骤和普通段落混合的正文（不含SQL，所有单元都可以切分）"""
+    lines = []
+    step = 0
+    for _ in range(paragraphs):
+        roll = rng.random()
+        sentence = '，'.join(' '.join(rng.choices(WORDS, k=rng.randint(2, 6))) for _ in range(rng.randint(1, 4)))
+        if roll < 0.15:
+            lines.append(f"# {rng.choice(WORDS)}{rng.choice(WORDS)}")
+            step = 0
+        elif roll < 0.5:
+            step += 1
+            lines.append(f"{step}. {sentence}。")
+        else:
+            lines.append('。'.join(sentence for _ in range(rng.randint(1, 5))) + '。')
+        if rng.random() < 0.3:
+            lines.append('')
+    return '\n'.join(lines)
+
+
+def check_chunks(chunker: Chunker, text: str, chunks):
+    for chunk in chunks:
+        assert chunk['text'] == text[chunk['start']:chunk['end']]
+        assert chunk['text'] == chunk['text'].strip()
+        assert chunk['size'] == chunker.measure(text, chunk['start'], chunk['end'])
+        assert chunk['size'] <= chunker.max_size
+    # 按顺序排列，且全部非空白字符都在某个分块中
+    for previous, current in zip(chunks, chunks[1:]):
+        assert previous['start'] < current['start'] and previous['end'] < current['end']
+    covered = set()
+    for chunk in chunks:
+        covered.update(range(chunk['start'], chunk['end']))
+    assert all(i in covered for i, char in enumerate(text) if not char.isspace())
+
+
+@pytest.mark.parametrize('unit', ['chars', 'tokens'])
+@pytest.mark.parametrize('max_size,overlap', [(60, 0), (120, 30), (300, 80)])
+def test_chunks_within_bounds_and_cover_text(unit, max_size, overlap):
+    rng = random.Random(f"{unit}-{max_size}-{overlap}")
+    chunker = Chunker(max_size, overlap, unit)
+    for _ in range(30):
+        text = random_document(rng, rng.randint(1, 40))
+        check_chunks(chunker, text, chunker.split(text))
+
+
+def test_overlap_repeats_tail_of_previous_chunk():
+    text = '\n'.join(f"{i}. 第{i}步在系统中打开批次并确认收据号码。" for i in range(1, 40))
+    chunker = Chunker(100, 40)
+    chunks = chunker.split(text)
+    assert len(chunks) > 2
+    for previous, current in zip(chunks, chunks[1:]):
+        # 下一块从上一块末尾的完整步骤开始，重叠部分不超过 overlap
+        assert current['start'] < previous['end']
+        assert chunker.measure(text, current['start'], previous['end']) <= chunker.overlap
+        assert HEADING_LINE.match(text, current['start']) is None
+
+
+def test_no_overlap_when_disabled():
+    text = '\n'.join(f"{i}. 第{i}步在系统中打开批次并确认收据号码。" for i in range(1, 40))
+    chunks = Chunker(100, 0).split(text)
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current['start'] > previous['end']
+
+
+def test_overlap_capped_at_half_of_max_size():
+    assert Chunker(100, 80).overlap == 50
+    with pytest.raises(ValueError):
+        Chunker(0)
+    with pytest.raises(ValueError):
+        Chunker(100, unit='words')
+
+
+def test_short_text_is_single_chunk():
+    text = '  \n# 标题\n内容一行。\n'
+    assert Chunker(100).split(text) == [{'text': '# 标题\n内容一行。', 'start': 3, 'end': 13, 'size': 10}]
+    assert Chunker(100).split(' \n\n ') == []
+
+
+def test_heading_stays_with_following_content():
+    text = '\n'.join(['这是第一段的内容，' * 5, '# 操作步骤', '1. ' + '打开系统并选择小区，' * 8, '2. 确认。'])
+    chunker = Chunker(80, 0)
+    chunks = chunker.split(text)
+    check_chunks(chunker, text, chunks)
+    heading_start = text.index('# 操作步骤')
+    # 标题不单独成块，也不留在上一块的末尾
+    for chunk in chunks:
+        assert chunk['text'] != '# 操作步骤'
+        assert not chunk['text'].endswith('# 操作步骤')
+    holder = next(chunk for chunk in chunks if chunk['start'] <= heading_start < chunk['end'])
+    assert holder['start'] == heading_start
+    assert holder['end'] > heading_start + len('# 操作步骤')
+
+
+def test_long_step_keeps_its_number():
+    text = '\n'.join(f"{i}. " + '在系统中打开批次，确认收据号码，' * 6 + '完成。' for i in range(1, 6))
+    chunker = Chunker(60, 0)
+    chunks = chunker.split(text)
+    check_chunks(chunker, text, chunks)
+    for i in range(1, 6):
+        number = text.index(f"{i}. ")
+        holder = next(chunk for chunk in chunks if chunk['start'] <= number < chunk['end'])
+        # 步骤编号与该步骤的内容在同一块
+        assert holder['end'] > number + len(f"{i}. ")
+
+
+def test_sql_statement_is_not_split():
+    sql = ("SELECT a.batchid, a.status\nFROM cmbtch a\nWHERE a.status = 'OPEN'\n"
+           "AND a.siteid IN (SELECT siteid FROM site WHERE region = 'HK')\nORDER BY a.batchid;")
+    text = '\n'.join(['先检查批次的状态。' * 3, sql, '确认后再删除。' * 3])
+    chunks = Chunker(60, 0).split(text)
+    sql_start = text.index(sql)
+    assert any(chunk['start'] <= sql_start and chunk['end'] >= sql_start + len(sql) for chunk in chunks)
+
+
+def test_options_include_version():
+    options = Chunker(500, 50, 'tokens').options()
+    assert options['max_size'] == 500 and options['overlap'] == 50 and options['unit'] == 'tokens'
+    assert 'version' in options
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""corpus_snapshot：快照写出后读回的内容与原始结构一致，包括按通用值保存的不规则记录"""
+
+import pytest
+
+from corpus_snapshot import CorpusSnapshot, SnapshotWriter, snapshot_path, SNAPSHOT_NAME
+from records import to_plain
+
+
+def plain_qa(question, **extra):
+    qa = {'question': question, 'answer': f"{question}的答案", 'keywords': ['批次', question],
+          'source': '文档来源：测试', 'type': 'text'}
+    qa.update(extra)
+    return qa
+
+
+DOCUMENTS = [
+    # 标准结构：按定长记录保存
+    ('SRMS Support/a.docx', 'sha-a:a_data.json:1:10', {
+        'title': '解锁批次', 'source_file': 'SRMS Support/a.docx', 'type': 'docx',
+        'sections': [
+            {'heading': '步骤', 'content': '1. 打开系统\n2. 解锁', 'images': [{'hash': 'h1', 'format': 'png'}],
+             'tables': [{'headers': ['字段', '值'], 'rows': [['status', 'OPEN'], ['', '😀']]}]},
+            # 多出的字段、非字符串的单元格：按通用值保存
+            {'heading': '附注', 'content': '', 'tables': [], 'images': [], 'page': 3},
+            {'heading': '表格', 'content': 'x', 'tables': [{'headers': ['n'], 'rows': [[1], [None]]}], 'images': []},
+        ],
+        'images': [{'hash': 'h1', 'format': 'png', 'width': 10}]
+    }, [
+        plain_qa('如何解锁'),
+        plain_qa('分块', chunk={'start': 0, 'end': 12, 'index': 1}),
+        plain_qa('截图', image_hash='h1', image_format='png'),
+        # 不规则的问答对：额外字段、字段顺序不同、非字符串的值
+        plain_qa('额外字段', page=2),
+        {'answer': '顺序不同', 'question': '顺序', 'keywords': [], 'source': 's', 'type': 'text'},
+        plain_qa('空答案', answer=None),
+        plain_qa('图片格式缺失', image_hash='h2', image_format=None),
+    ]),
+    # 文档级字段不是字符串、带额外字段：整个内容按通用值保存
+    ('b.pdf', 'sha-b:b_data.json:2:20', {
+        'title': None, 'source_file': 'b.pdf', 'type': 'pdf', 'sections': [], 'images': []
+    }, [plain_qa('第二个文档')]),
+    ('c.xlsx', 'sha-c:c_data.json:3:30', {
+        'title': 'c', 'source_file': 'c.xlsx', 'type': 'xlsx', 'sections': [], 'images': [], 'sheets': 2
+    }, []),
+    # 输出中没有原始内容
+    ('d.docx', 'sha-d:d_qa.json:4:40', None, [plain_qa('只有问答对'), plain_qa('如何解锁')]),
+]
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    writer = SnapshotWriter(snapshot_path(tmp_path))
+    for source, fingerprint, content, qa_pairs in DOCUMENTS:
+        writer.add_document(source, fingerprint, content, qa_pairs)
+    assert writer.close() == tmp_path / SNAPSHOT_NAME
+    snapshot = CorpusSnapshot.open(tmp_path)
+    yield snapshot
+    snapshot.close()
+
+
+def test_round_trip(snapshot):
+    assert len(snapshot) == len(DOCUMENTS)
+    for document, (source, fingerprint, content, qa_pairs) in zip(snapshot.documents(), DOCUMENTS):
+        assert document.source == source
+        assert document.fingerprint == fingerprint
+        assert to_plain(document.content) == content
+        decoded = [to_plain(qa) for qa in document.qa_pairs]
+        assert decoded == qa_pairs
+        # 字段顺序也与原始结构一致（写出的JSON相同）
+        assert [list(qa) for qa in decoded] == [list(qa) for qa in qa_pairs]
+
+
+def test_generic_fallbacks_keep_values(snapshot):
+    first = snapshot.document(0)
+    sections = first.content['sections']
+    assert sections[1]['page'] == 3
+    assert sections[2]['tables'][0]['rows'] == [[1], [None]]
+    assert first.qa_pairs[3]['page'] == 2
+    assert first.qa_pairs[5]['answer'] is None
+    assert snapshot.document(1).content['title'] is None
+    assert snapshot.document(2).content['sheets'] == 2
+    assert snapshot.document(3).content is None
+
+
+def test_skip_content_and_lookup_by_fingerprint(snapshot):
+    document = snapshot.document(0, content=False)
+    assert document.content is None
+    assert len(document.qa_pairs) == len(DOCUMENTS[0][3])
+
+    source, fingerprint, _, qa_pairs = DOCUMENTS[3]
+    assert snapshot.fingerprint(source) == fingerprint
+    assert [to_plain(qa) for qa in snapshot.qa_pairs(source, fingerprint)] == qa_pairs
+    # 输出文件变化（指纹不同）或快照中没有该文档时需要重新读取输出文件
+    assert snapshot.qa_pairs(source, fingerprint + 'x') is None
+    assert snapshot.qa_pairs(source, None) is None
+    assert snapshot.qa_pairs('missing.docx', fingerprint) is None
+
+
+def test_empty_snapshot(tmp_path):
+    SnapshotWriter(snapshot_path(tmp_path)).close()
+    snapshot = CorpusSnapshot.open(tmp_path)
+    assert len(snapshot) == 0
+    assert list(snapshot.documents()) == []
+    snapshot.close()
+
+
+def test_unreadable_snapshot_is_ignored(tmp_path):
+    assert CorpusSnapshot.open(tmp_path) is None
+    path = snapshot_path(tmp_path)
+    path.write_bytes(b'not a snapshot')
+    assert CorpusSnapshot.open(tmp_path) is None
+
+    writer = SnapshotWriter(path)
+    for document in DOCUMENTS:
+        writer.add_document(*document)
+    writer.close()
+    data = path.read_bytes()
+    path.write_bytes(data[:len(data) // 2])
+    assert CorpusSnapshot.open(tmp_path) is None
+
+
+def test_abort_leaves_no_files(tmp_path):
+    writer = SnapshotWriter(snapshot_path(tmp_path))
+    writer.add_document(*DOCUMENTS[0])
+    writer.abort()
+    assert list(tmp_path.iterdir()) == []
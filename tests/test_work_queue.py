@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""work_queue.WorkQueue：多个本地进程同时领取、租约过期后回收，以及迟到的续约和提交"""
+
+import os
+import time
+import multiprocessing
+
+from work_queue import WorkQueue, item_id, read_json
+
+KEYS = [f"SRMS Support/文档{i}.docx" for i in range(40)]
+
+
+def claim_all(queue_dir, state, worker, start, results):
+    """领取直到没有可领取的文件，租约不释放（模拟仍在处理）"""
+    queue = WorkQueue(queue_dir)
+    start.wait()
+    claimed = []
+    while True:
+        lease = queue.claim(worker, state)
+        if lease is None:
+            break
+        claimed.append((lease.item['key'], lease.attempts))
+    results.put((worker, claimed))
+
+
+def claim_and_crash(queue_dir, state):
+    """领取一个文件后直接退出，不释放租约"""
+    WorkQueue(queue_dir).claim('crashed', state)
+    os._exit(1)
+
+
+def run_processes(target, args_list):
+    processes = [multiprocessing.Process(target=target, args=args) for args in args_list]
+    for process in processes:
+        process.start()
+    return processes
+
+
+def collect(results, processes):
+    collected = dict(results.get(timeout=60) for _ in processes)
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+    return collected
+
+
+def test_concurrent_claims_are_exclusive(tmp_path):
+    queue = WorkQueue(tmp_path)
+    state = queue.start_run(KEYS, {}, lease_ttl=60)
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = run_processes(claim_all, [(str(tmp_path), state, f"w{i}", start, results) for i in range(4)])
+    start.set()
+    claimed = collect(results, processes)
+
+    keys = [key for items in claimed.values() for key, _ in items]
+    assert sorted(keys) == sorted(KEYS)
+    assert all(attempts == 1 for items in claimed.values() for _, attempts in items)
+    # 每个文件一个租约，租约属于领取到它的进程
+    for worker, items in claimed.items():
+        for key, _ in items:
+            assert queue.read_lease(item_id(key))['worker'] == worker
+    assert queue.claim('late', state) is None
+
+
+def test_expired_lease_is_reclaimed_once(tmp_path):
+    queue = WorkQueue(tmp_path)
+    state = queue.start_run(KEYS[:1], {}, lease_ttl=0.5)
+    crashed = multiprocessing.Process(target=claim_and_crash, args=(str(tmp_path), state))
+    crashed.start()
+    crashed.join(timeout=60)
+    assert queue.read_lease(item_id(KEYS[0]))['worker'] == 'crashed'
+    # 租约有效期间其他进程领取不到
+    assert queue.claim('early', state) is None
+
+    time.sleep(0.6)
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = run_processes(claim_all, [(str(tmp_path), state, f"w{i}", start, results) for i in range(4)])
+    start.set()
+    claimed = collect(results, processes)
+
+    # 同时回收同一个过期租约时只有一个进程成功，尝试次数加一
+    winners = {worker: items for worker, items in claimed.items() if items}
+    assert len(winners) == 1
+    (worker, items), = winners.items()
+    assert items == [(KEYS[0], 2)]
+    lease = queue.read_lease(item_id(KEYS[0]))
+    assert lease['worker'] == worker and lease['attempts'] == 2
+    assert not [name for name in os.listdir(queue.leases_dir) if name.startswith('.')]
+
+
+def test_late_renewal_and_completion_are_rejected(tmp_path):
+    queue = WorkQueue(tmp_path)
+    state = queue.start_run(KEYS[:1], {}, lease_ttl=0.3)
+    stale = queue.claim('slow', state)
+    assert queue.renew(stale, 'slow', 0.3)
+
+    time.sleep(0.4)
+    fresh = queue.claim('fast', state)
+    assert fresh is not None and fresh.attempts == 2
+    # 失去租约的进程既不能续约覆盖新租约，也不能提交结果
+    assert not queue.renew(stale, 'slow', 0.3)
+    assert queue.read_lease(fresh.item_id)['token'] == fresh.token
+    assert not queue.complete(stale, state, {'outputs': []}, None, 'slow')
+    assert not queue.done_path(fresh.item_id).exists()
+
+    assert queue.renew(fresh, 'fast', 0.3)
+    assert queue.complete(fresh, state, {'outputs': []}, None, 'fast')
+    report = read_json(queue.done_path(fresh.item_id))
+    assert report['worker'] == 'fast' and report['attempts'] == 2 and report['error'] is None
+    assert not queue.lease_path(fresh.item_id).exists()
+    assert queue.claim('another', state) is None
+
+
+def test_item_quarantined_after_max_attempts(tmp_path):
+    queue = WorkQueue(tmp_path)
+    state = queue.start_run(KEYS[:1], {}, lease_ttl=0.2, max_attempts=2)
+    for attempt in (1, 2):
+        lease = queue.claim(f"w{attempt}", state)
+        assert lease.attempts == attempt
+        time.sleep(0.3)
+
+    lease = queue.claim('w3', state)
+    assert lease.attempts == 3
+    report = read_json(queue.done_path(lease.item_id))
+    assert report['result']['quarantine']['attempts'] == 2
+    assert report['result']['profile']['error']
+    queue.release(lease)
+    assert queue.claim('w4', state) is None
+
+
+def test_new_run_invalidates_old_leases(tmp_path):
+    queue = WorkQueue(tmp_path)
+    old_state = queue.start_run(KEYS[:2], {}, lease_ttl=60)
+    old = queue.claim('w', old_state)
+    state = queue.start_run(KEYS[:2], {}, lease_ttl=60)
+    assert not queue.renew(old, 'w', 60)
+    assert queue.claim('w', old_state) is None
+    assert queue.claim('w', state) is not None
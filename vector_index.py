@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Q&A本地向量检索
+在本机为 document_processor.py 生成的问答对计算向量（特征哈希向量化，
+或本地的sentence-transformers模型），保存为内存映射的float32矩阵并做
+暴力top-k检索，用于离线检查语义检索的召回效果。向量按内容哈希缓存，
+语料更新时只为新增或变化的问答对计算向量
+"""
+
+import os
+import json
+import math
+import time
+import zlib
+import hashlib
+import argparse
+from collections import Counter
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("请安装numpy: pip install numpy")
+
+from qa_index import load_processed_outputs, qa_text, tokenize
+
+logger = logging.getLogger(__name__)
+
+# 索引格式版本，格式不兼容时递增
+VECTOR_INDEX_VERSION = 1
+
+# 每批计算向量的问答对数
+EMBED_BATCH_SIZE = 256
+# 检索时每次与查询向量相乘的行数，限制临时内存
+SEARCH_BLOCK_ROWS = 65536
+# 缓存中仍被使用的向量比例低于此值时压缩缓存
+MIN_CACHE_LIVE_RATIO = 0.5
+
+
+class HashingEmbedder:
+    """特征哈希向量化：检索词（与BM25索引相同的切分）经CRC32映射到固定维度
+
+    带符号哈希减小冲突的影响，词频取对数，向量做L2归一化，
+    因此内积即余弦相似度。不需要模型文件，结果完全确定。
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        # 检索词 -> (列, 符号)
+        self._buckets = {}
+
+    @property
+    def name(self) -> str:
+        return f"hashing-v1-{self.dim}"
+
+    def spec(self) -> Dict[str, Any]:
+        return {'type': 'hashing', 'dim': self.dim}
+
+    def _bucket(self, token: str) -> Tuple[int, float]:
+        bucket = self._buckets.get(token)
+        if bucket is None:
+            h = zlib.crc32(token.encode('utf-8'))
+            bucket = self._buckets[token] = (h % self.dim, 1.0 if h & 0x80000000 else -1.0)
+        return bucket
+
+    def embed(self, texts: List[str]) -> 'np.ndarray':
+        rows, cols, values = [], [], []
+        for i, text in enumerate(texts):
+            for token, tf in Counter(tokenize(text)).items():
+                col, sign = self._bucket(token)
+                rows.append(i)
+                cols.append(col)
+                values.append(sign * (1.0 + math.log(tf)))
+
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)),
+                  np.asarray(values, dtype=np.float32))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+class SentenceTransformerEmbedder:
+    """本地CPU上的sentence-transformers模型（模型名称或本地目录）"""
+
+    def __init__(self, model: str):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("请安装sentence-transformers: pip install sentence-transformers")
+        self.model_name = model
+        self.model = SentenceTransformer(model, device='cpu')
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    @property
+    def name(self) -> str:
+        return f"sentence-transformers-{self.model_name}"
+
+    def spec(self) -> Dict[str, Any]:
+        return {'type': 'sentence-transformers', 'model': self.model_name}
+
+    def embed(self, texts: List[str]) -> 'np.ndarray':
+        vectors = self.model.encode(texts, batch_size=64, normalize_embeddings=True, convert_to_numpy=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+def create_embedder(spec: Dict[str, Any]):
+    """按配置创建向量化器：{'type': 'hashing', 'dim': N} 或 {'type': 'sentence-transformers', 'model': 名称}"""
+    if spec['type'] == 'hashing':
+        return HashingEmbedder(spec.get('dim', 512))
+    if spec['type'] == 'sentence-transformers':
+        return SentenceTransformerEmbedder(spec['model'])
+    raise ValueError(f"不支持的向量化方式: {spec['type']}")
+
+
+def embedder_spec(model: str = 'hashing', dim: int = 512) -> Dict[str, Any]:
+    """命令行参数对应的向量化配置：hashing 为特征哈希，其他值为sentence-transformers模型"""
+    if model == 'hashing':
+        return {'type': 'hashing', 'dim': dim}
+    return {'type': 'sentence-transformers', 'model': model}
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """按内容哈希缓存向量
+
+    每个向量化器一个子目录：vectors.f32 为按行追加的float32向量，keys.txt 为
+    对应的内容哈希（每行一个）。先追加向量再追加哈希，中断时多出的半行向量被忽略。
+    """
+
+    def __init__(self, cache_dir: Path, name: str, dim: int):
+        self.dir = Path(cache_dir) / hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.vectors_path = self.dir / 'vectors.f32'
+        self.keys_path = self.dir / 'keys.txt'
+        self.rows = {}
+        if self.keys_path.exists():
+            with open(self.keys_path, 'r', encoding='ascii') as f:
+                keys = f.read().split()
+            stored = self.vectors_path.stat().st_size // (4 * dim) if self.vectors_path.exists() else 0
+            self.rows = {key: row for row, key in enumerate(keys[:stored])}
+        with open(self.dir / 'name.txt', 'w', encoding='utf-8') as f:
+            f.write(name)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def vectors(self) -> 'np.ndarray':
+        """缓存中的全部向量（内存映射，只读）"""
+        if not self.rows:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(len(self.rows), self.dim))
+
+    def add(self, keys: List[str], vectors: 'np.ndarray'):
+        # 先补齐中断时写了一半的向量文件
+        expected = len(self.rows) * 4 * self.dim
+        with open(self.vectors_path, 'ab') as f:
+            if f.tell() != expected:
+                f.truncate(expected)
+                f.seek(expected)
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self.keys_path, 'a', encoding='ascii') as f:
+            f.write(''.join(f"{key}\n" for key in keys))
+        for key in keys:
+            self.rows[key] = len(self.rows)
+
+    def compact(self, used: Iterable[str]):
+        """只保留仍被使用的向量"""
+        used = [key for key in dict.fromkeys(used) if key in self.rows]
+        if len(used) >= len(self.rows) * MIN_CACHE_LIVE_RATIO:
+            return
+        vectors = self.vectors()[[self.rows[key] for key in used]] if used else np.zeros((0, self.dim), np.float32)
+        tmp_vectors = self.vectors_path.with_name('.vectors.f32.tmp')
+        tmp_keys = self.keys_path.with_name('.keys.txt.tmp')
+        vectors.astype(np.float32).tofile(tmp_vectors)
+        with open(tmp_keys, 'w', encoding='ascii') as f:
+            f.write(''.join(f"{key}\n" for key in used))
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_keys, self.keys_path)
+        logger.info(f"向量缓存已压缩: {len(self.rows)} -> {len(used)}")
+        self.rows = {key: row for row, key in enumerate(used)}
+
+
+def index_files(generation: Optional[int]) -> Tuple[str, str, str]:
+    """一代索引的 (向量, 记录, 偏移) 文件名；generation 为None时为早期不分代的文件名"""
+    if generation is None:
+        return 'vectors.f32', 'records.jsonl', 'offsets.npy'
+    return f"vectors.{generation}.f32", f"records.{generation}.jsonl", f"offsets.{generation}.npy"
+
+
+class VectorIndex:
+    """内存映射的向量矩阵和对应的问答记录
+
+    vectors.<代>.f32 为 num_rows × dim 的float32矩阵（行已归一化），records.<代>.jsonl
+    为每行对应的问答记录，按 offsets.<代>.npy 中的偏移量随机读取。每次重建写出新的一代
+    文件，最后替换 meta.json 指向它；打开时一次性打开该代的全部文件并保持句柄，
+    之后的重建不会影响已打开的索引。
+    """
+
+    def __init__(self, index_dir: str):
+        self.index_dir = Path(index_dir)
+        self.meta = None
+        self.vectors = None
+        self.offsets = None
+        self.records = None
+        self.records_size = 0
+        self.embedder = None
+
+    @classmethod
+    def open(cls, index_dir: str) -> 'VectorIndex':
+        index = cls(index_dir)
+        try:
+            index._load()
+        except FileNotFoundError:
+            # 读取 meta.json 之后旧的一代刚好被重建清理：按新的 meta.json 再打开一次
+            index.close()
+            index._load()
+        return index
+
+    def _load(self):
+        with open(self.index_dir / 'meta.json', 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != VECTOR_INDEX_VERSION:
+            raise ValueError(f"向量索引版本不匹配，请重新建立: {self.index_dir}")
+        vectors_name, records_name, offsets_name = index_files(self.meta.get('generation'))
+        self.records = open(self.index_dir / records_name, 'rb')
+        self.records_size = os.fstat(self.records.fileno()).st_size
+        self.offsets = np.load(self.index_dir / offsets_name)
+        shape = (self.meta['num_rows'], self.meta['dim'])
+        if shape[0]:
+            self.vectors = np.memmap(self.index_dir / vectors_name, dtype=np.float32, mode='r', shape=shape)
+        else:
+            self.vectors = np.zeros(shape, dtype=np.float32)
+
+    def close(self):
+        if self.records is not None:
+            self.records.close()
+            self.records = None
+
+    @property
+    def num_rows(self) -> int:
+        return self.meta['num_rows'] if self.meta else 0
+
+    def read_row(self, row: int) -> Dict[str, Any]:
+        start = int(self.offsets[row])
+        end = int(self.offsets[row + 1]) if row + 1 < len(self.offsets) else self.records_size
+        # pread 不改变文件位置，多个线程可以同时读取
+        return json.loads(os.pread(self.records.fileno(), end - start, start))
+
+    def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """返回与查询向量内积最大的k个问答对（附带document和score字段）"""
+        if not self.num_rows:
+            return []
+        if self.embedder is None:
+            self.embedder = create_embedder(self.meta['embedder'])
+        query_vector = self.embedder.embed([query])[0]
+        return self.search_vector(query_vector, k)
+
+    def search_vector(self, query_vector: 'np.ndarray', k: int = 5) -> List[Dict[str, Any]]:
+        """暴力检索：分块计算内积，每块只保留前k个候选"""
+        k = min(k, self.num_rows)
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        for start in range(0, self.num_rows, SEARCH_BLOCK_ROWS):
+            scores = self.vectors[start:start + SEARCH_BLOCK_ROWS] @ query_vector
+            if len(scores) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(len(scores))
+            best_rows = np.concatenate([best_rows, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+        # 同分时按行号排列，结果稳定
+        order = np.lexsort((best_rows, -best_scores))[:k]
+
+        results = []
+        for i in order:
+            record = self.read_row(int(best_rows[i]))
+            record['score'] = float(best_scores[i])
+            results.append(record)
+        return results
+
+
+def read_generation(index_dir: Path) -> Optional[int]:
+    """当前 meta.json 指向的代；索引不存在或为早期不分代的格式时返回None"""
+    try:
+        with open(index_dir / 'meta.json', 'r', encoding='utf-8') as f:
+            return json.load(f).get('generation')
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def build_vector_index(output_dir: str, index_dir: str, spec: Optional[Dict[str, Any]] = None,
+                       documents: Optional[Iterable[Tuple[str, List[Dict[str, Any]]]]] = None,
+                       embedder=None) -> Dict[str, Any]:
+    """从处理结果重建向量索引，返回统计信息
+
+    缓存中已有的向量直接复用，只为新增或变化的问答对计算向量；
+    指定 documents 时改用给定的 (文档标识, 问答对列表)。
+    """
+    if embedder is None:
+        embedder = create_embedder(spec or embedder_spec())
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    cache = EmbeddingCache(index_dir / 'cache', embedder.name, embedder.dim)
+    if documents is None:
+        documents = load_processed_outputs(output_dir)
+
+    started = time.perf_counter()
+    tmp_records = index_dir / '.records.jsonl.tmp'
+    keys = []
+    offsets = []
+    missing = {}
+    with open(tmp_records, 'wb') as f:
+        for source, qa_pairs in documents:
+            for qa in qa_pairs:
+                text = qa_text(qa)
+                key = content_hash(text)
+                keys.append(key)
+                if key not in cache.rows:
+                    missing[key] = text
+                offsets.append(f.tell())
+                f.write(json.dumps(dict(qa, document=source), ensure_ascii=False).encode('utf-8') + b'\n')
+
+    missing_keys = list(missing)
+    for start in range(0, len(missing_keys), EMBED_BATCH_SIZE):
+        batch = missing_keys[start:start + EMBED_BATCH_SIZE]
+        cache.add(batch, embedder.embed([missing[key] for key in batch]))
+    embed_seconds = time.perf_counter() - started
+
+    # 按行号从缓存中取向量，写入新的矩阵文件
+    tmp_vectors = index_dir / '.vectors.f32.tmp'
+    if keys:
+        cached = cache.vectors()
+        matrix = np.memmap(tmp_vectors, dtype=np.float32, mode='w+', shape=(len(keys), embedder.dim))
+        rows = np.asarray([cache.rows[key] for key in keys], dtype=np.int64)
+        for start in range(0, len(rows), SEARCH_BLOCK_ROWS):
+            matrix[start:start + SEARCH_BLOCK_ROWS] = cached[rows[start:start + SEARCH_BLOCK_ROWS]]
+        matrix.flush()
+        del matrix
+    else:
+        open(tmp_vectors, 'wb').close()
+
+    tmp_offsets = index_dir / '.offsets.tmp.npy'
+    np.save(tmp_offsets, np.asarray(offsets, dtype=np.int64))
+    # 新的一代写到新的文件名，已打开的读者仍在读取旧的一代
+    previous = read_generation(index_dir)
+    generation = (previous or 0) + 1
+    for tmp_path, name in zip((tmp_vectors, tmp_records, tmp_offsets), index_files(generation)):
+        os.replace(tmp_path, index_dir / name)
+    stats = {
+        'version': VECTOR_INDEX_VERSION,
+        'generation': generation,
+        'embedder': embedder.spec(),
+        'dim': embedder.dim,
+        'num_rows': len(keys),
+        'embedded': len(missing_keys),
+        'cached': len(keys) - len(missing_keys),
+        'embed_seconds': embed_seconds,
+        'built': time.time()
+    }
+    # 新的一代完整写出后才替换 meta.json：之后打开的读者看到新的一代，之前打开的不受影响
+    tmp_meta = index_dir / '.meta.json.tmp'
+    with open(tmp_meta, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_meta, index_dir / 'meta.json')
+    # 删除更早的各代（已打开的句柄和内存映射在删除后仍然有效）
+    current = set(index_files(generation))
+    for path in index_dir.iterdir():
+        if path.is_file() and path.name.startswith(('vectors.', 'records.', 'offsets.')) and path.name not in current:
+            path.unlink()
+
+    cache.compact(keys)
+    return stats
+
+
+def main():
+    """命令行入口"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Q&A本地向量检索")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="从处理结果建立向量索引（复用已缓存的向量）")
+    build_parser.add_argument('--output', default="已处理知识库", help="处理结果目录")
+    build_parser.add_argument('--index', help="向量索引目录（默认为处理结果目录下的 vector_index）")
+    build_parser.add_argument('--model', default='hashing',
+                              help="向量化方式：hashing 为特征哈希（默认），其他值为sentence-transformers模型名称或本地目录")
+    build_parser.add_argument('--dim', type=int, default=512, help="特征哈希的向量维度（默认512）")
+
+    query_parser = subparsers.add_parser('query', help="查询向量索引")
+    query_parser.add_argument('query', help="查询文本")
+    query_parser.add_argument('-k', type=int, default=5, help="返回结果数")
+    query_parser.add_argument('--index', default=os.path.join("已处理知识库", "vector_index"), help="向量索引目录")
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        index_dir = args.index or os.path.join(args.output, 'vector_index')
+        started = time.perf_counter()
+        stats = build_vector_index(args.output, index_dir, embedder_spec(args.model, args.dim))
+        logger.info(f"向量索引建立完成: {stats['num_rows']} 个问答对，新计算 {stats['embedded']} 个，"
+                    f"复用缓存 {stats['cached']} 个，耗时 {time.perf_counter() - started:.2f} s")
+        return
+
+    index = VectorIndex.open(args.index)
+    started = time.perf_counter()
+    results = index.search(args.query, args.k)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    for rank, result in enumerate(results, 1):
+        print(f"{rank}. [{result['score']:.3f}] {result['question']}  ({result['document']})")
+    print(f"\n共 {len(results)} 条结果，耗时 {elapsed_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监视模式
+常驻运行并轮询输入目录：新增、修改或删除的文档在写入完成（大小和修改时间
+在去抖时间内不再变化）后进入有界队列，由处理线程按批增量处理；
+队列深度和处理延迟实时写入输出目录的 watch_status.json
+"""
+
+import os
+import json
+import time
+import signal
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import List, Dict, Any, Tuple, TYPE_CHECKING
+import logging
+
+from instrumentation import RunReport, percentile
+
+if TYPE_CHECKING:
+    from document_processor import DocumentProcessor
+
+logger = logging.getLogger(__name__)
+
+STATUS_NAME = 'watch_status.json'
+# 延迟统计只保留最近的若干次处理
+LATENCY_WINDOW = 1000
+
+
+def is_temporary(name: str) -> bool:
+    """Office的锁文件（~$开头）、隐藏文件和下载/复制中的临时文件"""
+    return name.startswith(('~$', '.')) or name.endswith(('.tmp', '.part', '.crdownload'))
+
+
+class ChangeTracker:
+    """比较相邻两次扫描，找出已经写入完成的变化
+
+    文件状态每变化一次就重新开始计时，debounce 秒内不再变化才视为写入完成，
+    因此仍在复制或保存中的文件不会被处理。删除同样需要去抖：
+    部分编辑器保存时会先删除再重命名。
+    """
+
+    def __init__(self, snapshot: Dict[str, Tuple[int, int]], debounce: float):
+        self.debounce = debounce
+        # 上次扫描看到的状态
+        self.observed = dict(snapshot)
+        # 已交给处理（或启动时已处理）的状态
+        self.settled = dict(snapshot)
+        # 文档 -> (最近一次变化的时间, 首次发现变化的时间)
+        self.changing = {}
+
+    def update(self, snapshot: Dict[str, Tuple[int, int]], now: float):
+        """记录一次扫描结果"""
+        for key in set(snapshot) | set(self.observed):
+            if snapshot.get(key) != self.observed.get(key):
+                first_seen = self.changing.get(key, (now, now))[1]
+                self.changing[key] = (now, first_seen)
+        self.observed = dict(snapshot)
+
+    def stable(self, now: float) -> List[Tuple[str, float]]:
+        """已经稳定且与上次处理时不同的文档，按首次发现的时间排序"""
+        ready = []
+        for key, (changed_at, first_seen) in list(self.changing.items()):
+            if now - changed_at < self.debounce:
+                continue
+            if self.observed.get(key) == self.settled.get(key):
+                # 改动后又恢复原状（例如保存了未修改的文件）
+                del self.changing[key]
+                continue
+            ready.append((key, first_seen))
+        ready.sort(key=lambda item: item[1])
+        return ready
+
+    def accept(self, key: str):
+        """文档已进入处理队列"""
+        del self.changing[key]
+        state = self.observed.get(key)
+        if state is None:
+            self.settled.pop(key, None)
+        else:
+            self.settled[key] = state
+
+
+class DirectoryWatcher:
+    """轮询输入目录，把稳定的变化放入有界队列，由调用线程按批处理
+
+    轮询在后台线程中进行，处理批次期间也会继续发现变化；队列满时暂不接收
+    新的变化（它们留在 ChangeTracker 中，下次轮询再尝试入队），
+    内存占用与输入目录中变化的文件数无关。
+    """
+
+    def __init__(self, processor: 'DocumentProcessor', poll_interval: float = 2.0,
+                 debounce: float = 3.0, queue_size: int = 100):
+        self.processor = processor
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.queue_size = max(1, queue_size)
+        self.status_path = processor.output_dir / STATUS_NAME
+
+        # 文档 -> 首次发现变化的时间（同一文档在队列中只出现一次）
+        self.queue = OrderedDict()
+        self.condition = threading.Condition()
+        # 轮询线程和处理线程都会写状态文件
+        self.status_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.tracker = None
+
+        self.in_flight = 0
+        self.batches = 0
+        self.processed = 0
+        self.failed = 0
+        self.removed = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.last_batch = None
+        self.started = time.time()
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        """输入目录中所有支持格式的文档及其 (大小, 修改时间ns)"""
+        snapshot = {}
+        input_dir = self.processor.input_dir
+        for root, dirs, names in os.walk(input_dir):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            for name in names:
+                if is_temporary(name) or Path(name).suffix.lower() not in self.processor.supported_formats:
+                    continue
+                file_path = Path(root) / name
+                try:
+                    stat = file_path.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot[self.processor.document_key(file_path)] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def run(self):
+        """启动时先补处理离线期间的变化，然后持续监视直到收到停止信号"""
+        processor = self.processor
+        self.tracker = ChangeTracker(self.scan(), self.debounce)
+        if processor.workers > 1:
+            processor.worker_pool = processor.create_worker_pool()
+
+        previous_handler = signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        poller = threading.Thread(target=self._poll_loop, name='watch-poller', daemon=True)
+        try:
+            processor.process_all_documents()
+            logger.info(f"开始监视目录: {processor.input_dir}（轮询间隔 {self.poll_interval}s，"
+                        f"去抖 {self.debounce}s，队列容量 {self.queue_size}）")
+            poller.start()
+            while not self.stop_event.is_set():
+                batch = self._take_batch()
+                if not batch:
+                    continue
+                try:
+                    self.process_batch(batch)
+                except Exception as e:
+                    logger.error(f"处理监视批次时出错: {str(e)}")
+                    self.requeue(batch)
+                    # 等一个轮询间隔再重试，避免持续出错时空转
+                    self.stop_event.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+            if poller.is_alive():
+                poller.join()
+            signal.signal(signal.SIGTERM, previous_handler)
+            if processor.worker_pool is not None:
+                processor.worker_pool.shutdown(cancel_futures=True)
+                processor.worker_pool = None
+            self.write_status()
+            logger.info(f"监视已停止，共处理 {self.processed} 个文件，失败 {self.failed} 个，"
+                        f"清理已删除 {self.removed} 个")
+
+    def stop(self):
+        with self.condition:
+            self.stop_event.set()
+            self.condition.notify_all()
+
+    def _poll_loop(self):
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"扫描输入目录时出错: {str(e)}")
+
+    def poll(self):
+        """扫描一次输入目录，把稳定的变化放入队列"""
+        now = time.time()
+        self.tracker.update(self.scan(), now)
+        with self.condition:
+            for key, first_seen in self.tracker.stable(now):
+                if key not in self.queue and len(self.queue) >= self.queue_size:
+                    break
+                self.queue.setdefault(key, first_seen)
+                self.tracker.accept(key)
+            if self.queue:
+                self.condition.notify()
+        self.write_status()
+
+    def _take_batch(self) -> List[Tuple[str, float]]:
+        """等待并取出队列中的全部文档"""
+        with self.condition:
+            while not self.queue and not self.stop_event.is_set():
+                self.condition.wait(timeout=1.0)
+            batch = list(self.queue.items())
+            self.queue.clear()
+            self.in_flight = len(batch)
+        return batch
+
+    def process_batch(self, batch: List[Tuple[str, float]]):
+        """增量处理一批变化的文档：变化的重新处理，删除的清理输出"""
+        processor = self.processor
+        # 每批单独出一份运行报告
+        processor.report = RunReport(top_n=processor.report.top_n)
+        processed_before = processor.processed_count
+        removed_before = processor.removed_count
+
+        with processor.report.run.stage('plan'):
+            manifest = processor.load_manifest()
+            pending = []
+            for key, _ in sorted(batch):
+                file_path = processor.input_dir / key
+                try:
+                    fingerprint = processor.check_changed(file_path, manifest)
+                except FileNotFoundError:
+                    processor.remove_document(manifest, key)
+                    continue
+                if fingerprint is not None:
+                    pending.append((file_path, fingerprint))
+        processor.process_pending(manifest, pending)
+
+        finished = time.time()
+        latencies = [finished - first_seen for _, first_seen in batch]
+        processed = processor.processed_count - processed_before
+        removed = processor.removed_count - removed_before
+        with self.condition:
+            self.batches += 1
+            self.processed += processed
+            self.failed += len(pending) - processed
+            self.removed += removed
+            self.latencies.extend(latencies)
+            self.in_flight = 0
+            self.last_batch = {
+                'finished': finished,
+                'documents': len(batch),
+                'processed': processed,
+                'failed': len(pending) - processed,
+                'removed': removed,
+                'max_latency': max(latencies)
+            }
+        logger.info(f"监视批次: {len(batch)} 个文档（处理 {processed} 个，清理 {removed} 个），"
+                    f"最大延迟 {max(latencies):.1f}s，队列剩余 {len(self.queue)} 个")
+        self.write_status()
+
+    def requeue(self, batch: List[Tuple[str, float]]):
+        """整批处理出错：计为失败，并把文档放回队列头部等待重试（保留首次发现的时间）"""
+        self.processor.close()
+        with self.condition:
+            self.batches += 1
+            self.failed += len(batch)
+            self.in_flight = 0
+            for key, first_seen in reversed(batch):
+                self.queue.setdefault(key, first_seen)
+                self.queue.move_to_end(key, last=False)
+            self.last_batch = {
+                'finished': time.time(),
+                'documents': len(batch),
+                'processed': 0,
+                'failed': len(batch),
+                'removed': 0,
+                'error': True
+            }
+        self.write_status()
+
+    def status(self) -> Dict[str, Any]:
+        """当前队列深度、处理计数和延迟统计（延迟从发现变化算起，包含去抖时间）"""
+        with self.condition:
+            latencies = list(self.latencies)
+            return {
+                'input_dir': str(self.processor.input_dir),
+                'started': self.started,
+                'updated': time.time(),
+                'running': not self.stop_event.is_set(),
+                'queue_depth': len(self.queue),
+                'queue_capacity': self.queue_size,
+                'in_flight': self.in_flight,
+                'changing': len(self.tracker.changing) if self.tracker else 0,
+                'batches': self.batches,
+                'processed': self.processed,
+                'failed': self.failed,
+                'removed': self.removed,
+                'latency': {
+                    'p50': percentile(latencies, 0.5),
+                    'p99': percentile(latencies, 0.99),
+                    'max': max(latencies, default=0.0)
+                },
+                'last_batch': self.last_batch
+            }
+
+    def write_status(self):
+        """原子地写出状态文件，供监控脚本读取"""
+        status = self.status()
+        tmp_path = self.status_path.with_name(f".{self.status_path.name}.{os.getpid()}.tmp")
+        with self.status_lock:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(status, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.status_path)
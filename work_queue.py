@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多机分布式处理：共享目录中的工作队列
+协调进程把待处理的文件写入共享文件系统上的队列目录，任意多个（可以在不同主机上的）
+工作进程通过带过期时间的租约文件领取文件，处理后原子地写出结果并提交完成报告；
+工作进程崩溃或失联后租约过期，由其他工作进程自动接手，超过最大尝试次数的文件被隔离
+
+队列目录结构：
+    queue.json        本次运行的状态和处理参数（工作进程据此重建相同配置的处理器）
+    items/<id>.json   待处理的文件（相对输入目录的路径）
+    leases/<id>.lease 租约：领取者、过期时间和尝试次数，以 O_CREAT|O_EXCL 独占创建
+    leases/<id>.attempts  该文件已被领取的次数
+    done/<id>.json    完成报告：输出文件名、引用的图片、计时和错误信息
+    workers/<id>.json 工作进程的心跳状态
+
+租约的过期时间由写入方的时钟决定，各主机的时钟偏差需远小于租约时长。
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import signal
+import random
+import socket
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple, TYPE_CHECKING
+import logging
+
+from instrumentation import FileProfile
+
+if TYPE_CHECKING:
+    from document_processor import DocumentProcessor
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DIR_NAME = 'work_queue'
+STATE_NAME = 'queue.json'
+QUEUE_VERSION = 1
+# 默认的租约时长（秒）：工作进程每 1/4 租约时长续约一次
+LEASE_TTL = 60.0
+# 同一个文件最多被领取的次数，超过后作为失败结果隔离
+MAX_ATTEMPTS = 3
+# 协调进程输出进度的间隔（秒）
+PROGRESS_INTERVAL = 10.0
+
+
+def item_id(key: str) -> str:
+    """文件在队列中的编号：相对路径的哈希，可以安全地用作文件名"""
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def write_json_atomic(path: Path, data: Any):
+    """先写临时文件再改名；临时文件名包含主机名，多台主机同时写同一个目录也不会冲突"""
+    tmp_path = path.with_name(f".{path.name}.{socket.gethostname()}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def read_json(path: Path) -> Optional[Any]:
+    """读取JSON文件；不存在或内容不完整时返回None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class Lease:
+    """一次成功领取的租约"""
+
+    def __init__(self, item_id: str, item: Dict[str, Any], token: str, attempts: int):
+        self.item_id = item_id
+        self.item = item
+        self.token = token
+        self.attempts = attempts
+
+    def __repr__(self) -> str:
+        return f"Lease({self.item['key']!r}, attempts={self.attempts})"
+
+
+class WorkQueue:
+    """共享目录中的工作队列；协调进程和工作进程使用同一个类访问"""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.state_path = self.root / STATE_NAME
+        self.items_dir = self.root / 'items'
+        self.leases_dir = self.root / 'leases'
+        self.done_dir = self.root / 'done'
+        self.workers_dir = self.root / 'workers'
+        for directory in (self.items_dir, self.leases_dir, self.done_dir, self.workers_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def lease_path(self, item_id: str) -> Path:
+        return self.leases_dir / f"{item_id}.lease"
+
+    def attempts_path(self, item_id: str) -> Path:
+        return self.leases_dir / f"{item_id}.attempts"
+
+    def done_path(self, item_id: str) -> Path:
+        return self.done_dir / f"{item_id}.json"
+
+    def read_state(self) -> Optional[Dict[str, Any]]:
+        state = read_json(self.state_path)
+        if state is None or state.get('version') != QUEUE_VERSION:
+            return None
+        return state
+
+    # ---- 协调进程 ----
+
+    def start_run(self, keys: List[str], options: Dict[str, Any], lease_ttl: float = LEASE_TTL,
+                  max_attempts: int = MAX_ATTEMPTS) -> Dict[str, Any]:
+        """开始新的一次运行：清空上一次运行的队列，写入状态和待处理的文件
+
+        上一次运行中仍在处理的工作进程会发现租约已失效，其结果被丢弃。
+        """
+        for directory in (self.items_dir, self.leases_dir, self.done_dir):
+            for path in directory.iterdir():
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+        state = {
+            'version': QUEUE_VERSION,
+            'run_id': uuid.uuid4().hex,
+            'status': 'running',
+            'created': time.time(),
+            'total': len(keys),
+            'lease_ttl': lease_ttl,
+            'max_attempts': max_attempts,
+            'options': options
+        }
+        # 先写状态再写文件：工作进程领取到的文件一定属于已经可读的运行
+        write_json_atomic(self.state_path, state)
+        for key in keys:
+            write_json_atomic(self.items_dir / f"{item_id(key)}.json", {'run_id': state['run_id'], 'key': key})
+        return state
+
+    def finish_run(self, state: Dict[str, Any]):
+        """标记运行结束；空闲的工作进程可据此退出（见 --exit-when-done）"""
+        write_json_atomic(self.state_path, dict(state, status='finished', finished=time.time()))
+
+    def wait(self, state: Dict[str, Any], keys: List[str], poll_interval: float = 1.0) -> Dict[str, Dict[str, Any]]:
+        """等待所有文件的完成报告，返回 {相对路径: 报告}
+
+        等待期间同时回收超过最大尝试次数的过期租约，避免反复崩溃的文件一直无人完成。
+        """
+        remaining = {item_id(key): key for key in keys}
+        reports = {}
+        last_progress = time.monotonic()
+        while remaining:
+            for name in os.listdir(self.done_dir):
+                if not name.endswith('.json') or name[:-5] not in remaining:
+                    continue
+                report = read_json(self.done_dir / name)
+                if report is None or report.get('run_id') != state['run_id']:
+                    continue
+                reports[remaining.pop(name[:-5])] = report
+            if not remaining:
+                break
+            self.reap(state, remaining)
+            if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                leased = sum(1 for name in remaining if self.lease_path(name).exists())
+                workers = self.active_workers(state)
+                logger.info(f"已完成 {len(reports)}/{len(keys)}，处理中 {leased}，"
+                            f"活跃的工作进程 {len(workers)} 个" + ("" if workers else "（等待工作进程领取）"))
+            time.sleep(poll_interval)
+        return reports
+
+    def reap(self, state: Dict[str, Any], remaining: Dict[str, str]):
+        """把已经用完尝试次数的过期租约转为失败报告"""
+        for name in os.listdir(self.leases_dir):
+            if not name.endswith('.lease') or name[:-6] not in remaining:
+                continue
+            lease = self.read_lease(name[:-6])
+            if lease is None or lease['expires'] > time.time() or lease['attempts'] < state['max_attempts']:
+                continue
+            claimed = self.claim_item(name[:-6], f"coordinator-{socket.gethostname()}", state)
+            # 领取到时 claim_item 已写出失败报告；否则租约已被他人续约或回收
+            if claimed is not None:
+                self.release(claimed)
+
+    def active_workers(self, state: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """最近一个租约时长内有心跳的工作进程"""
+        workers = []
+        for path in self.workers_dir.glob('*.json'):
+            status = read_json(path)
+            if status and time.time() - status.get('seen', 0) < state['lease_ttl']:
+                workers.append(status)
+        return workers
+
+    # ---- 工作进程 ----
+
+    def claim(self, worker: str, state: Dict[str, Any]) -> Optional[Lease]:
+        """领取一个尚未完成、没有有效租约的文件；没有可领取的文件时返回None
+
+        随机顺序遍历，多个工作进程同时领取时很少争抢同一个文件。
+        """
+        names = [name[:-5] for name in os.listdir(self.items_dir) if name.endswith('.json')]
+        random.shuffle(names)
+        for name in names:
+            if self.done_path(name).exists():
+                continue
+            lease = self.claim_item(name, worker, state)
+            if lease is not None:
+                return lease
+        return None
+
+    def claim_item(self, name: str, worker: str, state: Dict[str, Any]) -> Optional[Lease]:
+        """尝试领取一个文件：没有租约时独占创建；租约已过期时先原子地改名移走再创建
+
+        两个进程同时回收同一个过期租约时只有一个能改名成功。尝试次数另外记录在
+        leases/<id>.attempts 中：租约被改名移走的间隙里其他进程看不到租约而直接新建时，
+        尝试次数也不会从1重新开始。
+        超过最大尝试次数时不再处理，直接写出失败报告（返回的租约只用于释放）。
+        """
+        item = read_json(self.items_dir / f"{name}.json")
+        if item is None or item['run_id'] != state['run_id']:
+            return None
+        path = self.lease_path(name)
+        attempts = (read_json(self.attempts_path(name)) or 0) + 1
+        reason = None if attempts == 1 else "上一次领取的租约失效"
+        previous = self.read_lease(name)
+        if previous is not None:
+            if previous['expires'] > time.time():
+                return None
+            stale = path.with_name(f".{path.name}.{uuid.uuid4().hex}.expired")
+            try:
+                os.rename(path, stale)
+            except FileNotFoundError:
+                return None
+            # 读取与改名之间租约可能刚被续约：以改名后的内容为准，仍有效时放回原处
+            # （os.link 不覆盖已存在的文件，放回时不会破坏别人新建的租约）
+            previous = read_json(stale) or previous
+            if previous['expires'] > time.time():
+                try:
+                    os.link(stale, path)
+                except FileExistsError:
+                    pass
+                stale.unlink()
+                return None
+            stale.unlink()
+            attempts = max(attempts, previous.get('attempts', 1) + 1)
+            reason = f"工作进程 {previous.get('worker')} 退出或失去响应（租约过期）"
+            logger.warning(f"回收过期的租约: {item['key']}（{reason}）")
+
+        token = uuid.uuid4().hex
+        lease_data = self.lease_data(worker, token, attempts, state['lease_ttl'])
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(lease_data, f, ensure_ascii=False)
+        write_json_atomic(self.attempts_path(name), attempts)
+        lease = Lease(name, item, token, attempts)
+
+        if self.done_path(name).exists():
+            # 列出文件后刚好有人完成了它
+            self.release(lease)
+            return None
+        if attempts > state['max_attempts']:
+            reason = f"{reason}，已尝试 {attempts - 1} 次"
+            logger.error(f"放弃处理文件: {item['key']}（{reason}）")
+            self.write_report(lease, state, None, reason, worker,
+                              quarantine={'reason': reason, 'attempts': attempts - 1, 'time': time.time()})
+        return lease
+
+    def lease_data(self, worker: str, token: str, attempts: int, lease_ttl: float) -> Dict[str, Any]:
+        now = time.time()
+        return {'token': token, 'worker': worker, 'host': socket.gethostname(), 'pid': os.getpid(),
+                'renewed': now, 'expires': now + lease_ttl, 'attempts': attempts}
+
+    def read_lease(self, name: str) -> Optional[Dict[str, Any]]:
+        """读取租约；内容还未写完（或写入者已崩溃）时按文件修改时间推算过期时间"""
+        path = self.lease_path(name)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        lease = read_json(path)
+        if lease is None:
+            state = self.read_state()
+            return {'expires': stat.st_mtime + (state['lease_ttl'] if state else LEASE_TTL), 'attempts': 1}
+        return lease
+
+    def renew(self, lease: Lease, worker: str, lease_ttl: float) -> bool:
+        """续约；租约已被回收（不再属于本进程）时返回False
+
+        与 claim_item 回收过期租约的方式相同：先把租约原子地改名移走再核对令牌，
+        移走后其他进程无法再回收它；新内容用 os.link 放回，不会覆盖别人新建的租约。
+        移走期间恰好有人领取该文件时续约失败，本进程放弃该文件，任何时候最多只有
+        一个进程持有有效的租约。正常情况下每个租约时长续约4次。
+        """
+        path = self.lease_path(lease.item_id)
+        moved = path.with_name(f".{path.name}.{uuid.uuid4().hex}.renew")
+        try:
+            os.rename(path, moved)
+        except FileNotFoundError:
+            return False
+        try:
+            current = read_json(moved)
+            if current is None or current.get('token') != lease.token:
+                # 移走的是别人的租约：放回原处
+                try:
+                    os.link(moved, path)
+                except FileExistsError:
+                    pass
+                return False
+            renewed = moved.with_suffix('.tmp')
+            with open(renewed, 'w', encoding='utf-8') as f:
+                json.dump(self.lease_data(worker, lease.token, lease.attempts, lease_ttl), f, ensure_ascii=False)
+            try:
+                os.link(renewed, path)
+            except FileExistsError:
+                # 租约移走期间有人领取了该文件
+                return False
+            finally:
+                renewed.unlink()
+            return True
+        finally:
+            moved.unlink()
+
+    def release(self, lease: Lease):
+        """释放仍属于本进程的租约"""
+        current = self.read_lease(lease.item_id)
+        if current is not None and current.get('token') == lease.token:
+            try:
+                self.lease_path(lease.item_id).unlink()
+            except FileNotFoundError:
+                pass
+
+    def complete(self, lease: Lease, state: Dict[str, Any], result: Optional[Dict[str, Any]],
+                 error: Optional[str], worker: str) -> bool:
+        """提交完成报告并释放租约；租约已被他人回收时丢弃结果并返回False"""
+        current = self.read_lease(lease.item_id)
+        if current is None or current.get('token') != lease.token:
+            return False
+        self.write_report(lease, state, result, error, worker)
+        self.release(lease)
+        return True
+
+    def write_report(self, lease: Lease, state: Dict[str, Any], result: Optional[Dict[str, Any]],
+                     error: Optional[str], worker: str, quarantine: Optional[Dict[str, Any]] = None):
+        if quarantine is not None:
+            profile = FileProfile(lease.item['key'])
+            profile.error = quarantine['reason']
+            result = dict(result or {}, profile=profile.to_dict(), quarantine=quarantine)
+        write_json_atomic(self.done_path(lease.item_id), {
+            'run_id': state['run_id'],
+            'key': lease.item['key'],
+            'worker': worker,
+            'attempts': lease.attempts,
+            'result': result,
+            'error': error
+        })
+
+
+class QueueWorker:
+    """工作进程：循环领取文件，在本机的输入/输出目录（共享目录的挂载点）中处理
+
+    处理参数取自协调进程写入的队列状态，与单机运行完全一致；设置了超时或内存上限时
+    每个文件在受监督的子进程中处理，超限的文件按单机模式的规则重试和隔离。
+    """
+
+    def __init__(self, input_dir: str, output_dir: str, queue_dir: Optional[str] = None,
+                 worker_id: Optional[str] = None, poll_interval: float = 2.0, exit_when_done: bool = False):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.queue = WorkQueue(queue_dir or os.path.join(output_dir, QUEUE_DIR_NAME))
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.exit_when_done = exit_when_done
+        self.stop_event = threading.Event()
+        self.processor: Optional['DocumentProcessor'] = None
+        self.pool = None
+        self.run_id = None
+        self.current = None
+        self.processed = 0
+        self.failed = 0
+
+    def run(self):
+        previous_handler = signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        logger.info(f"工作进程 {self.worker_id} 开始领取任务: {self.queue.root}")
+        try:
+            while not self.stop_event.is_set():
+                state = self.queue.read_state()
+                if state is not None and state['status'] == 'running':
+                    self.prepare(state)
+                    lease = self.queue.claim(self.worker_id, state)
+                    if lease is not None:
+                        self.process(lease, state)
+                        continue
+                elif state is not None and self.exit_when_done:
+                    break
+                self.write_status(state)
+                self.stop_event.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+            self.close_pool()
+            try:
+                (self.queue.workers_dir / f"{self.worker_id}.json").unlink()
+            except FileNotFoundError:
+                pass
+            logger.info(f"工作进程 {self.worker_id} 已停止，共处理 {self.processed} 个文件，失败 {self.failed} 个")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def prepare(self, state: Dict[str, Any]):
+        """新的运行开始时按其参数重建处理器"""
+        if state['run_id'] == self.run_id:
+            return
+        from document_processor import DocumentProcessor
+        self.close_pool()
+        self.processor = DocumentProcessor(self.input_dir, self.output_dir, **state['options'])
+        if self.processor.supervised:
+            self.pool = self.processor.create_worker_pool()
+        self.run_id = state['run_id']
+        logger.info(f"加入运行 {self.run_id}（共 {state['total']} 个文件）")
+
+    def close_pool(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+        if self.processor is not None:
+            self.processor.close()
+
+    def process(self, lease: Lease, state: Dict[str, Any]):
+        if lease.attempts > state['max_attempts']:
+            # claim_item 已写出失败报告
+            self.queue.release(lease)
+            return
+        self.current = lease.item['key']
+        self.write_status(state)
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(lease, state, done), daemon=True)
+        heartbeat.start()
+        try:
+            result, error = self.process_file(Path(self.input_dir) / lease.item['key'])
+        finally:
+            done.set()
+            heartbeat.join()
+            self.current = None
+
+        if not self.queue.complete(lease, state, result, error, self.worker_id):
+            logger.warning(f"租约已被回收，丢弃处理结果: {lease.item['key']}")
+            return
+        if error is None:
+            self.processed += 1
+        else:
+            self.failed += 1
+            logger.error(f"处理文件 {lease.item['key']} 时出错: {error}")
+
+    def process_file(self, file_path: Path) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """处理一个文件，返回可写入完成报告的结果（输出文件只记录文件名）"""
+        processor = self.processor
+        if not file_path.exists():
+            return None, f"工作进程 {self.worker_id} 找不到源文件: {file_path}"
+        if self.pool is not None:
+            from document_processor import _process_in_worker
+            results = self.pool.map(_process_in_worker, [file_path], chunksize=1)
+            _, result, error = next(processor._check_failures([file_path], results))
+        else:
+            _, result, error = processor._process_one(file_path)
+        if result and 'outputs' in result:
+            result['outputs'] = [output.name for output in result['outputs']]
+        return result, error
+
+    def _heartbeat(self, lease: Lease, state: Dict[str, Any], done: threading.Event):
+        """处理期间定期续约和更新心跳状态，直到 done 被设置"""
+        interval = state['lease_ttl'] / 4
+        while not done.wait(interval):
+            if not self.queue.renew(lease, self.worker_id, state['lease_ttl']):
+                logger.warning(f"租约已失效（可能被判定为失联）: {lease.item['key']}")
+                return
+            self.write_status(state)
+
+    def write_status(self, state: Optional[Dict[str, Any]]):
+        write_json_atomic(self.queue.workers_dir / f"{self.worker_id}.json", {
+            'worker': self.worker_id,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'run_id': state['run_id'] if state else None,
+            'current': self.current,
+            'processed': self.processed,
+            'failed': self.failed,
+            'seen': time.time()
+        })
+
+
+def print_status(queue: WorkQueue):
+    """输出队列当前的进度和工作进程"""
+    state = queue.read_state()
+    if state is None:
+        print(f"队列目录中没有运行: {queue.root}")
+        return
+    done = sum(1 for report in (read_json(path) for path in queue.done_dir.glob('*.json'))
+               if report and report.get('run_id') == state['run_id'])
+    leases = len(list(queue.leases_dir.glob('*.lease')))
+    print(f"运行 {state['run_id']}: {state['status']}，已完成 {done}/{state['total']}，处理中 {leases}")
+    for worker in sorted(queue.active_workers(state), key=lambda status: status['worker']):
+        print(f"  {worker['worker']}: 已处理 {worker['processed']}，失败 {worker['failed']}，"
+              f"当前 {worker['current'] or '-'}")
+
+
+def main():
+    """命令行入口：启动工作进程或查看队列状态"""
+    parser = argparse.ArgumentParser(description="分布式处理的工作进程（协调进程见 document_processor.py --queue）")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    work = subparsers.add_parser('work', help="领取并处理队列中的文件")
+    work.add_argument('--input', default="待处理知识库", help="本机上共享输入目录的路径")
+    work.add_argument('--output', default="已处理知识库", help="本机上共享输出目录的路径")
+    work.add_argument('--queue', help="队列目录（默认为输出目录下的 work_queue）")
+    work.add_argument('--worker-id', help="工作进程名称（默认为 主机名-进程号）")
+    work.add_argument('--poll-interval', type=float, default=2.0,
+                      help="没有可领取的文件时再次检查的间隔（秒，默认2）")
+    work.add_argument('--exit-when-done', action='store_true',
+                      help="当前运行结束后退出（默认常驻，等待下一次运行）")
+
+    status = subparsers.add_parser('status', help="查看队列的进度和工作进程")
+    status.add_argument('--output', default="已处理知识库", help="输出目录")
+    status.add_argument('--queue', help="队列目录（默认为输出目录下的 work_queue）")
+
+    args = parser.parse_args()
+    if args.command == 'status':
+        print_status(WorkQueue(args.queue or os.path.join(args.output, QUEUE_DIR_NAME)))
+        return
+    if not os.path.isdir(args.input):
+        logger.error(f"输入目录不存在: {args.input}")
+        sys.exit(1)
+    QueueWorker(args.input, args.output, args.queue, worker_id=args.worker_id,
+                poll_interval=args.poll_interval, exit_when_done=args.exit_when_done).run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()